@@ -0,0 +1,118 @@
+# fake_telegram.py
+# Фейковый Bot API для бенчмарков: принимает те же запросы, что и api.telegram.org,
+# отвечает минимальными валидными объектами и запоминает, что и в какой чат было отправлено.
+import json
+import time
+import asyncio
+import itertools
+from collections import defaultdict
+from typing import Optional
+
+from aiohttp import web
+
+# Методы, которые возвращают Message
+MESSAGE_METHODS = {
+    'sendmessage', 'sendaudio', 'sendvideo', 'sendphoto', 'senddocument', 'sendvoice',
+    'editmessagetext', 'editmessagecaption', 'forwardmessage',
+}
+# Счетчик 'audio' - доставленные треки: sendAudio и каждый аудио-элемент sendMediaGroup
+AUDIO = 'audio'
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, file_path: Optional[str] = None):
+        """
+        Args:
+            latency: Искусственная задержка каждого запроса (RTT до Telegram)
+            file_path: Файл, который отдается на getFile / скачивание
+        """
+        self.latency = latency
+        self.file_path = file_path
+        self.calls: list[tuple[float, str, str]] = []  # (время, метод, chat_id)
+        self.counts: dict[tuple[str, str], int] = defaultdict(int)
+        self._waiters: dict[tuple[str, str], list[tuple[int, asyncio.Future]]] = defaultdict(list)
+        self._message_ids = itertools.count(1000)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application(client_max_size=2 * 1024 ** 3)
+        app.router.add_post('/bot{token}/{method}', self._handle_method)
+        app.router.add_get('/file/bot{token}/{path:.*}', self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def count(self, method: str, chat_id) -> int:
+        return self.counts[(method.lower(), str(chat_id))]
+
+    async def wait_for(self, method: str, chat_id, count: int = 1, timeout: Optional[float] = None):
+        """Ждет, пока в чат уйдет count запросов метода (считая уже отправленные); AUDIO - count треков"""
+        key = (method.lower(), str(chat_id))
+        if self.counts[key] >= count:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key].append((count, future))
+        await asyncio.wait_for(future, timeout)
+
+    def _record(self, method: str, chat_id: str, audio: int = 0):
+        self.calls.append((time.perf_counter(), method, chat_id))
+        self._count(method, chat_id, 1)
+        if audio:
+            self._count(AUDIO, chat_id, audio)
+
+    def _count(self, method: str, chat_id: str, n: int):
+        key = (method, chat_id)
+        self.counts[key] += n
+        waiting = []
+        for count, future in self._waiters[key]:
+            if self.counts[key] >= count:
+                if not future.done():
+                    future.set_result(None)
+            else:
+                waiting.append((count, future))
+        self._waiters[key] = waiting
+
+    def _message(self, chat_id: str, data) -> dict:
+        cid = int(chat_id) if chat_id.lstrip('-').isdigit() else 0
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': cid, 'type': 'private' if cid > 0 else 'supergroup'},
+        }
+        if 'text' in data:
+            message['text'] = data['text']
+        return message
+
+    async def _handle_method(self, request: web.Request):
+        method = request.match_info['method'].lower()
+        data = await request.post()  # читает и файлы, как настоящий сервер
+        chat_id = str(data.get('chat_id', ''))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        media = json.loads(data['media']) if method == 'sendmediagroup' else []
+        audio = 1 if method == 'sendaudio' else sum(1 for item in media if item.get('type') == 'audio')
+        self._record(method, chat_id, audio)
+
+        if method in MESSAGE_METHODS:
+            result = self._message(chat_id, data)
+        elif method == 'sendmediagroup':
+            result = [self._message(chat_id, data) for _ in media]
+        elif method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        elif method == 'getfile':
+            result = {'file_id': data.get('file_id'), 'file_unique_id': 'bench', 'file_path': 'voice/bench.ogg'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _handle_file(self, request: web.Request):
+        if not self.file_path:
+            raise web.HTTPNotFound()
+        return web.FileResponse(self.file_path)
@@ -0,0 +1,54 @@
+# fixtures.py
+# Локальные аудиофайлы для бенчмарков: WAV генерируется модулем wave,
+# MP3 и OGG (голосовое) получаются из него через ffmpeg - тот же, что использует бот.
+import os
+import math
+import wave
+import struct
+import subprocess
+from dataclasses import dataclass
+
+FFMPEG = '/usr/bin/ffmpeg'
+
+
+@dataclass
+class Fixtures:
+    directory: str
+    wav: str    # "исходник" для yt-dlp: качается и конвертируется в mp3
+    mp3: str    # готовый файл для Cobalt и быстрого пути VK
+    voice: str  # голосовое сообщение для распознавания
+
+
+def make_wav(path: str, seconds: float, rate: int = 44100, freq: float = 440.0):
+    """Стерео синус заданной длины (целая частота, поэтому секунду можно просто повторять)"""
+    second = b''.join(
+        struct.pack('<hh', s, s)
+        for s in (int(12000 * math.sin(2 * math.pi * freq * i / rate)) for i in range(rate))
+    )
+    whole, rest = divmod(seconds, 1)
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        for _ in range(int(whole)):
+            w.writeframes(second)
+        w.writeframes(second[:int(rest * rate) * 4])
+
+
+def _ffmpeg(*args):
+    subprocess.run([FFMPEG, '-y', '-loglevel', 'error', *args], check=True)
+
+
+def prepare_fixtures(directory: str, track_seconds: float = 180) -> Fixtures:
+    """Создает фикстуры один раз, повторные запуски используют готовые файлы"""
+    os.makedirs(directory, exist_ok=True)
+    wav = os.path.join(directory, f'track_{int(track_seconds)}s.wav')
+    mp3 = os.path.join(directory, f'track_{int(track_seconds)}s.mp3')
+    voice = os.path.join(directory, 'voice.ogg')
+    if not os.path.exists(wav):
+        make_wav(wav, track_seconds)
+    if not os.path.exists(mp3):
+        _ffmpeg('-i', wav, '-codec:a', 'libmp3lame', '-b:a', '192k', mp3)
+    if not os.path.exists(voice):
+        _ffmpeg('-i', wav, '-t', '10', '-ac', '1', '-codec:a', 'libopus', voice)
+    return Fixtures(directory, wav, mp3, voice)
@@ -0,0 +1,263 @@
+# run.py
+# Офлайн бенчмарк пайплайна поиска и скачивания.
+#
+#   python -m benchmarks.run --scenarios all --concurrency 4 --output results.json
+#   python -m benchmarks.run --scenarios single,playlist --baseline results.json
+#
+# Бот работает как есть (хендлеры, очереди, outbound планировщик, yt-dlp + ffmpeg), внешние
+# сервисы заменены локальными: фейковый Bot API, HTTP сервер с фикстурами и Cobalt API,
+# заглушки VK / SoundCloud / Shazam / текстов. Нужен ffmpeg в /usr/bin/ffmpeg, как и самому боту.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import itertools
+from dataclasses import dataclass, field
+
+from benchmarks.fixtures import prepare_fixtures
+from benchmarks.fake_telegram import FakeTelegram, AUDIO
+from benchmarks.stubs import MediaServer, StubLatency, patch_imports, install_stubs
+
+SCENARIOS = ('search', 'single', 'playlist', 'recognition', 'cobalt')
+
+
+@dataclass
+class Context:
+    telegram: FakeTelegram
+    media: MediaServer
+    bot: object
+    dp: object
+    timeout: float
+    playlist_size: int
+    _chat_ids: itertools.count = field(default_factory=lambda: itertools.count(100000))
+
+    def new_chat(self) -> int:
+        return next(self._chat_ids)
+
+    def message(self, chat_id: int, **content) -> dict:
+        return {
+            'message_id': 1,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench', 'username': f'bench{chat_id}'},
+            **content,
+        }
+
+    async def feed(self, **update):
+        from aiogram import types
+        payload = {'update_id': self.new_chat(), **update}
+        await self.dp.feed_update(self.bot, types.Update.model_validate(payload, context={'bot': self.bot}))
+
+
+# --- Сценарии: одна функция - один запрос пользователя ---
+
+async def run_search(ctx: Context):
+    chat_id = ctx.new_chat()
+    await ctx.feed(message=ctx.message(chat_id, text=f'bench query {chat_id}'))
+    if not ctx.telegram.count('editMessageText', chat_id):
+        raise RuntimeError('search results were not sent')
+
+
+async def run_single(ctx: Context):
+    from src.core.state import search_results
+    from src.handlers.keyboard import new_search_id, make_token, TRACK_TOKEN
+    chat_id = ctx.new_chat()
+    sid = await new_search_id()
+    search_results[sid] = [{
+        'title': f'Bench Track {chat_id}', 'channel': 'Bench Artist', 'duration': 180,
+        'url': ctx.media.track_url(f'single_{chat_id}'), 'source': 'soundcloud',
+    }]
+    await ctx.feed(callback_query={
+        'id': str(chat_id), 'chat_instance': 'bench', 'data': make_token(TRACK_TOKEN, sid, 0),
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench'},
+        'message': ctx.message(chat_id, text='results'),
+    })
+    await ctx.telegram.wait_for(AUDIO, chat_id, 1, timeout=ctx.timeout)
+
+
+async def run_playlist(ctx: Context):
+    chat_id = ctx.new_chat()
+    await ctx.feed(message=ctx.message(chat_id, text=f'https://vk.com/music/playlist/1_{chat_id}_bench'))
+    # Плейлист уходит альбомами sendMediaGroup; считаем треки, а не запросы
+    await ctx.telegram.wait_for(AUDIO, chat_id, ctx.playlist_size, timeout=ctx.timeout)
+
+
+async def run_recognition(ctx: Context):
+    chat_id = ctx.new_chat()
+    await ctx.feed(message=ctx.message(chat_id, voice={'file_id': f'voice{chat_id}', 'file_unique_id': f'v{chat_id}', 'duration': 10}))
+    if not ctx.telegram.count(AUDIO, chat_id):
+        raise RuntimeError('recognized track was not sent')
+
+
+async def run_cobalt(ctx: Context):
+    chat_id = ctx.new_chat()
+    await ctx.feed(message=ctx.message(chat_id, text=ctx.media.page_url(f'video_{chat_id}')))
+    await ctx.telegram.wait_for(AUDIO, chat_id, 1, timeout=ctx.timeout)
+
+
+RUNNERS = {
+    'search': run_search,
+    'single': run_single,
+    'playlist': run_playlist,
+    'recognition': run_recognition,
+    'cobalt': run_cobalt,
+}
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def run_scenario(ctx: Context, name: str, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await RUNNERS[name](ctx)
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(f'{type(e).__name__}: {e}')
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'wall_seconds': round(wall, 3),
+        'throughput_per_s': round(len(latencies) / wall, 3) if wall else 0.0,
+        'latency_seconds': {
+            'mean': round(statistics.fmean(latencies), 3) if latencies else 0.0,
+            'p50': round(_percentile(latencies, 0.5), 3),
+            'p90': round(_percentile(latencies, 0.9), 3),
+            'p99': round(_percentile(latencies, 0.99), 3),
+            'max': round(max(latencies), 3) if latencies else 0.0,
+        },
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return ''
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """Таблица изменений относительно сохраненного прогона"""
+    lines = [f"{'scenario':<12} {'p50':>16} {'p90':>16} {'throughput':>18}"]
+    for name, current in results['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        def cell(cur, old):
+            delta = (cur - old) / old * 100 if old else 0.0
+            return f'{cur:.2f} ({delta:+.0f}%)'
+        lines.append(
+            f"{name:<12} {cell(current['latency_seconds']['p50'], base['latency_seconds']['p50']):>16} "
+            f"{cell(current['latency_seconds']['p90'], base['latency_seconds']['p90']):>16} "
+            f"{cell(current['throughput_per_s'], base['throughput_per_s']):>18}"
+        )
+    return '\n'.join(lines)
+
+
+async def main(args) -> dict:
+    fixtures = prepare_fixtures(args.fixtures_dir, args.track_seconds)
+    latency = StubLatency(args.search_latency, args.cobalt_latency, args.recognition_latency, args.lyrics_latency)
+
+    telegram = FakeTelegram(latency=args.telegram_latency, file_path=fixtures.voice)
+    media = MediaServer(fixtures, latency)
+    telegram_url = await telegram.start()
+    media_url = await media.start()
+
+    # Окружение должно быть готово до импорта модулей бота
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCHMARK',
+        'TELEGRAM_API_URL': telegram_url,
+        'COBALT_API_URL': media_url,
+        'LOG_GROUP_ID': '',
+        'TRACE_LOG_PATH': '',
+    })
+    patch_imports()
+    from src.core.bot_instance import bot, dp
+    import src.handlers  # noqa: F401
+    from src.core.outbound import outbound
+    from src.logger.group_logger import log_sink
+    install_stubs(media, latency, args.playlist_size)
+
+    ctx = Context(telegram, media, bot, dp, args.timeout, args.playlist_size)
+    scenarios = SCENARIOS if args.scenarios == 'all' else tuple(s.strip() for s in args.scenarios.split(','))
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        'scenarios': {},
+    }
+    try:
+        for name in scenarios:
+            if name not in RUNNERS:
+                raise SystemExit(f'unknown scenario {name}, expected one of {", ".join(SCENARIOS)}')
+            requests = args.playlists if name == 'playlist' else args.requests
+            print(f'[bench] {name}: {requests} requests, concurrency {args.concurrency}', file=sys.stderr)
+            results['scenarios'][name] = await run_scenario(ctx, name, requests, args.concurrency)
+    finally:
+        await outbound.stop()
+        await log_sink.stop()
+        await bot.session.close()
+        await media.stop()
+        await telegram.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of the search and download pipeline')
+    parser.add_argument('--scenarios', default='all', help=f'comma separated: {",".join(SCENARIOS)} or all')
+    parser.add_argument('--requests', type=int, default=20, help='requests per scenario')
+    parser.add_argument('--playlists', type=int, default=1, help='playlists in the playlist scenario')
+    parser.add_argument('--playlist-size', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for a single request')
+    parser.add_argument('--track-seconds', type=float, default=180, help='length of the fixture track')
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'musicbot_bench_fixtures'))
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--search-latency', type=float, default=0.3)
+    parser.add_argument('--cobalt-latency', type=float, default=0.1)
+    parser.add_argument('--recognition-latency', type=float, default=0.5)
+    parser.add_argument('--lyrics-latency', type=float, default=0.2)
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='previous JSON results to compare against')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = asyncio.run(main(args))
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            print(compare(results, json.load(f)), file=sys.stderr)
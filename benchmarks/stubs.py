@@ -0,0 +1,185 @@
+# stubs.py
+# Заглушки внешних сервисов для офлайн бенчмарков:
+#  - HTTP сервер с медиафайлами и Cobalt API (настоящие HTTP запросы, настоящий yt-dlp и ffmpeg)
+#  - VK сервис, поиск SoundCloud, Shazam и провайдеры текстов подменяются в процессе.
+# Задержки заглушек блокирующие там, где блокирует настоящая библиотека.
+import time
+import uuid
+import shutil
+import asyncio
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Optional
+
+from aiohttp import web
+
+from benchmarks.fixtures import Fixtures
+
+
+@dataclass
+class StubLatency:
+    search: float = 0.3       # ответ VK / SoundCloud на поиск
+    cobalt: float = 0.1       # ответ Cobalt API
+    recognition: float = 0.5  # Shazam
+    lyrics: float = 0.2       # провайдер текстов
+
+
+class MediaServer:
+    """Отдает фикстуры как "удаленные" треки и эмулирует Cobalt API"""
+
+    def __init__(self, fixtures: Fixtures, latency: StubLatency):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.base_url = ''
+        self.cobalt_requests = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get('/audio/{name}', self._handle_wav)
+        app.router.add_get('/mp3/{name}', self._handle_mp3)
+        app.router.add_get('/page/{name}', self._handle_page)
+        app.router.add_post('/', self._handle_cobalt)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return self.base_url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def track_url(self, name: str) -> str:
+        return f'{self.base_url}/audio/{name}.wav'
+
+    def page_url(self, name: str) -> str:
+        return f'{self.base_url}/page/{name}'
+
+    async def _handle_wav(self, request):
+        return web.FileResponse(self.fixtures.wav, headers={'Content-Type': 'audio/wav'})
+
+    async def _handle_mp3(self, request):
+        return web.FileResponse(self.fixtures.mp3, headers={'Content-Type': 'audio/mpeg'})
+
+    async def _handle_page(self, request):
+        return web.Response(text='<html><body>bench</body></html>', content_type='text/html')
+
+    async def _handle_cobalt(self, request):
+        payload = await request.json()
+        self.cobalt_requests += 1
+        if self.latency.cobalt:
+            await asyncio.sleep(self.latency.cobalt)
+        if not payload.get('url'):
+            return web.json_response({'status': 'error', 'error': {'code': 'error.api.link.missing'}})
+        name = uuid.uuid4().hex
+        return web.json_response({'status': 'tunnel', 'url': f'{self.base_url}/mp3/{name}.mp3', 'filename': f'bench_{name}.mp3'})
+
+
+@dataclass
+class FakeSong:
+    title: str
+    artist: str
+    duration: int
+    url: str
+    track_id: int
+    owner_id: int = 1
+
+
+class FakeVkService:
+    """Тот же интерфейс, что у vkpymusic.Service, без сети"""
+
+    def __init__(self, media: MediaServer, latency: StubLatency, playlist_size: int):
+        self.media = media
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self._ids = iter(range(1, 10 ** 9))
+
+    def _songs(self, prefix: str, count: int) -> list[FakeSong]:
+        songs = []
+        for i in range(count):
+            track_id = next(self._ids)
+            songs.append(FakeSong(f'{prefix} {i}', 'Bench Artist', 180, self.media.track_url(f'vk_{track_id}'), track_id))
+        return songs
+
+    def search_songs_by_text(self, text, count=50, offset=0):
+        time.sleep(self.latency.search)
+        return self._songs(text, count)
+
+    def get_songs_by_playlist_id(self, owner_id, playlist_id, access_key=None, count=100, offset=0):
+        time.sleep(self.latency.search)
+        return self._songs(f'playlist {playlist_id}', min(count, self.playlist_size))
+
+    def save_music(self, track, filepath):
+        shutil.copyfile(self.media.fixtures.mp3, filepath)
+        return filepath
+
+
+class FakeSearchYoutubeDL:
+    """yt-dlp для scsearch: возвращает плоский список записей"""
+    media: MediaServer = None
+    latency: StubLatency = None
+
+    def __init__(self, opts=None):
+        self.opts = opts or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def extract_info(self, query, download=False):
+        time.sleep(self.latency.search)
+        spec, _, text = query.partition(':')
+        count = int(spec.replace('scsearch', '') or 1)
+        return {'entries': [
+            {
+                'title': f'Bench Artist - {text} {i}',
+                'uploader': 'bench',
+                'duration': 180,
+                'webpage_url': self.media.track_url(f'sc_{uuid.uuid4().hex}'),
+            }
+            for i in range(count)
+        ]}
+
+
+def patch_imports():
+    """Вызывается до импорта src: клиент MusixMatch ходит в сеть прямо в конструкторе"""
+    import musicxmatch_api
+    musicxmatch_api.MusixMatchAPI.get_secret = lambda self: ''
+
+
+def install_stubs(media: MediaServer, latency: StubLatency, playlist_size: int) -> FakeVkService:
+    """Подменяет внешние сервисы в уже импортированных модулях бота"""
+    import src.search.search as search
+    import src.search.vk_music as vk_music
+    import src.download.media_downloader as media_downloader
+    import src.recognition.music_recognition as recognition
+
+    vk = FakeVkService(media, latency, playlist_size)
+    vk_music.get_vk_service = lambda: vk
+    search.get_vk_service = lambda: vk
+    FakeSearchYoutubeDL.media = media
+    FakeSearchYoutubeDL.latency = latency
+    search.yt_dlp = SimpleNamespace(YoutubeDL=FakeSearchYoutubeDL)
+    media_downloader.get_playlist_tracks = vk_music.get_playlist_tracks
+
+    async def recognize(path):
+        await asyncio.sleep(latency.recognition)
+        return {'track': {'title': 'Recognized Song', 'subtitle': 'Bench Artist'}}
+    recognition.shazam.recognize = recognize
+
+    async def lyrics(artist, title):
+        await asyncio.sleep(latency.lyrics)
+        return f'{artist} - {title}\nla la la'
+
+    async def no_lyrics(artist, title):
+        return None
+
+    recognition.search_genius = lyrics
+    recognition.search_yandex_music = no_lyrics
+    recognition.search_musicxmatch = no_lyrics
+    return vk
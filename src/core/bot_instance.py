@@ -3,8 +3,11 @@ import os
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 from aiogram import Bot, Dispatcher
-from src.core.config import BOT_TOKEN
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from src.core.config import BOT_TOKEN, TELEGRAM_API_URL
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
 dp = Dispatcher() 
\ No newline at end of file
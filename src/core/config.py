@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -46,4 +47,95 @@ LOG_GROUP_ID = os.getenv('LOG_GROUP_ID')
 DEEPGRAM_API_KEY = os.getenv('DEEPGRAM_API_KEY')
 
 WEB_APP_URL = os.getenv('WEB_APP_URL')
-PORT = int(os.getenv('PORT', 8080)) # Default to 8080 if not set
\ No newline at end of file
+PORT = int(os.getenv('PORT', 8080)) # Default to 8080 if not set
+
+# Telethon агент для отправки больших файлов (через MTProto, без лимита Bot API)
+API_ID = os.getenv('API_ID')
+API_HASH = os.getenv('API_HASH')
+STRING_SESSION = os.getenv('STRING_SESSION')
+TELETHON_BOT_USERNAME = os.getenv('TELETHON_BOT_USERNAME') # username бота, куда агент отправляет файлы
+TELETHON_UPLOAD_PARALLELISM = int(os.getenv('TELETHON_UPLOAD_PARALLELISM', 2)) # одновременных загрузок через агента
+# Параллельная загрузка частями: соединений на один файл, размер части и повторы упавших частей
+TELETHON_UPLOAD_CONNECTIONS = int(os.getenv('TELETHON_UPLOAD_CONNECTIONS', 4))
+TELETHON_UPLOAD_PART_SIZE_KB = int(os.getenv('TELETHON_UPLOAD_PART_SIZE_KB', 512))
+TELETHON_UPLOAD_PART_RETRIES = int(os.getenv('TELETHON_UPLOAD_PART_RETRIES', 5))
+TELETHON_FAST_UPLOAD_MIN_MB = int(os.getenv('TELETHON_FAST_UPLOAD_MIN_MB', 20)) # файлы меньше грузятся обычным send_file
+TELETHON_HANDOFF_TIMEOUT = int(os.getenv('TELETHON_HANDOFF_TIMEOUT', 120)) # сколько ждать, пока бот получит файл от агента
+
+# Очередь логов для группы: размер и интервал склейки событий в одно сообщение (сек)
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 1000))
+LOG_BATCH_INTERVAL = float(os.getenv('LOG_BATCH_INTERVAL', 3))
+
+# Лимиты исходящих запросов к Bot API (запросов в секунду)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 25))
+OUTBOUND_PRIVATE_RATE = float(os.getenv('OUTBOUND_PRIVATE_RATE', 1))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60)) # 20 сообщений в минуту на группу
+OUTBOUND_MAX_INFLIGHT = int(os.getenv('OUTBOUND_MAX_INFLIGHT', 16))
+
+# Порт HTTP эндпоинта /metrics (Prometheus)
+METRICS_PORT = int(os.getenv('METRICS_PORT', PORT + 1))
+
+# Трассировка запросов: файл для JSON-строк (пусто - не писать) и сколько последних запросов держать для /slow
+TRACE_LOG_PATH = os.getenv('TRACE_LOG_PATH', '')
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 500))
+
+# Адрес Bot API (пусто - api.telegram.org). Нужен для локального telegram-bot-api и офлайн бенчмарков
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# Основной Cobalt API, резервные зеркала перебираются после него
+COBALT_API_URL = os.getenv('COBALT_API_URL', 'https://co.itsv1eds.ru')
+
+# Спекулятивная предзагрузка первых результатов поиска (по умолчанию выключена)
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '0').lower() in ('1', 'true', 'yes')
+PREFETCH_TOP_N = int(os.getenv('PREFETCH_TOP_N', 3))
+PREFETCH_MAX_ACTIVE = int(os.getenv('PREFETCH_MAX_ACTIVE', 2))  # на весь процесс
+PREFETCH_TTL = int(os.getenv('PREFETCH_TTL', 600))  # секунд считать предзагрузку "своей" для статистики попаданий
+PREFETCH_MAX_LOAD = float(os.getenv('PREFETCH_MAX_LOAD', 0.75))  # loadavg / число ядер
+
+# Общий кэш готовых MP3 (0 МБ - выключен)
+AUDIO_CACHE_DIR = os.getenv('AUDIO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'musicbot_audio_cache'))
+AUDIO_CACHE_MB = int(os.getenv('AUDIO_CACHE_MB', 2048))
+
+# Кэш результатов поиска: сколько секунд держать и сколько запросов помнить
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 120))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 500))
+# Живые сессии поиска (догрузка страниц): сколько секунд с последнего листания и сколько всего держать
+SEARCH_SESSION_TTL = int(os.getenv('SEARCH_SESSION_TTL', 600))
+SEARCH_SESSION_MAX = int(os.getenv('SEARCH_SESSION_MAX', 1000))
+
+# Общее состояние воркеров: пусто - словари процесса, redis://host:6379/0 - сервер Redis
+STATE_BACKEND_URL = os.getenv('STATE_BACKEND_URL', '')
+STATE_TTL = int(os.getenv('STATE_TTL', 86400))  # секунд хранить результаты поиска и плейлисты в Redis
+
+# Процессы-воркеры для yt-dlp, ffmpeg и тегов: сколько на ядро (0 - в потоках процесса бота,
+# тогда отмена не останавливает уже запущенный ffmpeg)
+DOWNLOAD_WORKERS_PER_CPU = float(os.getenv('DOWNLOAD_WORKERS_PER_CPU', 1))
+
+# Пулы потоков по классам нагрузки (см. executors.py)
+EXECUTOR_EXTRACT_THREADS = int(os.getenv('EXECUTOR_EXTRACT_THREADS', 16))  # сеть: поиск, extract_info, плейлисты
+EXECUTOR_TRANSCODE_THREADS = int(os.getenv('EXECUTOR_TRANSCODE_THREADS', max(2, os.cpu_count() or 1)))  # yt-dlp + ffmpeg
+EXECUTOR_METADATA_THREADS = int(os.getenv('EXECUTOR_METADATA_THREADS', 8))  # тексты песен, файлы аудиокэша
+
+# Прогресс загрузки в статусном сообщении: не чаще одной правки за столько секунд
+PROGRESS_EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', 3))
+
+# Политика перекодирования (transcode_policy.py): кодек и потолок битрейта по типу чата и загрузке
+TRANSCODE_CODEC = os.getenv('TRANSCODE_CODEC', 'mp3')  # mp3 | opus (Telegram проигрывает как аудио только MP3 и M4A)
+TRANSCODE_BITRATE_PRIVATE = int(os.getenv('TRANSCODE_BITRATE_PRIVATE', 192))  # kbit/s, 320 - максимум
+TRANSCODE_BITRATE_GROUP = int(os.getenv('TRANSCODE_BITRATE_GROUP', 128))
+TRANSCODE_BUSY_LOAD = float(os.getenv('TRANSCODE_BUSY_LOAD', 1))  # заданий на слот воркеров, с которых битрейт снижается
+TRANSCODE_BUSY_BITRATE = int(os.getenv('TRANSCODE_BUSY_BITRATE', 128))
+TRANSCODE_PEAK_LOAD = float(os.getenv('TRANSCODE_PEAK_LOAD', 3))
+TRANSCODE_REMUX_AAC = os.getenv('TRANSCODE_REMUX_AAC', 'peak')  # never | peak | always: AAC в M4A без ffmpeg-кодирования
+
+# Теги (название, исполнитель) пишет ffmpeg при перекодировании, без отдельной перезаписи файла
+TAGS_IN_FFMPEG = os.getenv('TAGS_IN_FFMPEG', '1').lower() in ('1', 'true', 'yes')
+
+# Обложки (cover_art.py): кэш в памяти, общий для треков одного альбома, и таймаут загрузки картинки
+COVER_ART_ENABLED = os.getenv('COVER_ART_ENABLED', '1').lower() in ('1', 'true', 'yes')
+COVER_CACHE_MB = int(os.getenv('COVER_CACHE_MB', 64))
+COVER_FETCH_TIMEOUT = float(os.getenv('COVER_FETCH_TIMEOUT', 10))
+
+# Плейлисты уходят альбомами sendMediaGroup (до 10 треков): сколько МБ максимум в одном альбоме
+# и сколько секунд ждать ответа на загрузку альбома (обычный таймаут сессии рассчитан на один файл)
+MEDIA_GROUP_MAX_MB = int(os.getenv('MEDIA_GROUP_MAX_MB', 50))
+MEDIA_GROUP_TIMEOUT = int(os.getenv('MEDIA_GROUP_TIMEOUT', 300))
@@ -0,0 +1,77 @@
+# executors.py
+# Именованные пулы потоков вместо общего executor'а loop'а. Раньше загрузки, поиск, пробы
+# плейлистов и тексты песен делили один ThreadPoolExecutor неизвестного размера, и пачка
+# медленных загрузок оставляла тексты и плейлисты ждать свободный поток. Теперь у каждого
+# класса нагрузки свой пул со своим размером:
+#   extract   - сетевые запросы yt-dlp / VK: поиск, extract_info, состав плейлистов, VK-загрузки
+#   transcode - yt-dlp + ffmpeg, если не включены процессы-воркеры (download_workers.py)
+#   metadata  - тексты песен и файловые операции аудиокэша
+# По каждому пулу видны занятые потоки, очередь и время ожидания свободного потока.
+import time
+import asyncio
+import threading
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from src.core.config import EXECUTOR_EXTRACT_THREADS, EXECUTOR_TRANSCODE_THREADS, EXECUTOR_METADATA_THREADS
+from src.monitoring.metrics import EXECUTOR_THREADS, EXECUTOR_QUEUED, EXECUTOR_WAIT
+
+
+class NamedExecutor:
+    """Пул потоков одного класса нагрузки с метриками"""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+        self.busy = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(size, thread_name_prefix=f"{name}_executor")
+        EXECUTOR_THREADS.set_function(lambda: self.busy, pool=name, state='busy')
+        EXECUTOR_THREADS.set_function(lambda: self.size, pool=name, state='total')
+        EXECUTOR_QUEUED.set_function(lambda: self.queued, pool=name)
+
+    def _dequeue(self, job_state: list) -> None:
+        # Задание покидает очередь один раз: либо поток его взял, либо его отменили до старта
+        if not job_state[0]:
+            job_state[0] = True
+            self.queued -= 1
+
+    def _job(self, submitted: float, job_state: list, context: contextvars.Context, fn, args, kwargs):
+        EXECUTOR_WAIT.observe(time.perf_counter() - submitted, pool=self.name)
+        with self._lock:
+            self._dequeue(job_state)
+            self.busy += 1
+        try:
+            return context.run(fn, *args, **kwargs)
+        finally:
+            with self._lock:
+                self.busy -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Как asyncio.to_thread, только в этом пуле: contextvars (trace запроса) видны в потоке"""
+        job_state = [False]  # взято потоком или отменено
+        with self._lock:
+            self.queued += 1
+        job = functools.partial(self._job, time.perf_counter(), job_state, contextvars.copy_context(), fn, args, kwargs)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, job)
+        finally:
+            with self._lock:
+                self._dequeue(job_state)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+extract_executor = NamedExecutor('extract', EXECUTOR_EXTRACT_THREADS)
+transcode_executor = NamedExecutor('transcode', EXECUTOR_TRANSCODE_THREADS)
+metadata_executor = NamedExecutor('metadata', EXECUTOR_METADATA_THREADS)
+
+EXECUTORS = (extract_executor, transcode_executor, metadata_executor)
+
+
+def shutdown_executors():
+    for executor in EXECUTORS:
+        executor.shutdown()
@@ -2,16 +2,53 @@ import asyncio
 from src.core.bot_instance import bot, dp
 import src.handlers # register handlers # noqa: F401
 from src.core.config import BOT_TOKEN
+from src.core.state import download_queues, download_tasks, state_backend
+from src.upload.telethon_uploader import telethon_uploader
+from src.logger.group_logger import log_sink
+from src.core.outbound import outbound
+from src.download.prefetch import prefetcher
+from src.download.audio_cache import audio_cache
+from src.download.cover_art import cover_art
+from src.download.track_downloader import track_flights
+from src.download.download_workers import download_workers
+from src.core.executors import shutdown_executors
+from src.monitoring.metrics import QUEUE_DEPTH, CACHE_BYTES, start_metrics_server
 import logging
 
 # Configure logging (similar to mainexample.py)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def register_queue_gauges():
+    QUEUE_DEPTH.set_function(lambda: sum(len(q) for q in download_queues.values()), queue='downloads_queued')
+    QUEUE_DEPTH.set_function(lambda: sum(len(t) for t in download_tasks.values()), queue='downloads_active')
+    QUEUE_DEPTH.set_function(lambda: outbound.queue_depth, queue='outbound')
+    QUEUE_DEPTH.set_function(lambda: telethon_uploader.queue_size, queue='telethon_uploads')
+    QUEUE_DEPTH.set_function(lambda: log_sink.queue_size, queue='admin_log')
+    QUEUE_DEPTH.set_function(lambda: prefetcher.active, queue='prefetch')
+    QUEUE_DEPTH.set_function(lambda: track_flights.active, queue='shared_downloads')
+    QUEUE_DEPTH.set_function(lambda: download_workers.pending, queue='download_workers')
+    CACHE_BYTES.set_function(lambda: audio_cache.size, cache='audio')
+    CACHE_BYTES.set_function(lambda: cover_art.size, cache='cover')
+
 async def main():
+    register_queue_gauges()
+    metrics_runner = await start_metrics_server()
+    await download_workers.start()
     await bot.delete_webhook(drop_pending_updates=True)
     logger.info("Starting bot in polling mode...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await telethon_uploader.stop()
+        await log_sink.stop()
+        await outbound.stop()
+        await state_backend.close()
+        await cover_art.close()
+        download_workers.shutdown()
+        shutdown_executors()
+        if metrics_runner:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
@@ -0,0 +1,238 @@
+# outbound.py
+# Центральный планировщик исходящих запросов к Bot API.
+# Ограничивает частоту запросов глобально и на каждый чат, склеивает правки одного
+# сообщения (остается только последний текст), учитывает retry_after от Telegram
+# и пропускает отправку файлов вперед косметических правок статуса.
+import time
+import asyncio
+import logging
+import itertools
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Awaitable, Any
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramBadRequest
+
+from src.core.bot_instance import bot
+from src.core.config import OUTBOUND_GLOBAL_RATE, OUTBOUND_PRIVATE_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_MAX_INFLIGHT
+from src.monitoring.metrics import SCHEDULER_WAIT, UPLOAD_SECONDS, UPLOAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - важнее
+PRIORITY_UPLOAD = 0
+PRIORITY_MESSAGE = 1
+PRIORITY_EDIT = 2
+PRIORITY_NAMES = {PRIORITY_UPLOAD: 'upload', PRIORITY_MESSAGE: 'message', PRIORITY_EDIT: 'edit'}
+
+
+class TokenBucket:
+    """Простой token bucket: rate токенов в секунду, не больше burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # retry_after от Telegram
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд можно будет взять токен"""
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass
+class _Job:
+    priority: int
+    seq: int
+    chat_id: int | str
+    factory: Optional[Callable[[], Awaitable[Any]]] = None
+    future: Optional[asyncio.Future] = None
+    edit_key: Optional[tuple] = None  # (chat_id, message_id) для склеиваемых правок
+    upload_bytes: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class OutboundScheduler:
+    """
+    Очередь исходящих запросов с учетом лимитов Telegram.
+
+    edit_text() ставит правку и сразу возвращается (повторные правки того же сообщения
+    заменяют текст в очереди), send() ждет результата запроса.
+    """
+
+    def __init__(self, bot: Bot,
+                 global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 private_rate: float = OUTBOUND_PRIVATE_RATE,
+                 group_rate: float = OUTBOUND_GROUP_RATE,
+                 max_inflight: int = OUTBOUND_MAX_INFLIGHT):
+        self.bot = bot
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_inflight = max_inflight
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._pending: list[_Job] = []
+        self._edits: dict[tuple, tuple[str, dict]] = {}  # последний текст правки
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        b = self._chats.get(chat_id)
+        if b is None:
+            # Отрицательные id - группы и каналы, для них лимит Telegram жестче
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.private_rate
+            b = self._chats[chat_id] = TokenBucket(rate, 3)
+        return b
+
+    def _ensure_running(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _push(self, job: _Job):
+        self._ensure_running()
+        self._pending.append(job)
+        self._wakeup.set()
+
+    def edit_text(self, text: str, chat_id: int | str, message_id: int, **kwargs):
+        """Ставит правку текста сообщения. Не ждет отправки, ошибки правок только логируются."""
+        key = (chat_id, message_id)
+        queued = key in self._edits
+        self._edits[key] = (text, kwargs)
+        if not queued:
+            self._push(_Job(PRIORITY_EDIT, next(self._seq), chat_id, edit_key=key))
+
+    def discard_edits(self, chat_id: int | str, message_id: int):
+        """Отменяет ожидающую правку (например, перед удалением сообщения)"""
+        self._edits.pop((chat_id, message_id), None)
+
+    async def send(self, chat_id: int | str, factory: Callable[[], Awaitable[Any]],
+                   priority: int = PRIORITY_UPLOAD, upload_bytes: int = 0) -> Any:
+        """
+        Выполняет запрос factory() с учетом лимитов и возвращает его результат.
+
+        Args:
+            chat_id: Чат, в который идет запрос (для лимита на чат)
+            factory: Функция без аргументов, создающая корутину запроса
+            priority: PRIORITY_UPLOAD / PRIORITY_MESSAGE / PRIORITY_EDIT
+            upload_bytes: Размер отправляемого файла (для метрик загрузки)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._push(_Job(priority, next(self._seq), chat_id, factory=factory, future=future, upload_bytes=upload_bytes))
+        return await future
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+        for job in self._pending:
+            if job.future and not job.future.done():
+                job.future.cancel()
+        self._pending.clear()
+        self._edits.clear()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch_ready()
+            if delay is None:
+                await self._wakeup.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _dispatch_ready(self) -> Optional[float]:
+        """Запускает все задания, которые можно отправить сейчас. Возвращает время до следующей попытки."""
+        now = time.monotonic()
+        next_delay = None
+        self._pending.sort(key=lambda j: (j.priority, j.seq))
+        remaining = []
+        for job in self._pending:
+            if job.edit_key is not None and job.edit_key not in self._edits:
+                continue  # правку отменили
+            if self._inflight >= self.max_inflight:
+                remaining.append(job)
+                continue
+            wait = max(self._global.wait_time(now), self._bucket(job.chat_id).wait_time(now))
+            if wait > 0:
+                remaining.append(job)
+                next_delay = wait if next_delay is None else min(next_delay, wait)
+                continue
+            self._global.take()
+            self._bucket(job.chat_id).take()
+            self._inflight += 1
+            asyncio.create_task(self._execute(job))
+        self._pending = remaining
+        if remaining and next_delay is None:
+            # Ждем освобождения слотов, _execute разбудит цикл
+            return None
+        return next_delay
+
+    async def _execute(self, job: _Job):
+        SCHEDULER_WAIT.observe(time.monotonic() - job.enqueued_at, priority=PRIORITY_NAMES.get(job.priority, ''))
+        try:
+            if job.edit_key is not None:
+                text, kwargs = self._edits.pop(job.edit_key, (None, None))
+                if text is None:
+                    return
+                chat_id, message_id = job.edit_key
+                try:
+                    await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, **kwargs)
+                except TelegramRetryAfter:
+                    # Возвращаем текст, если за это время не пришел более новый
+                    self._edits.setdefault(job.edit_key, (text, kwargs))
+                    raise
+                except TelegramBadRequest as e:
+                    if "message is not modified" not in str(e):
+                        logger.debug(f"Edit {job.edit_key} failed: {e}")
+                except Exception as e:
+                    logger.warning(f"Edit {job.edit_key} failed: {e}")
+            else:
+                started = time.perf_counter()
+                try:
+                    result = await job.factory()
+                    if job.upload_bytes:
+                        UPLOAD_SECONDS.observe(time.perf_counter() - started, kind='bot_api')
+                        UPLOAD_BYTES.inc(job.upload_bytes, kind='bot_api')
+                except TelegramRetryAfter:
+                    raise
+                except Exception as e:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    if not job.future.done():
+                        job.future.set_result(result)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control in chat {job.chat_id}: retry in {e.retry_after}s")
+            self._bucket(job.chat_id).blocked_until = time.monotonic() + e.retry_after
+            self._pending.append(job)
+        finally:
+            self._inflight -= 1
+            self._wakeup.set()
+
+
+outbound = OutboundScheduler(bot)
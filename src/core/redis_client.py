@@ -0,0 +1,125 @@
+# redis_client.py
+# Минимальный асинхронный клиент Redis (протокол RESP2) для общего состояния воркеров.
+# Пакет redis в зависимости не тянем: нужны только простые команды и WATCH/MULTI/EXEC,
+# а их хватает пары десятков строк поверх asyncio-сокета. Подойдет любой сервер с тем же
+# протоколом (Redis, Valkey, KeyDB, Dragonfly).
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class RedisError(Exception):
+    """Ошибка, которую вернул сервер (-ERR ...)"""
+
+
+def _encode(*args) -> bytes:
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if isinstance(arg, bytes):
+            data = arg
+        elif isinstance(arg, str):
+            data = arg.encode('utf-8')
+        else:
+            data = str(arg).encode('utf-8')
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+class RedisConnection:
+    """Одно соединение: команды по нему идут строго по очереди"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    @property
+    def closed(self) -> bool:
+        return self._writer.is_closing()
+
+    async def execute(self, *args):
+        self._writer.write(_encode(*args))
+        await self._writer.drain()
+        return await self._read()
+
+    async def _read(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("redis connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(body.decode('utf-8'))
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            size = int(body)
+            if size < 0:
+                return None
+            data = await self._reader.readexactly(size + 2)
+            return data[:-2]
+        if kind == b'*':
+            size = int(body)
+            if size < 0:
+                return None
+            return [await self._read() for _ in range(size)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    def close(self):
+        self._writer.close()
+
+
+class RedisClient:
+    """Пул соединений к redis://[:password@]host:port/db"""
+
+    def __init__(self, url: str, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._idle: list[RedisConnection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+
+    async def _connect(self) -> RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        conn = RedisConnection(reader, writer)
+        if self.password:
+            await conn.execute('AUTH', self.password)
+        if self.db:
+            await conn.execute('SELECT', self.db)
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        """Соединение в монопольное пользование (нужно для WATCH/MULTI/EXEC)"""
+        async with self._slots:
+            conn: Optional[RedisConnection] = None
+            while self._idle and conn is None:
+                conn = self._idle.pop()
+                if conn.closed:
+                    conn = None
+            if conn is None:
+                conn = await self._connect()
+            try:
+                yield conn
+            except RedisError:
+                # ответ с ошибкой прочитан целиком, соединение можно переиспользовать
+                self._idle.append(conn)
+                raise
+            except BaseException:
+                # ответ мог остаться непрочитанным - соединение больше не годится
+                conn.close()
+                raise
+            else:
+                self._idle.append(conn)
+
+    async def execute(self, *args):
+        async with self.connection() as conn:
+            return await conn.execute(*args)
+
+    async def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
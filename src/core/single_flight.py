@@ -0,0 +1,92 @@
+# single_flight.py
+# Объединение одинаковых параллельных операций: первый вызов с ключом запускает общую задачу,
+# остальные ждут ее результат. Используется для скачивания треков (одна загрузка на трек на
+# весь процесс) и для поиска (одинаковые запросы, пришедшие пачкой).
+# Отмена одного ждущего не трогает остальных; общая задача отменяется, только когда ушли все.
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from src.monitoring.metrics import SINGLEFLIGHT_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    waiters: int = 0
+    released: bool = False
+
+
+class SingleFlight:
+    """Объединяет параллельные вызовы с одинаковым ключом в одну задачу"""
+
+    def __init__(self, name: str, release: Optional[Callable[[str, Any], None]] = None,
+                 acquire: Optional[Callable[[str, Any], Any]] = None):
+        """
+        Args:
+            name: Имя для метрик
+            release: Вызывается один раз с (ключ, результат), когда результат больше никто не ждет.
+                     Нужен, если результат держит ресурс (например, закрепленный файл в кэше).
+            acquire: Вызывается каждым ждущим с (ключ, результат), пока общий результат еще не
+                     отпущен; do() возвращает то, что вернул acquire (например, свою ссылку на файл).
+        """
+        self.name = name
+        self._release = release
+        self._acquire = acquire
+        self._flights: dict[str, _Flight] = {}
+
+    @property
+    def active(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Возвращает результат factory() для ключа. Если такая задача уже идет - ждет ее,
+        а не запускает вторую. Результат общий для всех ждущих; если задан acquire, каждый
+        ждущий получает acquire(ключ, результат), взятый до того, как общий результат отпущен.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(factory()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finished(key, flight))
+            SINGLEFLIGHT_TOTAL.inc(flight=self.name, role='leader')
+        else:
+            SINGLEFLIGHT_TOTAL.inc(flight=self.name, role='joined')
+
+        flight.waiters += 1
+        try:
+            # shield: отмена этого ждущего не отменяет общую задачу
+            result = await asyncio.shield(flight.task)
+            # Своя ссылка берется здесь, пока waiters > 0: после finally результат может быть уже отпущен
+            return self._acquire(key, result) if self._acquire else result
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0:
+                if flight.task.done():
+                    self._release_result(key, flight)
+                else:
+                    flight.task.cancel()  # ушли все, кто ждал
+
+    def _finished(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if flight.waiters == 0:
+            # все ушли, пока задача доделывалась
+            self._release_result(key, flight)
+
+    def _release_result(self, key: str, flight: _Flight):
+        if flight.released:
+            return
+        flight.released = True
+        task = flight.task
+        # exception() заодно помечает ошибку как полученную, даже если ее уже некому показать
+        if task.cancelled() or task.exception() is not None or self._release is None:
+            return
+        try:
+            self._release(key, task.result())
+        except Exception as e:
+            logger.warning(f"[{self.name}] release of {key} failed: {e}")
@@ -1,12 +1,22 @@
 from collections import defaultdict
 
+from src.core.config import STATE_BACKEND_URL, STATE_TTL
+from src.core.state_backend import create_state_backend
+
 # Global state storage
-# download_tasks: user_id -> {url: asyncio.Task}
+# download_tasks: user_id -> {url: asyncio.Task} (задачи этого процесса)
 # search_results: search_id -> list of track dicts
 # download_queues: user_id -> list of queued items (track_data, playlist_id)
 # playlist_downloads: playlist_id -> playlist tracking info
+# search_results, download_queues и playlist_downloads читаются и пишутся через state_backend:
+# без STATE_BACKEND_URL это сами словари ниже, с ним - общий для всех воркеров Redis
 
 download_tasks = defaultdict(dict)
 search_results = {}
 download_queues = defaultdict(list)
-playlist_downloads = {} 
\ No newline at end of file
+playlist_downloads = {}
+
+state_backend = create_state_backend(
+    STATE_BACKEND_URL, STATE_TTL,
+    search_results=search_results, download_queues=download_queues, playlist_downloads=playlist_downloads,
+)
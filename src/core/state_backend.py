@@ -0,0 +1,320 @@
+# state_backend.py
+# Хранилище общего состояния. Пока все лежало в словарях state.py, бот мог работать только
+# одним процессом: колбэк страницы, пришедший в другой воркер, не находил результатов поиска,
+# а очередь и плейлисты пользователя жили там, где их создали. Теперь эти данные идут через
+# StateBackend:
+#   search_results     - результаты поиска по id (колбэки кнопок может обработать любой воркер)
+#   download_tasks     - заявки (пользователь, url): не дают скачать один трек дважды. Сами
+#                        asyncio.Task остаются в процессе, который качает
+#   download_queues    - очереди загрузок пользователей
+#   playlist_downloads - прогресс плейлистов; изменения атомарны (update_playlist)
+#   agent handoff      - file_id от Telethon агента: его сообщение может прийти в любой воркер,
+#                        а ждет файл тот, кто запустил загрузку (agent_channel.py)
+# MemoryStateBackend - прежние словари одного процесса, RedisStateBackend - общий сервер с
+# протоколом Redis (STATE_BACKEND_URL=redis://host:6379/0). Файлы треков по-прежнему лежат на
+# диске, поэтому воркеры одного плейлиста должны видеть общий tempdir и AUDIO_CACHE_DIR.
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable, Optional, TypeVar
+
+from src.core.redis_client import RedisClient
+
+T = TypeVar('T')
+QueueItem = tuple[dict, Optional[str]]  # (track_data, playlist_id)
+
+CLAIM_TTL = 3600  # секунд: заявки упавшего воркера не блокируют трек навсегда
+
+
+class StateBackend(ABC):
+    """Общее состояние воркеров бота"""
+
+    # search_results
+    @abstractmethod
+    async def save_search(self, search_id: int, tracks: list[dict]): ...
+
+    @abstractmethod
+    async def load_search(self, search_id: int) -> Optional[list[dict]]: ...
+
+    # download_tasks
+    @abstractmethod
+    async def claim_download(self, user_id: int, url: str) -> bool:
+        """False - этот url у пользователя уже качается или ждет в очереди"""
+
+    @abstractmethod
+    async def release_download(self, user_id: int, url: str): ...
+
+    @abstractmethod
+    async def release_downloads(self, user_id: int): ...
+
+    # download_queues
+    @abstractmethod
+    async def enqueue(self, user_id: int, items: list[QueueItem]): ...
+
+    @abstractmethod
+    async def dequeue(self, user_id: int) -> Optional[QueueItem]: ...
+
+    @abstractmethod
+    async def queue_length(self, user_id: int) -> int: ...
+
+    @abstractmethod
+    async def clear_queue(self, user_id: int) -> int:
+        """Очищает очередь, возвращает число выброшенных элементов"""
+
+    # playlist_downloads
+    @abstractmethod
+    async def save_playlist(self, playlist_id: str, entry: dict): ...
+
+    @abstractmethod
+    async def load_playlist(self, playlist_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def update_playlist(self, playlist_id: str, change: Callable[[dict], T]) -> tuple[Optional[dict], Optional[T]]:
+        """Атомарно применяет change(entry); (None, None), если плейлиста нет"""
+
+    @abstractmethod
+    async def pop_playlist(self, playlist_id: str) -> Optional[dict]:
+        """Забирает плейлист; из нескольких одновременных вызовов запись получит только один"""
+
+    @abstractmethod
+    async def user_playlists(self, user_id: int) -> list[str]: ...
+
+    # agent handoff
+    @abstractmethod
+    async def save_agent_user(self, user_id: int): ...
+
+    @abstractmethod
+    async def load_agent_user(self) -> Optional[int]: ...
+
+    @abstractmethod
+    async def publish_handoff(self, job_id: str, result: dict, ttl: int): ...
+
+    @abstractmethod
+    async def take_handoff(self, job_id: str) -> Optional[dict]:
+        """Забирает результат задания агента; из нескольких вызовов его получит только один"""
+
+    async def close(self):
+        pass
+
+
+class MemoryStateBackend(StateBackend):
+    """Словари одного процесса. Записи не копируются: список search_results[sid] - это
+    живой SearchSession.tracks, а плейлисты меняются на месте."""
+
+    def __init__(self, search_results: dict, download_queues: defaultdict, playlist_downloads: dict):
+        self.search_results = search_results
+        self.download_queues = download_queues
+        self.playlist_downloads = playlist_downloads
+        self.claims: defaultdict[int, set] = defaultdict(set)
+        self.agent_user: Optional[int] = None
+        self.handoffs: dict[str, tuple[float, dict]] = {}  # job_id -> (когда истекает, результат)
+
+    async def save_search(self, search_id, tracks):
+        self.search_results[search_id] = tracks
+
+    async def load_search(self, search_id):
+        return self.search_results.get(search_id)
+
+    async def claim_download(self, user_id, url):
+        if url in self.claims[user_id]:
+            return False
+        self.claims[user_id].add(url)
+        return True
+
+    async def release_download(self, user_id, url):
+        urls = self.claims.get(user_id)
+        if urls is not None:
+            urls.discard(url)
+            if not urls:
+                del self.claims[user_id]
+
+    async def release_downloads(self, user_id):
+        self.claims.pop(user_id, None)
+
+    async def enqueue(self, user_id, items):
+        self.download_queues[user_id].extend(items)
+
+    async def dequeue(self, user_id):
+        queue = self.download_queues.get(user_id)
+        if not queue:
+            return None
+        item = queue.pop(0)
+        if not queue:
+            del self.download_queues[user_id]
+        return item
+
+    async def queue_length(self, user_id):
+        return len(self.download_queues.get(user_id, ()))
+
+    async def clear_queue(self, user_id):
+        return len(self.download_queues.pop(user_id, ()))
+
+    async def save_playlist(self, playlist_id, entry):
+        self.playlist_downloads[playlist_id] = entry
+
+    async def load_playlist(self, playlist_id):
+        return self.playlist_downloads.get(playlist_id)
+
+    async def update_playlist(self, playlist_id, change):
+        entry = self.playlist_downloads.get(playlist_id)
+        if entry is None:
+            return None, None
+        return entry, change(entry)
+
+    async def pop_playlist(self, playlist_id):
+        return self.playlist_downloads.pop(playlist_id, None)
+
+    async def user_playlists(self, user_id):
+        return [pid for pid, entry in self.playlist_downloads.items() if entry.get('user_id') == user_id]
+
+    async def save_agent_user(self, user_id):
+        self.agent_user = user_id
+
+    async def load_agent_user(self):
+        return self.agent_user
+
+    async def publish_handoff(self, job_id, result, ttl):
+        # Файл, пришедший после таймаута задания, никто не заберет - такие записи истекают, как в Redis
+        now = time.monotonic()
+        self.handoffs = {j: h for j, h in self.handoffs.items() if h[0] > now}
+        self.handoffs[job_id] = (now + ttl, result)
+
+    async def take_handoff(self, job_id):
+        expires, result = self.handoffs.pop(job_id, (0, None))
+        return result if expires > time.monotonic() else None
+
+
+class RedisStateBackend(StateBackend):
+    """Состояние на сервере Redis; значения хранятся в JSON"""
+
+    def __init__(self, url: str, ttl: int, prefix: str = 'musicbot'):
+        self.redis = RedisClient(url)
+        self.ttl = ttl  # сколько живут результаты поиска и плейлисты
+        self.prefix = prefix
+
+    def _key(self, *parts: Any) -> str:
+        return ':'.join((self.prefix, *map(str, parts)))
+
+    @staticmethod
+    def _dump(value) -> str:
+        return json.dumps(value, ensure_ascii=False)
+
+    async def save_search(self, search_id, tracks):
+        await self.redis.execute('SET', self._key('search', search_id), self._dump(tracks), 'EX', self.ttl)
+
+    async def load_search(self, search_id):
+        raw = await self.redis.execute('GET', self._key('search', search_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def claim_download(self, user_id, url):
+        key = self._key('claims', user_id)
+        added = await self.redis.execute('SADD', key, url)
+        await self.redis.execute('EXPIRE', key, CLAIM_TTL)
+        return added == 1
+
+    async def release_download(self, user_id, url):
+        await self.redis.execute('SREM', self._key('claims', user_id), url)
+
+    async def release_downloads(self, user_id):
+        await self.redis.execute('DEL', self._key('claims', user_id))
+
+    async def enqueue(self, user_id, items):
+        if items:
+            await self.redis.execute('RPUSH', self._key('queue', user_id), *(self._dump(list(item)) for item in items))
+
+    async def dequeue(self, user_id):
+        raw = await self.redis.execute('LPOP', self._key('queue', user_id))
+        if raw is None:
+            return None
+        track_data, playlist_id = json.loads(raw)
+        return track_data, playlist_id
+
+    async def queue_length(self, user_id):
+        return await self.redis.execute('LLEN', self._key('queue', user_id))
+
+    async def clear_queue(self, user_id):
+        key = self._key('queue', user_id)
+        async with self.redis.connection() as conn:
+            await conn.execute('MULTI')
+            await conn.execute('LLEN', key)
+            await conn.execute('DEL', key)
+            length, _ = await conn.execute('EXEC')
+        return length
+
+    async def save_playlist(self, playlist_id, entry):
+        async with self.redis.connection() as conn:
+            await conn.execute('MULTI')
+            await conn.execute('SET', self._key('playlist', playlist_id), self._dump(entry), 'EX', self.ttl)
+            await conn.execute('SADD', self._key('playlists', entry['user_id']), playlist_id)
+            await conn.execute('EXPIRE', self._key('playlists', entry['user_id']), self.ttl)
+            await conn.execute('EXEC')
+
+    async def load_playlist(self, playlist_id):
+        raw = await self.redis.execute('GET', self._key('playlist', playlist_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def update_playlist(self, playlist_id, change):
+        # Оптимистичная блокировка: если запись поменял другой воркер, EXEC вернет nil - повторяем
+        key = self._key('playlist', playlist_id)
+        async with self.redis.connection() as conn:
+            while True:
+                await conn.execute('WATCH', key)
+                raw = await conn.execute('GET', key)
+                if raw is None:
+                    await conn.execute('UNWATCH')
+                    return None, None
+                entry = json.loads(raw)
+                result = change(entry)
+                await conn.execute('MULTI')
+                await conn.execute('SET', key, self._dump(entry), 'EX', self.ttl)
+                if await conn.execute('EXEC') is not None:
+                    return entry, result
+
+    async def pop_playlist(self, playlist_id):
+        key = self._key('playlist', playlist_id)
+        async with self.redis.connection() as conn:
+            await conn.execute('MULTI')
+            await conn.execute('GET', key)
+            await conn.execute('DEL', key)
+            raw, _ = await conn.execute('EXEC')
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        await self.redis.execute('SREM', self._key('playlists', entry['user_id']), playlist_id)
+        return entry
+
+    async def user_playlists(self, user_id):
+        members = await self.redis.execute('SMEMBERS', self._key('playlists', user_id))
+        return [m.decode('utf-8') for m in members]
+
+    async def save_agent_user(self, user_id):
+        await self.redis.execute('SET', self._key('agent_user'), user_id)
+
+    async def load_agent_user(self):
+        raw = await self.redis.execute('GET', self._key('agent_user'))
+        return int(raw) if raw is not None else None
+
+    async def publish_handoff(self, job_id, result, ttl):
+        await self.redis.execute('SET', self._key('handoff', job_id), self._dump(result), 'EX', ttl)
+
+    async def take_handoff(self, job_id):
+        key = self._key('handoff', job_id)
+        async with self.redis.connection() as conn:
+            await conn.execute('MULTI')
+            await conn.execute('GET', key)
+            await conn.execute('DEL', key)
+            raw, _ = await conn.execute('EXEC')
+        return json.loads(raw) if raw is not None else None
+
+    async def close(self):
+        await self.redis.close()
+
+
+def create_state_backend(url: str, ttl: int, **memory_state) -> StateBackend:
+    """redis://... - общий сервер, пустая строка - словари процесса"""
+    if url.startswith('redis://'):
+        return RedisStateBackend(url, ttl)
+    if url and url != 'memory':
+        raise ValueError(f"Unsupported STATE_BACKEND_URL: {url}")
+    return MemoryStateBackend(**memory_state)
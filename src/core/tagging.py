@@ -0,0 +1,117 @@
+# tagging.py
+# Проверка и теги аудиофайлов за одно открытие mutagen. Раньше файл открывался дважды (MP3() для
+# проверки длительности, ID3() для тегов), а теги писались только в MP3: M4A, Opus, Ogg и FLAC
+# уходили без них. check_and_tag() открывает файл один раз, проверяет длительность и пишет
+# название, исполнителя и обложку в родном для контейнера виде (ID3, MP4, Vorbis comment, FLAC).
+# Файл перезаписывается, только если теги отличаются: если их уже записал ffmpeg при
+# перекодировании (ffmpeg_metadata_args), лишнего прохода по файлу нет.
+import base64
+import logging
+from typing import Optional
+
+import mutagen
+from mutagen.id3 import TIT2, TPE1, APIC
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.flac import FLAC, Picture
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+
+from src.monitoring.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+COVER_MIME = 'image/jpeg'
+
+
+class InvalidAudioError(Exception):
+    """Файл не читается как аудио или нулевой длины"""
+
+
+def ffmpeg_metadata_args(title: str, artist: str) -> list[str]:
+    """Аргументы вывода ffmpeg: теги пишутся тем же проходом, что и перекодирование"""
+    return ['-metadata', f'title={title}', '-metadata', f'artist={artist}']
+
+
+def _picture(cover: bytes) -> Picture:
+    picture = Picture()
+    picture.type = 3  # front cover
+    picture.mime = COVER_MIME
+    picture.data = cover
+    return picture
+
+
+def _tag_id3(audio, title, artist, cover) -> bool:
+    tags, changed = audio.tags, False
+    for frame in (TIT2(encoding=3, text=title), TPE1(encoding=3, text=artist)):
+        if str(tags.get(frame.FrameID, '')) != frame.text[0]:
+            tags.setall(frame.FrameID, [frame])
+            changed = True
+    if cover and not any(apic.data == cover for apic in tags.getall('APIC')):
+        tags.setall('APIC', [APIC(encoding=3, mime=COVER_MIME, type=3, desc='Cover', data=cover)])
+        changed = True
+    return changed
+
+
+def _tag_mp4(audio, title, artist, cover) -> bool:
+    tags, changed = audio.tags, False
+    for key, value in (('\xa9nam', title), ('\xa9ART', artist)):
+        if tags.get(key) != [value]:
+            tags[key] = [value]
+            changed = True
+    if cover and tags.get('covr') != [cover]:
+        tags['covr'] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+        changed = True
+    return changed
+
+
+def _tag_vorbis(audio, title, artist, cover) -> bool:
+    tags, changed = audio.tags, False
+    for key, value in (('title', title), ('artist', artist)):
+        if tags.get(key) != [value]:
+            tags[key] = [value]
+            changed = True
+    if cover:
+        if isinstance(audio, FLAC):
+            if not any(p.data == cover for p in audio.pictures):
+                audio.clear_pictures()
+                audio.add_picture(_picture(cover))
+                changed = True
+        else:
+            # Ogg хранит картинку как FLAC picture block в base64
+            block = base64.b64encode(_picture(cover).write()).decode('ascii')
+            if tags.get('metadata_block_picture') != [block]:
+                tags['metadata_block_picture'] = [block]
+                changed = True
+    return changed
+
+
+_WRITERS = {MP3: _tag_id3, MP4: _tag_mp4, OggOpus: _tag_vorbis, OggVorbis: _tag_vorbis, FLAC: _tag_vorbis}
+
+
+@traced()
+def check_and_tag(path: str, title: Optional[str] = None, artist: Optional[str] = None,
+                  cover: Optional[bytes] = None) -> bool:
+    """
+    Проверяет аудиофайл и, если задан title, пишет теги - одним открытием mutagen.
+    Битый или пустой файл - InvalidAudioError. True - теги в файле, False - теги не заданы,
+    контейнер их не поддерживает или запись не удалась.
+    """
+    try:
+        audio = mutagen.File(path)
+    except Exception as e:
+        raise InvalidAudioError(f"не получилось прочитать аудио: {e}")
+    if audio is None or not audio.info.length > 0:
+        raise InvalidAudioError("аудиофайл скачался но похоже битый (нулевая длина)")
+    writer = _WRITERS.get(type(audio))
+    if title is None or writer is None:
+        return False
+    try:
+        if audio.tags is None:
+            audio.add_tags()
+        if writer(audio, title, artist or '', cover):
+            audio.save()
+        return True
+    except Exception as e:
+        logger.warning(f"Could not tag {path}: {e}")
+        return False
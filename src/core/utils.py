@@ -1,5 +1,5 @@
 # utils.py
-# Utility functions for title/artist extraction and MP3 metadata
+# Utility functions for title/artist extraction (теги файлов - в tagging.py)
 
 def extract_title_and_artist(title):
     """Улучшенное извлечение названия трека и исполнителя"""
@@ -24,20 +24,3 @@ def extract_title_and_artist(title):
         return title, "Unknown Artist"
     else:
         return title, "Unknown Artist"
-
-
-def set_mp3_metadata(file_path, title, artist):
-    """Sets ID3 metadata TIT2 and TPE1 on MP3 file"""
-    try:
-        from mutagen.id3 import ID3, TIT2, TPE1
-        try:
-            audio = ID3(file_path)
-        except Exception:
-            audio = ID3()
-        audio["TIT2"] = TIT2(encoding=3, text=title)
-        audio["TPE1"] = TPE1(encoding=3, text=artist)
-        audio.save(file_path)
-        return True
-    except Exception as e:
-        print(f"ошибка при установке метаданных: {e}")
-        return False 
\ No newline at end of file
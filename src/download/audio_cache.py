@@ -0,0 +1,336 @@
+# audio_cache.py
+# Общий для всех пользователей и чатов кэш готовых аудиофайлов на диске (MP3, а при
+# политике перекодирования без ffmpeg - M4A/Opus; расширение сохраняется).
+# Ключ - каноничная личность трека (источник + id, иначе нормализованные исполнитель/название
+# + длительность), а не URL: у VK ссылки подписанные и меняются от запроса к запросу. К ней
+# добавляется потолок перекодирования (TranscodeTarget.cache_tag): одинаковые треки разного
+# качества лежат отдельно.
+# Файлы кладутся атомарно (os.replace), вытесняются по LRU при превышении квоты, а файлы, которые
+# сейчас отправляются или ждут отправки плейлиста (есть ссылки), не трогаются. Каталог общий для
+# всех воркеров бота: ссылки и порядок LRU хранятся на диске (см. AudioCache).
+# Файловые операции put/release и просмотр каталога при вытеснении идут в пуле metadata, а не в
+# event loop. Каталог просматривается не на каждый put, а когда своя оценка размера вышла за
+# квоту или с прошлого просмотра прошло EVICT_INTERVAL (файлы кладут и другие процессы).
+import os
+import re
+import asyncio
+import shutil
+import hashlib
+import logging
+import tempfile
+import time
+import uuid
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from src.core.config import AUDIO_CACHE_DIR, AUDIO_CACHE_MB, STATE_TTL
+from src.core.executors import metadata_executor
+from src.monitoring.metrics import CACHE_REQUESTS, CACHE_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTS = ('.mp3', '.m4a', '.opus')
+PIN_TTL = STATE_TTL  # ссылка дольше не нужна: столько живет и плейлист, который ее держит
+STALE_TMP_SECONDS = 3600  # копия файла в кэш не длится час - такой .tmp остался от упавшего процесса
+EVICT_INTERVAL = 60  # секунд между просмотрами каталога, пока своя оценка размера в пределах квоты
+
+
+def _normalize(text: str) -> str:
+    text = re.sub(r'[\(\[].*?[\)\]]', ' ', (text or '').lower())  # (Official Video), [Remix] и т.п.
+    text = re.sub(r'[^\w]+', ' ', text)
+    return ' '.join(text.split())
+
+
+def track_identity(track: dict) -> Optional[str]:
+    """Каноничная личность трека или None, если по данным трек не опознать"""
+    source = track.get('source') or 'unknown'
+    if track.get('track_id'):
+        return f"{source}:{track['track_id']}"
+    url = (track.get('url') or '').split('?', 1)[0].rstrip('/')
+    if url and source != 'vk':  # ссылки VK подписаны и не годятся как id
+        return f"{source}:{url}"
+    title = _normalize(track.get('title', ''))
+    if not title or title == 'unknown title':
+        return None
+    artist = _normalize(track.get('channel') or track.get('artist') or '')
+    duration = int(round(float(track.get('duration') or 0)))
+    return f"meta:{artist}|{title}|{duration}"
+
+
+def _lock(fd: int, exclusive: bool, wait: bool = True) -> bool:
+    """flock на открытый файл; False - файл уже заблокирован другим (только при wait=False)"""
+    if fcntl is None:
+        return True  # Windows: один процесс, блокировки между процессами не нужны
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    try:
+        fcntl.flock(fd, flags if wait else flags | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class AudioCache:
+    """
+    LRU кэш файлов с квотой по размеру. Каталог могут делить несколько процессов бота, поэтому
+    состояние хранится на диске, а не в памяти процесса:
+      - ссылка на файл (pin) - пустой файл pins/<ключ>.<uuid>; release() в любом процессе снимает
+        одну ссылку ключа, так что файл плейлиста, переданного другому воркеру, отпускается там
+      - порядок LRU - mtime файла (pin() его обновляет)
+      - вытеснение берет flock LOCK_EX на файл и перепроверяет ссылки, pin() после создания ссылки
+        проверяет файл под LOCK_SH - файл не удалят между проверкой и закреплением
+    """
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, quota_mb: int = AUDIO_CACHE_MB):
+        self.directory = directory
+        self.pins_dir = os.path.join(directory, 'pins')
+        self.quota = quota_mb * 1024 * 1024
+        self._size = 0  # по последнему просмотру каталога плюс свои put
+        self._loaded = False
+        self._last_scan: Optional[float] = None
+        self._evicting: Optional[asyncio.Task] = None
+        self._releasing: set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.quota > 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @staticmethod
+    def key_for(track: dict, quality: Optional[str] = None) -> Optional[str]:
+        """Ключ файла трека; quality - TranscodeTarget.cache_tag, под который файл перекодирован"""
+        identity = track_identity(track)
+        if not identity:
+            return None
+        if quality:
+            identity = f"{identity}|{quality}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.directory, f"{key}{ext}")
+
+    def _find(self, key: str) -> Optional[str]:
+        for ext in AUDIO_EXTS:
+            path = self._path(key, ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _load(self):
+        """Создает каталог и разбирает то, что осталось от прошлых запусков"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.pins_dir, exist_ok=True)
+        self._maybe_evict()
+
+    # ссылки
+
+    def _add_pin(self, key: str) -> str:
+        pin = os.path.join(self.pins_dir, f"{key}.{uuid.uuid4().hex}")
+        open(pin, 'xb').close()
+        return pin
+
+    def _pins(self, key: str) -> list[str]:
+        prefix = f"{key}."
+        try:
+            return [os.path.join(self.pins_dir, name) for name in os.listdir(self.pins_dir) if name.startswith(prefix)]
+        except FileNotFoundError:
+            return []
+
+    def _pinned_keys(self) -> set[str]:
+        """Ключи с живыми ссылками; ссылки старше PIN_TTL (от упавших процессов) удаляются"""
+        keys, now = set(), time.time()
+        for entry in os.scandir(self.pins_dir):
+            try:
+                if now - entry.stat().st_mtime > PIN_TTL:
+                    os.remove(entry.path)
+                    continue
+            except FileNotFoundError:
+                continue
+            keys.add(entry.name.split('.', 1)[0])
+        return keys
+
+    @staticmethod
+    def _still_there(path: str) -> bool:
+        """Файл на месте и не удаляется прямо сейчас вытеснением в другом процессе"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            _lock(fd, exclusive=False)  # вытеснение держит LOCK_EX считанные микросекунды
+            return os.fstat(fd).st_nlink > 0
+        finally:
+            os.close(fd)
+
+    def acquire(self, key: Optional[str]) -> Optional[str]:
+        """Возвращает путь к файлу и закрепляет его до release(). None - в кэше нет."""
+        if not key or not self.enabled:
+            return None
+        self._load()
+        path = self.pin(key)
+        CACHE_REQUESTS.inc(cache='audio', result='hit' if path else 'miss')
+        return path
+
+    def pin(self, key: str) -> Optional[str]:
+        """Как acquire(), но без учета в метриках попаданий - для уже известного файла"""
+        self._load()
+        path = self._find(key)
+        if path is None:
+            return None
+        pin = self._add_pin(key)
+        if not self._still_there(path):
+            os.remove(pin)
+            return None
+        try:
+            os.utime(path)  # LRU общий для всех процессов
+        except OSError:
+            pass
+        return path
+
+    def release(self, key: Optional[str]):
+        """Снимает одну ссылку ключа - не обязательно взятую этим процессом (в фоне, в пуле metadata)"""
+        if not key or not self.enabled:
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._remove_pin(key)  # вне event loop - прямо здесь
+            return
+        task = asyncio.create_task(self._release(key))
+        self._releasing.add(task)
+        task.add_done_callback(self._releasing.discard)
+
+    async def _release(self, key: str):
+        try:
+            await metadata_executor.run(self._remove_pin, key)
+        except Exception as e:
+            logger.warning(f"Could not release cached audio {key}: {e}")
+        self._maybe_evict()
+
+    def _remove_pin(self, key: str):
+        for pin in self._pins(key):
+            try:
+                os.remove(pin)
+                break
+            except FileNotFoundError:
+                continue  # эту ссылку только что снял другой процесс
+
+    async def put(self, key: Optional[str], src_path: str) -> str:
+        """
+        Переносит готовый файл в кэш и закрепляет его (нужен release()).
+        Если такой трек уже успели положить, src_path удаляется и возвращается путь из кэша.
+        При выключенном кэше возвращает src_path как есть.
+        """
+        if not key or not self.enabled:
+            return src_path
+        self._load()
+        final_path, added = await metadata_executor.run(self._publish, key, src_path)
+        self._size += added
+        self._maybe_evict()
+        return final_path
+
+    def _publish(self, key: str, src_path: str) -> tuple[str, int]:
+        """Блокирующая часть put(): путь в кэше и сколько байт добавилось"""
+        existing = self.pin(key)
+        if existing:
+            if os.path.abspath(src_path) != os.path.abspath(existing):
+                try: os.remove(src_path)
+                except OSError: pass
+            return existing, 0
+
+        final_path = self._path(key, os.path.splitext(src_path)[1] or '.mp3')
+        # Ссылка ставится до публикации: вытеснение в другом процессе не заберет файл сразу
+        pin = self._add_pin(key)
+        try:
+            try:
+                os.replace(src_path, final_path)  # тот же диск - атомарное переименование
+            except OSError:
+                fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+                os.close(fd)
+                try:
+                    shutil.copyfile(src_path, tmp_path)
+                    os.replace(tmp_path, final_path)
+                except Exception:
+                    try: os.remove(tmp_path)
+                    except OSError: pass
+                    raise
+                os.remove(src_path)
+            os.utime(final_path)
+        except Exception:
+            os.remove(pin)
+            raise
+        return final_path, os.path.getsize(final_path)
+
+    def _maybe_evict(self):
+        """Запускает вытеснение в фоне, если своя оценка размера вышла за квоту или каталог давно не просматривали"""
+        if self._evicting is not None and not self._evicting.done():
+            return
+        now = time.monotonic()
+        if self._size <= self.quota and self._last_scan is not None and now - self._last_scan < EVICT_INTERVAL:
+            return
+        try:
+            self._evicting = asyncio.get_running_loop().create_task(self._evict_in_pool())
+        except RuntimeError:
+            return  # вне event loop - просмотрим при следующем put
+        self._last_scan = now
+
+    async def _evict_in_pool(self):
+        try:
+            await metadata_executor.run(self._evict)
+        except Exception as e:
+            logger.warning(f"Audio cache eviction failed: {e}")
+
+    def _remove_unpinned(self, key: str, path: str) -> bool:
+        """Удаляет файл, если на него нет ссылок. False - файл закреплен или его сейчас закрепляют."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return True  # уже вытеснил другой процесс
+        try:
+            if not _lock(fd, exclusive=True, wait=False) or self._pins(key):
+                return False
+            os.remove(path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not evict {path}: {e}")
+            return False
+        finally:
+            os.close(fd)
+
+    def _evict(self):
+        """Просматривает общий каталог и вытесняет давно не использованные файлы сверх квоты"""
+        files, total, now = [], 0, time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.tmp'):
+                    if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                        os.remove(entry.path)  # недописанная копия упавшего процесса
+                elif entry.name.endswith(AUDIO_EXTS):
+                    st = entry.stat()
+                    files.append((st.st_mtime, os.path.splitext(entry.name)[0], entry.path, st.st_size))
+                    total += st.st_size
+            except FileNotFoundError:
+                continue
+        self._size = total
+        if total <= self.quota:
+            return
+        pinned = self._pinned_keys()
+        for _, key, path, size in sorted(files):
+            if self._size <= self.quota:
+                break
+            if key in pinned:
+                continue  # файл сейчас отправляется или ждет отправки плейлиста
+            if self._remove_unpinned(key, path):
+                self._size -= size
+                CACHE_EVICTIONS.inc(cache='audio')
+
+
+audio_cache = AudioCache()
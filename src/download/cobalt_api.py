@@ -9,13 +9,16 @@ from typing import Optional, Dict, Any, Tuple, List, Callable
 from aiohttp import ClientTimeout, ClientSession
 from aiohttp_socks import ProxyConnector, ProxyType
 
+from src.core.config import COBALT_API_URL
+from src.monitoring.metrics import COBALT_REQUESTS
+
 class AsyncCobaltDownloader:
     """
     Асинхронный модуль для скачивания медиа через Cobalt API
     """
     
     def __init__(self, 
-                 api_url: str = "https://co.itsv1eds.ru",
+                 api_url: str = COBALT_API_URL,
                  api_key: str = "",
                  temp_dir: str = "temp_downloads",
                  auto_fallback: bool = True,
@@ -283,16 +286,19 @@ class AsyncCobaltDownloader:
                     )
                     
                     if result:
+                        COBALT_REQUESTS.inc(mirror=api_url, outcome='ok')
                         direct_url = result["url"]
                         filename = result["filename"]
                         print(f"Успешный запрос к API: {api_url}")
                         break
                     else:
+                        COBALT_REQUESTS.inc(mirror=api_url, outcome='error')
                         last_error = error
                         print(f"API {api_url} не сработал: {error}")
                         continue
                         
                 except Exception as e:
+                    COBALT_REQUESTS.inc(mirror=api_url, outcome='exception')
                     last_error = f"API {api_url} failed: {e}"
                     print(f"Ошибка API {api_url}: {e}")
                     continue
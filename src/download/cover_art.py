@@ -0,0 +1,136 @@
+# cover_art.py
+# Обложки треков. Ссылки на картинки есть в результатах поиска SoundCloud, в info yt-dlp и в
+# ответе Shazam, но аудио уходило без превью. Обложка качается параллельно с треком, ужимается
+# ffmpeg под требования Telegram к thumbnail (JPEG, до 320x320, до 200 КБ) и идет и в
+# send_audio(thumbnail=...), и в теги файла.
+# Кэш адресуется содержимым: картинка хранится один раз по sha1 готового JPEG, на нее ссылаются
+# URL и псевдонимы (ключ трека из аудиокэша, альбом). Треки одного альбома с одной обложкой
+# берут ее из памяти, одновременные запросы одного URL ждут одну загрузку.
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+import aiohttp
+
+from src.core.config import COVER_ART_ENABLED, COVER_CACHE_MB, COVER_FETCH_TIMEOUT
+from src.core.single_flight import SingleFlight
+from src.monitoring.metrics import CACHE_REQUESTS, CACHE_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 320
+THUMBNAIL_MAX_BYTES = 200 * 1024
+_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+_JPEG_QUALITIES = (3, 6, 10, 16)  # -q:v ffmpeg: меньше - лучше; берем первое, что влезает в лимит
+
+
+async def make_thumbnail(data: bytes) -> Optional[bytes]:
+    """Вписывает картинку в 320x320 и сжимает в JPEG до 200 КБ; None - ffmpeg не справился"""
+    for quality in _JPEG_QUALITIES:
+        proc = await asyncio.create_subprocess_exec(
+            '/usr/bin/ffmpeg', '-loglevel', 'error', '-i', 'pipe:0',
+            '-vf', f'scale={THUMBNAIL_SIZE}:{THUMBNAIL_SIZE}:force_original_aspect_ratio=decrease',
+            '-frames:v', '1', '-q:v', str(quality), '-f', 'mjpeg', 'pipe:1',
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(data)
+        if proc.returncode != 0 or not out:
+            logger.debug(f"ffmpeg could not convert cover: {err.decode('utf-8', 'replace').strip()}")
+            return None
+        if len(out) <= THUMBNAIL_MAX_BYTES:
+            return out
+    return None
+
+
+class CoverArtCache:
+    """Обложки в памяти: sha1 -> JPEG, URL и псевдонимы -> sha1, LRU по объему"""
+
+    def __init__(self, quota_mb: int = COVER_CACHE_MB, timeout: float = COVER_FETCH_TIMEOUT):
+        self.quota = quota_mb * 1024 * 1024
+        self.timeout = timeout
+        self._images: OrderedDict[str, bytes] = OrderedDict()
+        self._refs: dict[str, str] = {}  # URL или псевдоним -> sha1
+        self._size = 0
+        self._flights = SingleFlight('cover_art')
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def lookup(self, *keys: Optional[str]) -> Optional[bytes]:
+        """Обложка по URL или псевдониму без загрузки"""
+        for key in keys:
+            digest = self._refs.get(key) if key else None
+            if digest in self._images:
+                self._images.move_to_end(digest)
+                return self._images[digest]
+        return None
+
+    async def fetch(self, url: Optional[str], *aliases: Optional[str]) -> Optional[bytes]:
+        """
+        Обложка по URL (из кэша или загрузкой) и привязка ее к псевдонимам.
+        Ошибки не пробрасываются: без обложки трек все равно отправляется.
+        """
+        if not COVER_ART_ENABLED or not url:
+            return None
+        # Альбом мог уже прийти с другим треком - тогда его обложку не качаем
+        image = self.lookup(url, *aliases)
+        CACHE_REQUESTS.inc(cache='cover', result='hit' if image else 'miss')
+        if image is None:
+            try:
+                image = await self._flights.do(url, lambda: self._download(url))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Cover {url} failed: {e}")
+                return None
+        if image is not None:
+            digest = hashlib.sha1(image).hexdigest()
+            for alias in aliases:
+                if alias:
+                    self._refs[alias] = digest
+        return image
+
+    async def _download(self, url: str) -> Optional[bytes]:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            data = await resp.content.read(_MAX_SOURCE_BYTES + 1)
+        if len(data) > _MAX_SOURCE_BYTES:
+            raise ValueError("cover image too large")
+        image = await make_thumbnail(data)
+        if image is not None:
+            self._store(url, image)
+        return image
+
+    def _store(self, url: str, image: bytes):
+        digest = hashlib.sha1(image).hexdigest()
+        if digest not in self._images:
+            self._images[digest] = image
+            self._size += len(image)
+        self._images.move_to_end(digest)
+        self._refs[url] = digest
+        while self._size > self.quota and len(self._images) > 1:
+            old_digest, old = self._images.popitem(last=False)
+            self._size -= len(old)
+            self._refs = {key: d for key, d in self._refs.items() if d != old_digest}
+            CACHE_EVICTIONS.inc(cache='cover')
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def album_key(track: dict) -> Optional[str]:
+    """Псевдоним обложки для треков одного альбома"""
+    album = track.get('album')
+    if not album:
+        return None
+    return f"album:{(track.get('channel') or track.get('artist') or '').lower()}|{album.lower()}"
+
+
+cover_art = CoverArtCache()
@@ -0,0 +1,504 @@
+# download_workers.py
+# Процессы для скачивания. yt-dlp (разбор страниц под GIL), ffmpeg и теги выполнялись в
+# потоках процесса бота, и пачка загрузок отнимала у event loop и GIL, и общий пул потоков.
+# С DOWNLOAD_WORKERS_PER_CPU > 0 задания выполняют size долгоживущих процессов
+# (python -m src.download.download_workers): они запускаются один раз, импорт yt-dlp не
+# повторяется на каждое задание, и получают задания строками JSON в stdin, по одному за раз.
+# Остальные задания ждут в очереди слотов; фоновые (предзагрузка) получают слот, только когда
+# его не ждет ни одно задание пользователя. Бот занимается только Telegram. Задание получает url,
+# путь и потолок перекодирования (transcode_policy.py), а возвращает путь к готовому файлу,
+# принятое решение и тайминги: метрики пишет процесс бота, у воркера их не видно.
+# Отмена: каждый воркер живет в своей сессии, и /cancel убивает всю его группу - yt-dlp
+# вместе с дочерним ffmpeg - и сразу освобождает слот, а вместо убитого (или упавшего) воркера
+# в фоне запускается новый. В режиме потоков (0) отмену видит хук
+# прогресса yt-dlp: загрузка обрывается на следующем куске, а ffmpeg, если уже запущен,
+# дорабатывает.
+# Прогресс (байты, скорость, ETA, старт/конец ffmpeg) задание отдает через progress(event): из
+# потока - через call_soon_threadsafe, из процесса - строками в stdout. Частые события загрузки
+# прореживаются на месте, до PROGRESS_EMIT_INTERVAL.
+# Функции заданий живут здесь, а не в track_downloader: процесс-воркер импортирует только этот
+# модуль и transcode_policy, без бота и обработчиков.
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Callable, Optional
+
+import yt_dlp
+from yt_dlp.utils import DownloadCancelled
+from src.core.config import DOWNLOAD_WORKERS_PER_CPU, TAGS_IN_FFMPEG
+from src.core.tagging import check_and_tag, ffmpeg_metadata_args, InvalidAudioError
+from src.download import transcode_policy
+from src.download.transcode_policy import TranscodeTarget, TranscodeDecision, fit_to_source
+
+logger = logging.getLogger(__name__)
+
+_LEFTOVER_EXTS = ['.mp3', '.m4a', '.webm', '.mp4', '.opus', '.ogg', '.aac', '.part', '.reencode.mp3', '.reencode.opus']
+_ENCODERS = {'mp3': 'libmp3lame', 'opus': 'libopus'}
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_RESULT_MARK = '@@result '  # строка ответа воркера в stdout
+_PROGRESS_MARK = '@@progress '
+PROGRESS_EMIT_INTERVAL = 0.5  # секунд между событиями 'downloading'
+
+
+@dataclass
+class YtdlpTimings:
+    download_seconds: float
+    convert_seconds: Optional[float]  # None - ffmpeg не запускался
+    codec: str
+
+
+@dataclass
+class AudioJobResult:
+    path: str
+    tagged: bool  # теги записаны воркером
+    timings: YtdlpTimings
+    transcode: TranscodeDecision
+    thumbnail: Optional[str] = None  # обложка из info yt-dlp
+    cover_tagged: bool = False  # обложка из cover_path записана в файл вместе с тегами
+
+
+def run_ytdlp(url: str, download_opts: dict, cancel: Optional[threading.Event] = None,
+              progress: Optional[Callable[[dict], None]] = None,
+              choose_postprocessors: Optional[Callable[[Optional[dict]], list]] = None) -> YtdlpTimings:
+    """
+    Блокирующее скачивание через yt-dlp.
+    cancel - прервать на ближайшем хуке, progress - получать события:
+      {'stage': 'download', 'status', 'downloaded', 'total', 'speed', 'eta', 'elapsed'}
+      {'stage': 'convert', 'status'}  # ffmpeg started / finished
+    choose_postprocessors(info) - постпроцессоры по формату, который выбрал yt-dlp
+    """
+    # Время ffmpeg отмечаем хуком постпроцессора, остальное - скачивание
+    pp_times = {}
+    last_emit = [0.0]
+    def check_cancel():
+        if cancel is not None and cancel.is_set():
+            raise DownloadCancelled('cancelled')
+    def progress_hook(d):
+        check_cancel()
+        if progress is None:
+            return
+        status = d.get('status')
+        now = time.monotonic()
+        if status == 'downloading' and now - last_emit[0] < PROGRESS_EMIT_INTERVAL:
+            return
+        last_emit[0] = now
+        progress({
+            'stage': 'download', 'status': status,
+            'downloaded': d.get('downloaded_bytes'),
+            'total': d.get('total_bytes') or d.get('total_bytes_estimate'),
+            'speed': d.get('speed'), 'eta': d.get('eta'), 'elapsed': d.get('elapsed'),
+        })
+    def pp_hook(d):
+        check_cancel()
+        if d.get('postprocessor') == 'ExtractAudio':
+            pp_times[d.get('status')] = time.perf_counter()
+            if progress is not None and d.get('status') in ('started', 'finished'):
+                progress({'stage': 'convert', 'status': d.get('status')})
+    def with_hooks(opts):
+        return {
+            **opts,
+            'progress_hooks': [*opts.get('progress_hooks', []), progress_hook],
+            'postprocessor_hooks': [*opts.get('postprocessor_hooks', []), pp_hook],
+        }
+    start = time.perf_counter()
+    if choose_postprocessors is None:
+        with yt_dlp.YoutubeDL(with_hooks(download_opts)) as ydl:
+            ydl.download([url])
+    else:
+        # Сначала только выбор формата: постпроцессоры зависят от кодека и битрейта источника
+        with yt_dlp.YoutubeDL(download_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        download_opts = {**download_opts, 'postprocessors': choose_postprocessors(info)}
+        if info is not None:
+            with yt_dlp.YoutubeDL(with_hooks(download_opts)) as ydl:
+                ydl.process_ie_result(info, download=True)
+    end = time.perf_counter()
+    codec = next((pp.get('preferredcodec') for pp in download_opts.get('postprocessors', []) if pp.get('key') == 'FFmpegExtractAudio'), '')
+    convert = None
+    if 'started' in pp_times and 'finished' in pp_times:
+        convert = pp_times['finished'] - pp_times['started']
+    return YtdlpTimings(pp_times.get('started', end) - start, convert, codec or '')
+
+
+def reencode(path: str, bitrate: int, output_args: list[str], cancel: Optional[threading.Event] = None,
+             progress: Optional[Callable[[dict], None]] = None) -> float:
+    """
+    Пережимает файл в тот же кодек с битрейтом bitrate (FFmpegExtractAudio файл того же кодека
+    только копирует). Возвращает время ffmpeg; cancel останавливает его.
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.reencode{ext}"
+    if progress is not None:
+        progress({'stage': 'convert', 'status': 'started'})
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        ['/usr/bin/ffmpeg', '-y', '-loglevel', 'error', '-i', path, '-map', '0:a', '-map_metadata', '0',
+         '-c:a', _ENCODERS[ext[1:]], '-b:a', f'{bitrate}k', *output_args, tmp_path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    while True:
+        try:
+            _, err = proc.communicate(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                proc.kill()
+                proc.wait()
+                try: os.remove(tmp_path)
+                except OSError: pass
+                raise DownloadCancelled('cancelled')
+    if proc.returncode != 0:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        raise Exception(f"ffmpeg не пережал {path}: {err.decode('utf-8', 'replace').strip()[-300:]}")
+    os.replace(tmp_path, path)
+    if progress is not None:
+        progress({'stage': 'convert', 'status': 'finished'})
+    return time.perf_counter() - started
+
+
+def remove_leftovers(base_temp_path: str):
+    """Удаляет файлы недокачанного или прерванного задания"""
+    for ext in _LEFTOVER_EXTS:
+        p = f"{base_temp_path}{ext}"
+        if os.path.exists(p):
+            try:
+                os.remove(p)
+            except OSError as e:
+                logger.warning(f"Could not remove {p}: {e}")
+
+
+def download_audio(url: str, base_temp_path: str, title: Optional[str] = None, artist: Optional[str] = None,
+                   target: Optional[dict] = None, cover_path: Optional[str] = None,
+                   cancel: Optional[threading.Event] = None,
+                   progress: Optional[Callable[[dict], None]] = None) -> AudioJobResult:
+    """
+    Скачивает трек в base_temp_path + расширение по политике перекодирования (target -
+    TranscodeTarget в виде словаря), проверяет файл и, если заданы, пишет теги. cover_path -
+    JPEG, который бот кладет, пока идет скачивание: если он уже появился, обложка пишется
+    тем же проходом, что и теги
+    """
+    remove_leftovers(base_temp_path)
+
+    download_opts = {
+        'format':'bestaudio[ext=m4a]/bestaudio/best',
+        'outtmpl':base_temp_path + '.%(ext)s',
+        'quiet':True,'verbose':False,'no_warnings':True,
+        'prefer_ffmpeg':True,'nocheckcertificate':True,'ignoreerrors':True,
+        'extract_flat':False,'ffmpeg_location':'/usr/bin/ffmpeg'
+    }
+    policy = TranscodeTarget(**target) if target else transcode_policy.target(False, 0)
+    decision = [fit_to_source(policy, None)]
+    thumbnail = [None]
+    def choose_postprocessors(info):
+        decision[0] = fit_to_source(policy, info)
+        thumbnail[0] = (info or {}).get('thumbnail')
+        return decision[0].postprocessors()
+    if title is not None and TAGS_IN_FFMPEG:
+        # Теги пишет сам ffmpeg при перекодировании; если он не запускался, их допишет check_and_tag
+        download_opts['postprocessor_args'] = {'extractaudio+ffmpeg_o1': ffmpeg_metadata_args(title, artist or '')}
+    timings = run_ytdlp(url, download_opts, cancel, progress, choose_postprocessors)
+    timings.codec = decision[0].label
+    expected = f"{base_temp_path}.{decision[0].ext}"
+
+    if not os.path.exists(expected):
+        remove_leftovers(base_temp_path)
+        raise Exception(f"файл {expected} не создался после скачивания/конвертации")
+    if decision[0].reencode:
+        metadata = ffmpeg_metadata_args(title, artist or '') if title is not None and TAGS_IN_FFMPEG else []
+        try:
+            timings.convert_seconds = (timings.convert_seconds or 0) + reencode(expected, decision[0].bitrate, metadata, cancel, progress)
+        except BaseException:
+            remove_leftovers(base_temp_path)
+            raise
+
+    try:
+        if os.path.getsize(expected) == 0:
+            raise InvalidAudioError("скачанный файл пустой чет не то")
+        cover = None
+        if cover_path and os.path.exists(cover_path):
+            with open(cover_path, 'rb') as f:
+                cover = f.read()
+        tagged = check_and_tag(expected, title, artist, cover)
+    except InvalidAudioError:
+        try: os.remove(expected)
+        except OSError: pass
+        raise
+    return AudioJobResult(expected, tagged, timings, decision[0], thumbnail[0], tagged and cover is not None)
+
+
+# Задания, которые можно отправить воркеру: имя -> (функция, разбор ответа)
+_JOBS = {
+    'run_ytdlp': (run_ytdlp, lambda d: YtdlpTimings(**d)),
+    'download_audio': (download_audio, lambda d: AudioJobResult(d['path'], d['tagged'], YtdlpTimings(**d['timings']),
+                                                                TranscodeDecision(**d['transcode']), d['thumbnail'],
+                                                                d['cover_tagged'])),
+}
+
+
+class _Worker:
+    """Долгоживущий процесс-воркер: задания строками JSON в stdin, ответы строками в stdout"""
+
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self._stderr_tail = deque(maxlen=20)
+        # stderr читается все время, иначе заполненный pipe остановит воркер
+        self._stderr = asyncio.create_task(self._drain_stderr())
+
+    @classmethod
+    async def spawn(cls) -> '_Worker':
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', __name__,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            cwd=_ROOT, start_new_session=True,
+        )
+        return cls(proc)
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    @property
+    def last_error(self) -> str:
+        return self._stderr_tail[-1] if self._stderr_tail else f"exit code {self.proc.returncode}"
+
+    async def _drain_stderr(self):
+        while chunk := await self.proc.stderr.read(65536):
+            for line in chunk.decode('utf-8', 'replace').splitlines():
+                if line.strip():
+                    self._stderr_tail.append(line.strip())
+
+    async def call(self, job: str, args: tuple, progress) -> Optional[dict]:
+        """Отправляет задание и ждет ответа; None - воркер умер, не ответив"""
+        try:
+            self.proc.stdin.write(json.dumps({'job': job, 'args': args, 'progress': progress is not None}).encode('utf-8') + b'\n')
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            return None
+        async for raw in self.proc.stdout:
+            line = raw.decode('utf-8', 'replace').rstrip('\n')
+            if line.startswith(_PROGRESS_MARK):
+                _deliver(progress, json.loads(line[len(_PROGRESS_MARK):]))
+            elif line.startswith(_RESULT_MARK):
+                return json.loads(line[len(_RESULT_MARK):])
+        return None
+
+    def kill(self):
+        # своя сессия: группа процесса - это воркер, yt-dlp и запущенный им ffmpeg
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def close(self):
+        self.kill()
+        await self.proc.wait()
+        try:
+            await self._stderr
+        except Exception:
+            pass
+
+
+class _Slots:
+    """Семафор с приоритетом: фоновое задание получает слот, только если его не ждет обычное"""
+
+    def __init__(self, size: int):
+        self._free = size
+        self._waiters = {False: deque(), True: deque()}  # background -> очередь future
+
+    async def acquire(self, background: bool = False):
+        if self._free > 0 and not self._waiters[False] and not (background and self._waiters[True]):
+            self._free -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[background].append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # слот уже отдан нам - передаем дальше
+            else:
+                self._waiters[background].remove(fut)
+            raise
+
+    def release(self):
+        for queue in (self._waiters[False], self._waiters[True]):
+            while queue:
+                fut = queue.popleft()
+                if not fut.done():
+                    fut.set_result(None)
+                    return
+        self._free += 1
+
+
+class DownloadWorkers:
+    """Процессы для заданий скачивания; выключены - задания идут в пул потоков transcode"""
+
+    def __init__(self, per_cpu: float = DOWNLOAD_WORKERS_PER_CPU):
+        self.size = max(1, round(per_cpu * (os.cpu_count() or 1))) if per_cpu > 0 else 0
+        self.pending = 0  # заданий в очереди и в работе
+        self._slots: Optional[_Slots] = None
+        self._workers: set[_Worker] = set()  # все запущенные воркеры
+        self._idle: list[_Worker] = []       # свободные из них
+        self._retiring: set[asyncio.Task] = set()
+        self._closed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    @property
+    def load(self) -> float:
+        """Заданий на слот: до 1 - есть свободные, больше 1 - задания ждут в очереди"""
+        if self.enabled:
+            return self.pending / self.size
+        # local import: процессу-воркеру пулы потоков и метрики не нужны
+        from src.core.executors import transcode_executor
+        return self.pending / transcode_executor.size
+
+    async def start(self):
+        """Запускает воркеры заранее, чтобы первое задание не ждало старта интерпретатора"""
+        while self.enabled and not self._closed and len(self._workers) < self.size:
+            self._idle.append(await self._spawn())
+
+    async def run(self, fn, *args, progress: Optional[Callable[[dict], None]] = None, background: bool = False):
+        """
+        Выполняет задание fn(*args) из _JOBS. Отмена корутины прерывает и само задание.
+        progress(event) вызывается в event loop. background - задание уступает очередь
+        заданиям пользователей.
+        """
+        self.pending += 1
+        try:
+            slots = self._get_slots()
+            await slots.acquire(background)
+            try:
+                if self.enabled:
+                    return await self._run_process(fn.__name__, args, progress)
+                return await self._run_thread(fn, args, progress)
+            finally:
+                slots.release()
+        finally:
+            self.pending -= 1
+
+    def _get_slots(self) -> _Slots:
+        if self._slots is None:
+            if self.enabled:
+                self._slots = _Slots(self.size)
+            else:
+                # local import: процессу-воркеру пулы потоков и метрики не нужны
+                from src.core.executors import transcode_executor
+                self._slots = _Slots(transcode_executor.size)
+        return self._slots
+
+    async def _run_thread(self, fn, args, progress):
+        # local import: процессу-воркеру пулы потоков и метрики не нужны
+        from src.core.executors import transcode_executor
+        cancel = threading.Event()
+        to_loop = None
+        if progress is not None:
+            loop = asyncio.get_running_loop()
+            to_loop = lambda event: loop.call_soon_threadsafe(_deliver, progress, event)
+        try:
+            return await transcode_executor.run(fn, *args, cancel=cancel, progress=to_loop)
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    async def _run_process(self, job: str, args: tuple, progress):
+        parse = _JOBS[job][1]
+        worker = await self._take()
+        try:
+            reply = await worker.call(job, args, progress)
+        except BaseException:
+            # отмена (или сбой канала): задание не дошло до конца, воркер в неизвестном состоянии
+            self._retire(worker)
+            raise
+        if reply is None:
+            self._retire(worker)
+            raise Exception(f"download worker failed: {worker.last_error}")
+        self._idle.append(worker)
+        if 'error' in reply:
+            raise Exception(reply['error'])
+        return parse(reply['result'])
+
+    async def _spawn(self) -> _Worker:
+        worker = await _Worker.spawn()
+        self._workers.add(worker)
+        return worker
+
+    async def _take(self) -> _Worker:
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive:
+                return worker
+            self._retire(worker)
+        return await self._spawn()
+
+    def _retire(self, worker: _Worker):
+        """Убивает воркер вместе с его заданием и в фоне запускает замену"""
+        self._workers.discard(worker)
+        worker.kill()
+        task = asyncio.create_task(self._replace(worker))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    async def _replace(self, worker: _Worker):
+        await worker.close()
+        if self._closed or len(self._workers) >= self.size:
+            return
+        try:
+            self._idle.append(await self._spawn())
+        except Exception as e:
+            logger.warning(f"Could not respawn download worker: {e}")
+
+    def shutdown(self):
+        self._closed = True
+        for worker in list(self._workers):
+            worker.kill()
+        self._workers.clear()
+        self._idle.clear()
+
+
+def _deliver(progress, event: dict):
+    if progress is None:
+        return
+    try:
+        progress(event)
+    except Exception as e:
+        logger.warning(f"Progress callback failed: {e}")
+
+
+download_workers = DownloadWorkers()
+
+
+def _main():
+    # stdout - только для ответов воркера: yt-dlp и ffmpeg пишут туда строку прогресса без
+    # перевода строки, поэтому их вывод уходит в stderr
+    channel = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    def send(mark: str, payload: dict):
+        channel.write(mark + json.dumps(payload, ensure_ascii=False) + '\n')
+        channel.flush()
+    # задания по одному на строку, пока бот не закроет stdin
+    while line := sys.stdin.readline():
+        request = json.loads(line)
+        fn = _JOBS[request['job']][0]
+        emit = (lambda event: send(_PROGRESS_MARK, event)) if request.get('progress') else None
+        try:
+            reply = {'result': asdict(fn(*request['args'], progress=emit))}
+        except Exception as e:
+            reply = {'error': str(e) or type(e).__name__}
+        send(_RESULT_MARK, reply)
+
+
+if __name__ == '__main__':
+    _main()
@@ -5,8 +5,6 @@ import asyncio
 import traceback
 import logging
 import re
-import subprocess
-import sys
 
 import yt_dlp # NEW
 from aiogram import types
@@ -15,13 +13,19 @@ from aiogram.types import FSInputFile
 # DEPRECATED: from mutagen import File # No longer needed as metadata extracted from yt-dlp
 
 from src.core.bot_instance import bot
+from src.core.outbound import outbound
+from src.core.executors import extract_executor, metadata_executor
 from src.core.config import MAX_TRACKS, GROUP_MAX_TRACKS, MAX_PARALLEL_DOWNLOADS
-from src.core.state import download_queues, download_tasks, playlist_downloads
-from src.core.utils import extract_title_and_artist, set_mp3_metadata
+from src.core.state import download_tasks, playlist_downloads, state_backend
+from src.core.utils import extract_title_and_artist
+from src.core.tagging import check_and_tag, InvalidAudioError
 # DEPRECATED: from .track_downloader import _blocking_download_and_convert
 from .download_queue import process_download_queue
-from src.search.vk_music import parse_playlist_url, get_playlist_tracks
+from src.search.vk_music import parse_playlist_url, get_playlist_tracks, vk_track_id
 from src.download.cobalt_api import AsyncCobaltDownloader
+from src.upload.telethon_uploader import telethon_uploader, UploadJob
+from src.upload.media_group import AudioItem, send_audio_group
+from src.monitoring.tracing import span
 
 # Disable debug prints and exception stack traces
 logger = logging.getLogger(__name__)
@@ -31,17 +35,24 @@ traceback.print_exc = lambda *args, **kwargs: None
 # Constants for Telethon agent
 TELETHON_THRESHOLD_MB = 48 # Files larger than this will be handled by Telethon agent
 
+async def _tag_media(path, title, artist):
+    """Теги в любой аудиоконтейнер; файл, который mutagen не читает, отправляется как есть"""
+    try:
+        await metadata_executor.run(check_and_tag, path, title, artist)
+    except InvalidAudioError as e:
+        print(f"[URL] Could not tag {path}: {e}")
+
 async def download_media_from_url(url: str, original_message: types.Message, status_message: types.Message):
     """Downloads media (audio/video) or playlists from URL using yt-dlp."""
     loop = asyncio.get_running_loop()
     user_id = original_message.from_user.id
+    chat_id = original_message.chat.id
     is_group = original_message.chat.type in ('group', 'supergroup')
     download_uuid = str(uuid.uuid4())
     temp_dir = tempfile.gettempdir()
     base_temp_path = os.path.join(temp_dir, f"media_{download_uuid}")
     actual_downloaded_path = None
     temp_path = None
-    telethon_agent_used = False # NEW
 
     # Check if URL is a VK playlist or album
     # Ссылки на плейлисты: https://vk.com/music/playlist/123_456_hash
@@ -56,13 +67,13 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
             playlist_type = "альбома" if "album" in url else "плейлиста"
             
             
-            await bot.edit_message_text(f"⏳ получаю информацию о {playlist_type}...", chat_id=status_message.chat.id, message_id=status_message.message_id)
+            outbound.edit_text(f"⏳ получаю информацию о {playlist_type}...", chat_id=status_message.chat.id, message_id=status_message.message_id)
             
             # Получаем треки из плейлиста/альбома
-            tracks = await loop.run_in_executor(None, lambda: get_playlist_tracks(url))
+            tracks = await extract_executor.run(get_playlist_tracks, url)
             
             if not tracks:
-                await bot.edit_message_text(f"❌ {playlist_type} пуст или нет доступа к трекам", chat_id=status_message.chat.id, message_id=status_message.message_id)
+                outbound.edit_text(f"❌ {playlist_type} пуст или нет доступа к трекам", chat_id=status_message.chat.id, message_id=status_message.message_id)
                 return
             
             # Используем разные лимиты для групп и личных чатов
@@ -88,12 +99,14 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
                     'artist': artist, 
                     'status': 'pending',
                     'file_path': None,
-                    'source': 'vk'
+                    'source': 'vk',
+                    'track_id': vk_track_id(track),
+                    'duration': getattr(track, 'duration', 0),
                 })
             
             total = len(processed)
             if total == 0:
-                await bot.edit_message_text(f"❌ нет доступных треков в {playlist_type}", chat_id=status_message.chat.id, message_id=status_message.message_id)
+                outbound.edit_text(f"❌ нет доступных треков в {playlist_type}", chat_id=status_message.chat.id, message_id=status_message.message_id)
                 return
             
             if total > max_tracks:
@@ -101,7 +114,7 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
                 total = max_tracks
             
             # Добавляем в playlist_downloads
-            playlist_downloads[playlist_id_str] = {
+            await state_backend.save_playlist(playlist_id_str, {
                 'user_id': user_id,
                 'chat_id': original_message.chat.id,
                 'chat_type': original_message.chat.type,
@@ -110,20 +123,18 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
                 'total_tracks': total,
                 'completed_tracks': 0,
                 'tracks': processed
-            }
+            })
             
-            await bot.edit_message_text(f"⏳ скачиваю {playlist_type} ({total} треков)", chat_id=status_message.chat.id, message_id=status_message.message_id)
+            outbound.edit_text(f"⏳ скачиваю {playlist_type} ({total} треков)", chat_id=status_message.chat.id, message_id=status_message.message_id)
             
             # Добавляем треки в очередь
-            download_queues.setdefault(user_id, [])
             for t in processed:
-                download_queues[user_id].append(({'title': t['title'], 'channel': t['artist'], 'url': t['url'], 'source': t['source']}, playlist_id_str))
+                # заявка: отдельное нажатие на этот же трек ответит "уже в очереди"
+                await state_backend.claim_download(user_id, t['url'])
+            await state_backend.enqueue(user_id, [({'title': t['title'], 'channel': t['artist'], 'url': t['url'], 'source': t['source'], 'track_id': t['track_id'], 'duration': t['duration']}, playlist_id_str) for t in processed])
             
             # Запускаем обработку очереди
-            if user_id not in download_tasks:
-                download_tasks[user_id] = {}
-            
-            active = sum(1 for t in download_tasks[user_id].values() if not t.done())
+            active = sum(1 for t in download_tasks.get(user_id, {}).values() if not t.done())
             if active < MAX_PARALLEL_DOWNLOADS:
                 asyncio.create_task(process_download_queue(user_id))
             
@@ -132,7 +143,7 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
         except Exception as e:
             print(f"[URL] VK Playlist/Album error: {e}")
             traceback.print_exc()
-            await bot.edit_message_text(f"❌ ошибка при обработке плейлиста/альбома ВКонтакте: {str(e)}", chat_id=status_message.chat.id, message_id=status_message.message_id)
+            outbound.edit_text(f"❌ ошибка при обработке плейлиста/альбома ВКонтакте: {str(e)}", chat_id=status_message.chat.id, message_id=status_message.message_id)
             return
 
     # DEPRECATED: media download options
@@ -157,7 +168,7 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
         try:
             info_opts = {'quiet': True, 'no_warnings': True, 'nocheckcertificate': True, 'ignoreerrors': True, 'extract_flat': False}
             with yt_dlp.YoutubeDL(info_opts) as ydl:
-                extracted_info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
+                extracted_info = await extract_executor.run(ydl.extract_info, url, download=False)
         except Exception as e:
             print(f"[URL] Info extraction error: {e}")
             traceback.print_exc()
@@ -169,7 +180,7 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
             playlist_title = extracted_info.get('title', 'Плейлист')
             entries = extracted_info.get('entries') or []
             if not entries:
-                await bot.edit_message_text(f"❌ плейлист {playlist_title} пуст", chat_id=status_message.chat.id, message_id=status_message.message_id)
+                outbound.edit_text(f"❌ плейлист {playlist_title} пуст", chat_id=status_message.chat.id, message_id=status_message.message_id)
                 return
 
             # prepare tracks for Cobalt API multi-download
@@ -197,13 +208,14 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
             max_tracks = GROUP_MAX_TRACKS if is_group else MAX_TRACKS
             total = len(processed_tracks_info)
             if total == 0:
-                await bot.edit_message_text(f"❌ нет треков для {playlist_title}", chat_id=status_message.chat.id, message_id=status_message.message_id)
+                outbound.edit_text(f"❌ нет треков для {playlist_title}", chat_id=status_message.chat.id, message_id=status_message.message_id)
                 return
             if total > max_tracks:
                 processed_tracks_info = processed_tracks_info[:max_tracks]
                 track_urls_to_download = track_urls_to_download[:max_tracks]
                 total = max_tracks
             
+            # Cobalt качает весь плейлист внутри этой корутины - запись локальная для процесса
             playlist_downloads[playlist_id] = {
                 'user_id': user_id,
                 'chat_id': original_message.chat.id,
@@ -215,13 +227,14 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
                 'tracks': processed_tracks_info
             }
 
-            await bot.edit_message_text(f"⏳ скачиваю плейлист '{playlist_title}' ({total} треков)", chat_id=status_message.chat.id, message_id=status_message.message_id)
+            outbound.edit_text(f"⏳ скачиваю плейлист '{playlist_title}' ({total} треков)", chat_id=status_message.chat.id, message_id=status_message.message_id)
             
             # Initialize CobaltDownloader for playlist download
             cobalt_downloader = AsyncCobaltDownloader(temp_dir=temp_dir)
 
             # Define progress callback for multiple downloads
-            async def multi_progress_callback(track_url: str, percent: int):
+            # Cobalt вызывает callback синхронно, поэтому правка только ставится в очередь
+            def multi_progress_callback(track_url: str, percent: int):
                 # Find the track in playlist_downloads and update its status/progress
                 for track_info in playlist_downloads[playlist_id]['tracks']:
                     if track_info['url'] == track_url:
@@ -235,9 +248,9 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
                 # Update the status message for the playlist
                 completed = playlist_downloads[playlist_id]['completed_tracks']
                 total_tracks = playlist_downloads[playlist_id]['total_tracks']
-                await bot.edit_message_text(
+                outbound.edit_text(
                     f"⏳ скачиваю плейлист '{playlist_title}' ({completed}/{total_tracks} треков)",
-                    chat_id=status_message.chat.id, 
+                    chat_id=status_message.chat.id,
                     message_id=status_message.message_id
                 )
 
@@ -249,54 +262,61 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
             
             await cobalt_downloader._close_session()
 
-            # Process downloaded files
+            # Process downloaded files: аудио собираем в альбомы, остальное отправляем по одному
+            audio_items = []
             for idx, file_path in enumerate(downloaded_paths):
                 track_info = playlist_downloads[playlist_id]['tracks'][idx]
                 if file_path:
                     track_info['file_path'] = file_path
-                    # Send the file after download
                     ext = os.path.splitext(file_path)[1].lower()
                     # Get title and artist for metadata from the processed_tracks_info
                     title_for_meta = track_info['title']
                     artist_for_meta = track_info['artist']
 
                     if ext in ['.mp3','.m4a','.ogg','.opus','.aac','.wav','.flac']:
-                        if ext == '.mp3': set_mp3_metadata(file_path, title_for_meta, artist_for_meta)
-                        await original_message.answer_audio(
-                            FSInputFile(file_path),
-                            title=title_for_meta,
-                            performer=artist_for_meta
-                        )
-                    elif ext in ['.jpg','.jpeg','.png','.gif','.webp']:
-                        await original_message.answer_photo(FSInputFile(file_path))
-                    elif ext in ['.mp4','.mkv','.webm','.mov','.avi']:
-                        await original_message.answer_video(FSInputFile(file_path))
-                    else:
-                        await original_message.answer_document(FSInputFile(file_path))
-                    
-                    # Clean up the downloaded file
-                    try: os.remove(file_path)
-                    except: pass
+                        await _tag_media(file_path, title_for_meta, artist_for_meta)
+                        audio_items.append(AudioItem(file_path, title=title_for_meta, performer=artist_for_meta))
+                        continue
+                    try:
+                        if ext in ['.jpg','.jpeg','.png','.gif','.webp']:
+                            await outbound.send(chat_id, lambda: original_message.answer_photo(FSInputFile(file_path)), upload_bytes=os.path.getsize(file_path))
+                        elif ext in ['.mp4','.mkv','.webm','.mov','.avi']:
+                            await outbound.send(chat_id, lambda: original_message.answer_video(FSInputFile(file_path)), upload_bytes=os.path.getsize(file_path))
+                        else:
+                            await outbound.send(chat_id, lambda: original_message.answer_document(FSInputFile(file_path)), upload_bytes=os.path.getsize(file_path))
+                    finally:
+                        # Clean up the downloaded file
+                        try: os.remove(file_path)
+                        except: pass
                 else:
                     print(f"[URL] Failed to download track: {track_info['url']}")
                     track_info['status'] = 'failed'
 
+            try:
+                # answer_audio отвечал в ту же тему форума - альбомы тоже
+                thread_id = original_message.message_thread_id if original_message.is_topic_message else None
+                await send_audio_group(chat_id, audio_items, message_thread_id=thread_id)
+            finally:
+                for item in audio_items:
+                    try: os.remove(item.path)
+                    except: pass
+
+            outbound.discard_edits(status_message.chat.id, status_message.message_id)
             await bot.delete_message(chat_id=status_message.chat.id, message_id=status_message.message_id)
             return
 
         # single media
         print(f"[URL] Single media download for: {url}")
-        try:
-            await bot.edit_message_text(f"⏳ скачиваю...", chat_id=status_message.chat.id, message_id=status_message.message_id)
-        except: pass
+        outbound.edit_text(f"⏳ скачиваю...", chat_id=status_message.chat.id, message_id=status_message.message_id)
 
         # Initialize CobaltDownloader
         cobalt_downloader = AsyncCobaltDownloader(temp_dir=temp_dir)
         
         # Download using Cobalt API
-        actual_downloaded_path = await cobalt_downloader.download_media(
-            url, 
-        )
+        with span('cobalt_download'):
+            actual_downloaded_path = await cobalt_downloader.download_media(
+                url,
+            )
         
         # Close the session after download
         await cobalt_downloader._close_session()
@@ -326,9 +346,8 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
         # Send the file
         size = os.path.getsize(actual_downloaded_path)
         if size > TELETHON_THRESHOLD_MB * 1024 * 1024: # If file is larger than threshold, use Telethon agent
-            telethon_agent_used = True
             mb = size / 1024 / 1024
-            await bot.edit_message_text(f"⏳ файл {mb:.1f}МБ слишком большой для прямой отправки, использую Telethon агента...", chat_id=status_message.chat.id, message_id=status_message.message_id)
+            outbound.edit_text(f"⏳ файл {mb:.1f}МБ слишком большой для прямой отправки, использую Telethon агента...", chat_id=status_message.chat.id, message_id=status_message.message_id)
 
             file_type = "document" # Default type for agent
             if ext in ['.mp3','.m4a','.ogg','.opus','.aac','.wav','.flac']:
@@ -338,49 +357,71 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
             elif ext in ['.jpg','.jpeg','.png','.gif','.webp']:
                 file_type = "photo"
 
-            # Duration is already handled by duration_for_media
-            duration_for_agent = duration_for_media
-
-            # Call Telethon agent in a separate process
-            command = [
-                sys.executable, # Use the same python executable
-                "telethon_agent.py",
-                actual_downloaded_path,
-                str(original_message.chat.id),
-                str(original_message.message_id),
-                str(status_message.message_id),
-                file_type,
-                title_for_media,
-                performer_for_media,
-                str(duration_for_agent)
-            ]
-            print(f"[AGENT] Calling Telethon agent: {' '.join(command)}")
-            subprocess.Popen(command)
-            # Agent will handle sending the file and updating status, so we return here.
+            # Прогресс отправки: обновляем статус не чаще раза в 5 секунд
+            last_progress_edit = 0.0
+            async def agent_progress(sent: int, total: int):
+                nonlocal last_progress_edit
+                now = loop.time()
+                if not total or now - last_progress_edit < 5:
+                    return
+                last_progress_edit = now
+                outbound.edit_text(f"📤 отправляю {mb:.1f}МБ: {sent * 100 // total}%", chat_id=status_message.chat.id, message_id=status_message.message_id)
+
+            job = UploadJob(
+                file_path=actual_downloaded_path,
+                file_type=file_type,
+                title=title_for_media,
+                performer=performer_for_media,
+                duration=int(duration_for_media or 0),
+                progress_callback=agent_progress
+            )
+            print(f"[AGENT] Submitting job {job.job_id} to Telethon uploader")
+            with span('telethon_upload', size=size):
+                agent_file = await telethon_uploader.upload(job)
+
+            # Агент вернул file_id - пересылаем файл пользователю без повторной загрузки
+            outbound.discard_edits(status_message.chat.id, status_message.message_id)
+            try: await bot.delete_message(chat_id=status_message.chat.id, message_id=status_message.message_id)
+            except: pass
+            reply_to = original_message.message_id
+            if agent_file.file_type == "audio":
+                await outbound.send(chat_id, lambda: bot.send_audio(chat_id, agent_file.file_id, title=title_for_media, performer=performer_for_media, duration=job.duration, reply_to_message_id=reply_to))
+            elif agent_file.file_type == "video":
+                await outbound.send(chat_id, lambda: bot.send_video(chat_id, agent_file.file_id, caption=title_for_media, duration=job.duration, supports_streaming=True, reply_to_message_id=reply_to))
+            elif agent_file.file_type == "photo":
+                await outbound.send(chat_id, lambda: bot.send_photo(chat_id, agent_file.file_id, caption=title_for_media, reply_to_message_id=reply_to))
+            else:
+                await outbound.send(chat_id, lambda: bot.send_document(chat_id, agent_file.file_id, caption=title_for_media, reply_to_message_id=reply_to))
+
+            # Убираем файл из чата агента с ботом
+            try: await bot.delete_message(chat_id=agent_file.chat_id, message_id=agent_file.message_id)
+            except: pass
             return
         else: # If file is within limits, send directly
+            outbound.discard_edits(status_message.chat.id, status_message.message_id)
             await bot.delete_message(chat_id=status_message.chat.id, message_id=status_message.message_id)
             
             # ext is already defined above
-            if ext in ['.mp3','.m4a','.ogg','.opus','.aac','.wav','.flac']:
-                if ext == '.mp3': set_mp3_metadata(actual_downloaded_path, title_for_media, performer_for_media)
-                await original_message.answer_audio(
-                    FSInputFile(actual_downloaded_path),
-                    title=title_for_media,
-                    performer=performer_for_media,
-                    duration=duration_for_media # NEW: Pass duration for directly sent audio files
-                )
-            elif ext in ['.jpg','.jpeg','.png','.gif','.webp']:
-                await original_message.answer_photo(FSInputFile(actual_downloaded_path))
-            elif ext in ['.mp4','.mkv','.webm','.mov','.avi']:
-                await original_message.answer_video(
-                    FSInputFile(actual_downloaded_path),
-                    caption=title_for_media, # Use title as caption for video
-                    duration=duration_for_media, # Pass duration for directly sent video files
-                    supports_streaming=True # Allow streaming of the video file
-                )
-            else:
-                await original_message.answer_document(FSInputFile(actual_downloaded_path))
+            with span('send_media', size=size):
+                if ext in ['.mp3','.m4a','.ogg','.opus','.aac','.wav','.flac']:
+                    await _tag_media(actual_downloaded_path, title_for_media, performer_for_media)
+                    await outbound.send(chat_id, lambda: original_message.answer_audio(
+                        FSInputFile(actual_downloaded_path),
+                        title=title_for_media,
+                        performer=performer_for_media,
+                        duration=duration_for_media # NEW: Pass duration for directly sent audio files
+                    ), upload_bytes=size)
+                elif ext in ['.jpg','.jpeg','.png','.gif','.webp']:
+                    await outbound.send(chat_id, lambda: original_message.answer_photo(FSInputFile(actual_downloaded_path)), upload_bytes=size)
+                elif ext in ['.mp4','.mkv','.webm','.mov','.avi']:
+                    await outbound.send(chat_id, lambda: original_message.answer_video(
+                        FSInputFile(actual_downloaded_path),
+                        caption=title_for_media, # Use title as caption for video
+                        duration=duration_for_media, # Pass duration for directly sent video files
+                        supports_streaming=True # Allow streaming of the video file
+                    ), upload_bytes=size)
+                else:
+                    await outbound.send(chat_id, lambda: original_message.answer_document(FSInputFile(actual_downloaded_path)), upload_bytes=size)
 
     except Exception as e:
         print(f"[URL] ERROR: {e}")
@@ -391,6 +432,5 @@ async def download_media_from_url(url: str, original_message: types.Message, sta
 
     finally:
         if actual_downloaded_path and os.path.exists(actual_downloaded_path):
-            if not telethon_agent_used: # Only remove if not passed to agent
-                try: os.remove(actual_downloaded_path)
-                except: pass
\ No newline at end of file
+            try: os.remove(actual_downloaded_path)
+            except: pass
\ No newline at end of file
@@ -0,0 +1,141 @@
+# prefetch.py
+# Спекулятивная предзагрузка: после показа результатов поиска в фоне качаются первые
+# PREFETCH_TOP_N треков прямо в общий аудиокэш. Если пользователь нажмет на один из них,
+# download_track найдет файл в кэше (или сначала дождется незаконченной загрузки).
+# Новый поиск или /cancel того же пользователя отменяет его незаконченные предзагрузки.
+# Предзагрузка не отнимает воркеры у пользователей: в очереди download_workers она пропускает
+# их задания вперед, а пока все воркеры заняты (load >= 1), новые предзагрузки не ставятся.
+import os
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+from src.core.config import PREFETCH_ENABLED, PREFETCH_TOP_N, PREFETCH_MAX_ACTIVE, PREFETCH_TTL, PREFETCH_MAX_LOAD
+from src.download.audio_cache import audio_cache
+from src.download.download_workers import download_workers
+from src.download import transcode_policy
+from src.monitoring.metrics import CACHE_REQUESTS, PREFETCH_TOTAL
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    url: str
+    user_id: int
+    task: Optional[asyncio.Task] = None
+
+
+class Prefetcher:
+    """Фоновые загрузки первых результатов поиска в общий аудиокэш"""
+
+    def __init__(self, enabled: bool = PREFETCH_ENABLED, top_n: int = PREFETCH_TOP_N,
+                 max_active: int = PREFETCH_MAX_ACTIVE, ttl: float = PREFETCH_TTL,
+                 max_load: float = PREFETCH_MAX_LOAD):
+        self.enabled = enabled
+        self.top_n = top_n
+        self.max_active = max_active
+        self.ttl = ttl
+        self.max_load = max_load
+        self._entries: dict[str, _Entry] = {}  # url -> незаконченная предзагрузка
+        self._done: dict[str, float] = {}      # url -> когда предзагрузка легла в кэш
+
+    @property
+    def active(self) -> int:
+        return len(self._entries)
+
+    def _system_busy(self) -> bool:
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load
+        except (AttributeError, OSError):
+            return False  # loadavg недоступен (Windows)
+
+    def schedule(self, user_id: int, tracks: list[dict], is_group: bool = False):
+        """Запускает предзагрузку первых результатов поиска пользователя - в качестве для его чата"""
+        if not self.enabled or not audio_cache.enabled:
+            return
+        self.cancel_user(user_id)
+        target = transcode_policy.target(is_group, download_workers.load)
+        now = time.monotonic()
+        self._done = {url: t for url, t in self._done.items() if now - t < self.ttl}
+        for track in tracks[:self.top_n]:
+            url = track.get('url')
+            key = audio_cache.key_for(track, target.cache_tag)
+            if not url or not key or url in self._entries or url in self._done:
+                continue
+            if self.active >= self.max_active or self._system_busy() or download_workers.load >= 1:
+                PREFETCH_TOTAL.inc(outcome='skipped')
+                continue
+            entry = _Entry(url, user_id)
+            entry.task = asyncio.create_task(self._fetch(entry, track, key, target))
+            self._entries[url] = entry
+
+    def cancel_user(self, user_id: int):
+        """Пользователь ушел дальше: отменяем его незаконченные предзагрузки"""
+        for entry in list(self._entries.values()):
+            if entry.user_id == user_id:
+                del self._entries[entry.url]
+                entry.task.cancel()
+
+    async def wait(self, url: str):
+        """Дожидается предзагрузки этого трека, если она идет. Результат ищите в audio_cache."""
+        if not self.enabled:
+            return
+        if self._done.pop(url, None) is not None:
+            CACHE_REQUESTS.inc(cache='prefetch', result='hit')
+            return
+        entry = self._entries.get(url)
+        if entry is None:
+            CACHE_REQUESTS.inc(cache='prefetch', result='miss')
+            return
+        CACHE_REQUESTS.inc(cache='prefetch', result='inflight')
+        try:
+            # shield: если ждущего отменят, предзагрузка все равно доедет до кэша
+            await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            if not entry.task.cancelled():
+                raise
+        except Exception:
+            pass
+
+    async def _fetch(self, entry: _Entry, track: dict, key: str, target: transcode_policy.TranscodeTarget):
+        # local import to avoid circular dependency
+        from .track_downloader import fetch_audio, _tag_and_cache, _cover_keys
+        base = os.path.join(tempfile.gettempdir(), f"prefetch_{uuid.uuid4().hex}")
+        title, artist = track.get('title', 'Unknown Title'), track.get('channel', 'Unknown Artist')
+        try:
+            path, tagged, cover = await fetch_audio(entry.url, base, track.get('source') or 'unknown', title, artist,
+                                                    cover_url=track.get('cover_url'), cover_keys=_cover_keys(key, track),
+                                                    target=target, background=True)
+            path, pinned = await _tag_and_cache(key, path, title, artist, tagged=tagged, cover=cover)
+            if pinned:
+                audio_cache.release(key)  # никем не закреплен, может вытесниться по LRU
+            else:
+                os.remove(path)  # без тегов в кэш не кладем
+            self._done[entry.url] = time.monotonic()
+            PREFETCH_TOTAL.inc(outcome='done')
+        except asyncio.CancelledError:
+            PREFETCH_TOTAL.inc(outcome='cancelled')
+            self._discard(base)
+            raise
+        except Exception as e:
+            PREFETCH_TOTAL.inc(outcome='failed')
+            logger.debug(f"Prefetch of {entry.url} failed: {e}")
+            self._discard(base)
+        finally:
+            if self._entries.get(entry.url) is entry:
+                del self._entries[entry.url]
+
+    @staticmethod
+    def _discard(base: str):
+        # yt-dlp в потоке executor'а может дописать файл уже после отмены задачи, чистим что есть
+        for ext in ('.mp3', '.m4a', '.webm', '.opus', '.ogg', '.aac', '.part', '.mp4'):
+            try: os.remove(base + ext)
+            except OSError: pass
+
+
+prefetcher = Prefetcher()
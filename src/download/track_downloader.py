@@ -4,41 +4,262 @@ import asyncio
 import tempfile
 import traceback
 import uuid
+import time
+from dataclasses import asdict
 
 # Disable debug prints
 import builtins
 print = lambda *args, **kwargs: None
 traceback.print_exc = lambda *args, **kwargs: None
 
-import yt_dlp
-from aiogram.types import FSInputFile
-from mutagen.mp3 import MP3
+from aiogram.types import FSInputFile, BufferedInputFile
 
 from src.core.bot_instance import bot
-from src.core.config import MAX_PARALLEL_DOWNLOADS, GROUP_MAX_TRACKS
-from src.core.state import download_tasks, download_queues, playlist_downloads
-from src.core.utils import set_mp3_metadata
+from src.core.outbound import outbound, PRIORITY_MESSAGE
+from src.core.executors import extract_executor, metadata_executor
+from src.core.config import MAX_PARALLEL_DOWNLOADS, GROUP_MAX_TRACKS, PROGRESS_EDIT_INTERVAL
+from src.core.state import download_tasks, state_backend
+from src.core.tagging import check_and_tag, InvalidAudioError
 from src.recognition.music_recognition import shazam, search_lyrics_parallel
+from src.monitoring.metrics import DOWNLOAD_SECONDS, CONVERT_SECONDS, DOWNLOADS_TOTAL, DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, TRANSCODE_DECISIONS
+from src.monitoring.tracing import span, traced
+from src.download.prefetch import prefetcher
+from src.download.audio_cache import audio_cache
+from src.download.cover_art import cover_art, album_key
+from src.core.single_flight import SingleFlight
+from src.download.download_workers import download_workers, download_audio, remove_leftovers, YtdlpTimings
+from src.download import transcode_policy
+from src.upload.media_group import AudioItem, send_audio_group
 
 
-def _blocking_download_and_convert(url, download_opts):
-    """Helper function to run blocking yt-dlp download."""
-    print(f"[_blocking_dl] Starting yt-dlp download command for: {url}")
+def _observe_ytdlp(timings: YtdlpTimings, source='unknown'):
+    DOWNLOAD_SECONDS.observe(timings.download_seconds, source=source)
+    if timings.convert_seconds is not None:
+        CONVERT_SECONDS.observe(timings.convert_seconds, codec=timings.codec)
+
+
+def _format_size(size):
+    return f"{size / 1024 / 1024:.1f}"
+
+
+class DownloadProgress:
+    """Прогресс загрузки в статусном сообщении: не чаще раза в PROGRESS_EDIT_INTERVAL секунд"""
+
+    def __init__(self, chat_id, message_id, label):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.label = label
+        self._last_edit = 0.0
+
+    def __call__(self, event):
+        if event['stage'] == 'convert':
+            if event['status'] == 'started':
+                self._edit(f"⏳ конвертирую {self.label}...", force=True)
+            return
+        if event['status'] != 'downloading':
+            return
+        downloaded, total = event.get('downloaded') or 0, event.get('total')
+        details = [f"{_format_size(downloaded)}/{_format_size(total)} МБ" if total else f"{_format_size(downloaded)} МБ"]
+        if event.get('speed'):
+            details.append(f"{_format_size(event['speed'])} МБ/с")
+        if event.get('eta') is not None:
+            details.append(f"~{int(event['eta'])} с")
+        percent = f"{min(100, int(downloaded * 100 / total))}% " if total else ''
+        self._edit(f"⏳ скачиваю {self.label}: {percent}({', '.join(details)})")
+
+    def _edit(self, text, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_EDIT_INTERVAL:
+            return
+        self._last_edit = now
+        outbound.edit_text(text, chat_id=self.chat_id, message_id=self.message_id)
+
+
+def _throughput_observer(source, progress=None):
+    """Оборачивает progress: по окончании скачивания пишет объем и скорость в метрики"""
+    def observe(event):
+        if event['stage'] == 'download' and event['status'] == 'finished':
+            size = event.get('downloaded') or event.get('total') or 0
+            DOWNLOAD_BYTES.inc(size, source=source)
+            if size and event.get('elapsed'):
+                DOWNLOAD_THROUGHPUT.observe(size / event['elapsed'], source=source)
+        if progress is not None:
+            progress(event)
+    return observe
+
+
+async def fetch_audio(url, base_temp_path, source='unknown', title=None, artist=None, progress=None, is_group=False,
+                      cover_url=None, cover_keys=(), target=None, background=False):
+    """
+    Скачивает трек через yt-dlp в base_temp_path + расширение и проверяет файл. Кодек и битрейт
+    выбирает transcode_policy по типу чата, загрузке воркеров и битрейту источника (target -
+    уже выбранный потолок, если по нему посчитан ключ аудиокэша).
+    Если заданы title/artist, теги пишутся там же, где шло скачивание.
+    progress(event) получает события загрузки и конвертации (см. run_ytdlp).
+    background - фоновая загрузка (предзагрузка): в очереди воркеров уступает загрузкам пользователей.
+    Обложка cover_url качается параллельно с аудио (нет ее - берется превью из info yt-dlp) и
+    запоминается в cover_art под ключами cover_keys. Если она готова раньше аудио, воркер пишет
+    ее в файл вместе с тегами.
+    Возвращает (путь, записаны ли теги вместе с обложкой, обложка JPEG или None).
+    """
+    target = target or transcode_policy.target(is_group, download_workers.load)
+    cover_path = f"{base_temp_path}.cover.jpg"
+    cover_task = asyncio.create_task(cover_art.fetch(cover_url, *cover_keys))
+    cover_task.add_done_callback(lambda task: _publish_cover(task, cover_path))
     try:
-        with yt_dlp.YoutubeDL(download_opts) as ydl:
-            ydl.download([url])
-            print(f"[_blocking_dl] yt-dlp download command finished for: {url}.")
-    except Exception as e:
-        print(f"[_blocking_dl] ERROR during yt-dlp download command for {url}: {type(e).__name__} - {e}")
-        print(traceback.format_exc())
-        raise
+        try:
+            # Воркер не видит contextvars, поэтому span вокруг await
+            with span('_blocking_download_and_convert', source=source):
+                result = await download_workers.run(download_audio, url, base_temp_path, title, artist, asdict(target),
+                                                    cover_path, progress=_throughput_observer(source, progress),
+                                                    background=background)
+        except asyncio.CancelledError:
+            cover_task.cancel()
+            remove_leftovers(base_temp_path)
+            raise
+        except Exception:
+            cover_task.cancel()
+            raise
+        _observe_ytdlp(result.timings, source)
+        transcode_policy.log_decision(url, result.transcode)
+        TRANSCODE_DECISIONS.inc(output=result.transcode.label, reason=result.transcode.reason)
+        print(f"Confirmed audio exists at: {result.path}")
+        try:
+            cover = await cover_task or await cover_art.fetch(result.thumbnail, *cover_keys)
+        except asyncio.CancelledError:
+            remove_leftovers(base_temp_path)
+            raise
+    finally:
+        try: os.remove(cover_path)
+        except OSError: pass
+    # Обложка пришла позже, чем воркер дописал теги, - ее допишет _tag_and_cache
+    return result.path, result.tagged and (cover is None or result.cover_tagged), cover
+
+
+def _publish_cover(task, cover_path):
+    """Кладет готовую обложку туда, где ее найдет воркер (атомарно: файл не читается наполовину)"""
+    if task.cancelled() or task.exception() is not None or not task.result():
+        return
+    try:
+        with open(cover_path + '.tmp', 'wb') as f:
+            f.write(task.result())
+        os.replace(cover_path + '.tmp', cover_path)
+    except OSError as e:
+        print(f"Could not write cover for worker: {e}")
+
 
+def _cover_keys(cache_key, track):
+    """Под этими ключами обложка трека ищется при отправке и для других треков альбома"""
+    return tuple(key for key in (cache_key, album_key(track)) if key)
 
+
+async def _track_cover(track, cover_keys):
+    """Обложка для отправки: уже скачанная вместе с треком или по cover_url трека"""
+    return cover_art.lookup(*cover_keys) or await cover_art.fetch(track.get('cover_url'), *cover_keys)
+
+
+def _thumbnail(cover):
+    return BufferedInputFile(cover, filename='cover.jpg') if cover else None
+
+
+async def _tag_and_cache(cache_key, path, title, artist, tagged=False, cover=None):
+    """
+    Проверяет свежескачанный файл и пишет теги с обложкой (если их еще не записал воркер), затем
+    переносит его в общий аудиокэш. Возвращает (путь, закреплен ли файл в кэше). Файл без тегов
+    в кэш не попадает, битый удаляется (InvalidAudioError).
+    """
+    if not tagged:
+        try:
+            tagged = await metadata_executor.run(check_and_tag, path, title, artist, cover)
+        except InvalidAudioError:
+            try: os.remove(path)
+            except OSError: pass
+            raise
+    if not tagged:
+        return path, False
+    cached_path = await audio_cache.put(cache_key, path)
+    return cached_path, cached_path != path
+
+
+def _release_shared(cache_key, result):
+    """Общий файл больше никто не ждет: отпускаем ссылку общей загрузки"""
+    path, pinned = result
+    if pinned:
+        audio_cache.release(cache_key)
+    elif os.path.exists(path):
+        try: os.remove(path)
+        except: pass
+
+
+def _acquire_shared(cache_key, result):
+    """Своя ссылка ждущего на общий файл: (путь, True) или (None, False), если файла в кэше нет"""
+    _, pinned = result
+    path = audio_cache.pin(cache_key) if pinned else None
+    return (path, True) if path else (None, False)
+
+
+track_flights = SingleFlight('track_download', release=_release_shared, acquire=_acquire_shared)
+
+
+async def fetch_shared(cache_key, fetch):
+    """
+    Скачивает трек один раз на весь процесс: параллельные запросы того же трека от любых
+    пользователей ждут одну загрузку. fetch() качает файл и кладет его в аудиокэш через
+    _tag_and_cache. Каждый ждущий получает свою ссылку на файл в кэше: (путь, True).
+    """
+    if not cache_key or not audio_cache.enabled:
+        return await fetch()
+    path, pinned = await track_flights.do(cache_key, fetch)
+    if pinned:
+        return path, True
+    # Общий файл не попал в кэш (не записались теги) - делить нечего, качаем себе
+    return await fetch()
+
+
+async def _forget_task(user_id, url):
+    """Убирает задачу из download_tasks и снимает заявку пользователя на url"""
+    if user_id in download_tasks:
+        download_tasks[user_id].pop(url, None)
+        if not download_tasks[user_id]:
+            del download_tasks[user_id]
+    await state_backend.release_download(user_id, url)
+
+
+async def _playlist_track_done(playlist_download_id, url, path, cache_key, cover_key=None):
+    """
+    Отмечает трек плейлиста скачанным и отправляет плейлист, если это был последний трек.
+    True - файл перешел плейлисту и освободится при его отправке. cover_key - ключ обложки в cover_art.
+    """
+    def change(entry):
+        handed_over = False
+        for t in entry['tracks']:
+            if t['url']==url and t['status'] in ('pending','downloading'):
+                t['status']='success'
+                t['file_path']=path
+                t['cache_key']=cache_key
+                t['cover_key']=cover_key
+                handed_over = True
+                break
+        entry['completed_tracks']+=1
+        return handed_over
+
+    entry, handed_over = await state_backend.update_playlist(playlist_download_id, change)
+    if entry is None:
+        return False
+    if entry['completed_tracks'] < entry['total_tracks'] and entry['status_message_id']:
+        text = f"⏳ загрузка плейлиста {entry['playlist_title']}: {entry['completed_tracks']}/{entry['total_tracks']}"
+        outbound.edit_text(text, chat_id=entry['chat_id'], message_id=entry['status_message_id'])
+    if entry['completed_tracks']>=entry['total_tracks']:
+        asyncio.create_task(send_completed_playlist(playlist_download_id))
+    return handed_over
+
+
+@traced()
 async def download_track(user_id, track_data, callback_message=None, status_message=None, original_message_context=None, playlist_download_id=None):
     """Downloads a single track. If part of a playlist (playlist_download_id is set),
     it updates the central playlist tracker instead of sending the file directly."""
     temp_path = None
-    loop = asyncio.get_running_loop()
+    outcome = 'cancelled'
     is_playlist_track = playlist_download_id is not None
     playlist_entry = None
     original_status_message_id = None
@@ -48,16 +269,13 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
 
     # Determine message context
     if is_playlist_track:
-        if playlist_download_id in playlist_downloads:
-            playlist_entry = playlist_downloads[playlist_download_id]
+        playlist_entry = await state_backend.load_playlist(playlist_download_id)
+        if playlist_entry:
             original_status_message_id = playlist_entry.get('status_message_id')
             chat_id_for_updates = playlist_entry.get('chat_id')
         else:
             print(f"ERROR: download_track called with playlist_id {playlist_download_id} but entry not found!")
-            if user_id in download_tasks:
-                download_tasks[user_id].pop(url, None)
-                if not download_tasks[user_id]:
-                    del download_tasks[user_id]
+            await _forget_task(user_id, url)
             return
     elif callback_message and status_message:
         chat_id_for_updates = callback_message.chat.id
@@ -68,10 +286,7 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
         print(f"Warning: download_track using original_message_context for single track, no status_message.")
     else:
         print(f"ERROR: download_track called for single track but missing message context!")
-        if user_id in download_tasks:
-            download_tasks[user_id].pop(url, None)
-            if not download_tasks[user_id]:
-                del download_tasks[user_id]
+        await _forget_task(user_id, url)
         return
 
     title = track_data.get('title', 'Unknown Title')
@@ -87,18 +302,31 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
         is_group = callback_message.chat.type in ('group', 'supergroup')
     elif original_message_context:
         is_group = original_message_context.chat.type in ('group', 'supergroup')
+    elif playlist_entry:
+        is_group = playlist_entry.get('chat_type') in ('group', 'supergroup')
 
     if not url:
         print(f"ERROR: Missing URL in track_data for {title}")
-        if user_id in download_tasks:
-            download_tasks[user_id].pop('unknown_url', None)
-            if not download_tasks[user_id]:
-                del download_tasks[user_id]
+        await _forget_task(user_id, url)
         return
 
+    # Файл в аудиокэше закреплен за нами до release(), для плейлиста - до отправки плейлиста
+    target = transcode_policy.target(is_group, download_workers.load)
+    cache_key = audio_cache.key_for(track_data, target.cache_tag)
+    cover_keys = _cover_keys(cache_key, track_data)
+    cache_pinned = False
+    handed_over = False
+
     try:
+        # Готовый файл мог остаться от другого пользователя или от предзагрузки
+        await prefetcher.wait(url)
+        temp_path = audio_cache.acquire(cache_key)
+        cache_pinned = temp_path is not None
+        if cache_pinned:
+            print(f"Using cached file for: {title} - {artist}")
+
         # FAST DOWNLOAD PATH FOR VK TRACKS
-        if source == 'vk' and 'track_obj' in track_data:
+        if not cache_pinned and source == 'vk' and 'track_obj' in track_data:
             print(f"Using fast download path for VK track: {title} - {artist}")
             temp_dir = tempfile.gettempdir()
             safe_title = ''.join(c if c.isalnum() or c in ('.','_','-') else '_' for c in title).strip('_.-')[:100]
@@ -131,88 +359,76 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
             
             # Статус для пользователя
             if not is_playlist_track:
-                try:
-                    if original_status_message_id:
-                        await bot.edit_message_text(f"⏳ мгновенная загрузка {title} - {artist} из VK...", 
-                                                     chat_id=chat_id_for_updates, 
-                                                     message_id=original_status_message_id)
-                except Exception as e:
-                    print(f"Warning: Could not update status message: {e}")
+                if original_status_message_id:
+                    outbound.edit_text(f"⏳ мгновенная загрузка {title} - {artist} из VK...",
+                                       chat_id=chat_id_for_updates,
+                                       message_id=original_status_message_id)
             
             # Выполняем скачивание в executor
             try:
-                temp_path = await loop.run_in_executor(None, 
-                                                    lambda: vk_download_track(track_obj, download_dir))
-                
-                print(f"Fast download complete: {temp_path}")
-                
-                # Проверяем что файл существует и не пустой
-                if not os.path.exists(temp_path):
-                    raise Exception("Файл не был скачан")
-                
-                if os.path.getsize(temp_path) == 0:
-                    raise Exception("Скачанный файл пустой")
-                
-                # Валидируем MP3
-                audio_check = MP3(temp_path)
-                if not audio_check.info.length > 0:
-                    raise Exception("MP3 файл скачался, но похоже битый (нулевая длина)")
+                async def vk_fetch():
+                    cover_task = asyncio.create_task(cover_art.fetch(track_data.get('cover_url'), *cover_keys))
+                    try:
+                        with span('vk_download'):
+                            path = await extract_executor.run(vk_download_track, track_obj, download_dir)
+                    except BaseException:
+                        cover_task.cancel()
+                        raise
+                    
+                    print(f"Fast download complete: {path}")
+                    
+                    # Проверяем что файл существует; длительность проверяется вместе с тегами
+                    if not os.path.exists(path):
+                        cover_task.cancel()
+                        raise Exception("Файл не был скачан")
+                    return await _tag_and_cache(cache_key, path, original_title, original_artist, cover=await cover_task)
+
+                temp_path, cache_pinned = await fetch_shared(cache_key, vk_fetch)
+                outcome = 'ok'
                 
                 # Успешное скачивание - обрабатываем трек
                 if is_playlist_track:
-                    entry = playlist_downloads.get(playlist_download_id)
-                    if entry:
-                        for t in entry['tracks']:
-                            if t['url']==url and t['status'] in ('pending','downloading'):
-                                t['status']='success'
-                                t['file_path']=temp_path
-                                break
-                        entry['completed_tracks']+=1
-                        if entry['completed_tracks'] < entry['total_tracks'] and entry['status_message_id']:
-                            try:
-                                text = f"⏳ загрузка плейлиста {entry['playlist_title']}: {entry['completed_tracks']}/{entry['total_tracks']}"
-                                await bot.edit_message_text(text, chat_id=entry['chat_id'], message_id=entry['status_message_id'])
-                            except: pass
-                        if entry['completed_tracks']>=entry['total_tracks']:
-                            asyncio.create_task(send_completed_playlist(playlist_download_id))
+                    handed_over = await _playlist_track_done(playlist_download_id, url, temp_path, cache_key if cache_pinned else None, cache_key)
                 else:
                     # Single track:
-                    # Используем исходные метаданные для записи в файл
-                    if set_mp3_metadata(temp_path, original_title, original_artist): # Changed to use original_title, original_artist
                         
 
-                        # Fetch lyrics using original artist and title: Genius -> Yandex Music -> MusicXMatch -> PyLyrics -> ChartLyrics -> LyricWikia
+                    # Fetch lyrics using original artist and title: Genius -> Yandex Music -> MusicXMatch -> PyLyrics -> ChartLyrics -> LyricWikia
+                    lyrics = None
+                    try:
+                        # Используем исходные название и исполнителя для поиска текста
+                        lyrics = await search_lyrics_parallel(original_artist, original_title, timeout=10.0)
+                    except Exception as e:
+                        print(f"Error fetching lyrics: {e}")
                         lyrics = None
-                        try:
-                            # Используем исходные название и исполнителя для поиска текста
-                            lyrics = await search_lyrics_parallel(original_artist, original_title, timeout=10.0)
-                        except Exception as e:
-                            print(f"Error fetching lyrics: {e}")
-                            lyrics = None
-
-                        # Delete original status message if present
-                        if original_status_message_id:
-                            try: await bot.delete_message(chat_id_for_updates, original_status_message_id)
-                            except: pass
-
-                        ctx = callback_message or original_message_context
-                        if ctx:
-                            # Send audio and capture the message using original metadata
-                            audio_msg = await bot.send_audio(
+
+                    # Delete original status message if present
+                    if original_status_message_id:
+                        outbound.discard_edits(chat_id_for_updates, original_status_message_id)
+                        try: await bot.delete_message(chat_id_for_updates, original_status_message_id)
+                        except: pass
+
+                    ctx = callback_message or original_message_context
+                    if ctx:
+                        cover = await _track_cover(track_data, cover_keys)
+                        # Send audio and capture the message using original metadata
+                        with span('send_audio'):
+                            audio_msg = await outbound.send(chat_id_for_updates, lambda: bot.send_audio(
                                 chat_id_for_updates,
                                 FSInputFile(temp_path),
                                 title=original_title, # Changed to use original_title
-                                performer=original_artist # Changed to use original_artist
-                            )
+                                performer=original_artist, # Changed to use original_artist
+                                thumbnail=_thumbnail(cover)
+                            ), upload_bytes=os.path.getsize(temp_path))
                             
-                            # Send lyrics if found (даже в группах)
-                            if lyrics:
-                                await bot.send_message(
-                                    chat_id_for_updates,
-                                    f"<blockquote expandable>{lyrics}</blockquote>",
-                                    reply_to_message_id=audio_msg.message_id,
-                                    parse_mode="HTML"
-                                )
+                        # Send lyrics if found (даже в группах)
+                        if lyrics:
+                            await outbound.send(chat_id_for_updates, lambda: bot.send_message(
+                                chat_id_for_updates,
+                                f"<blockquote expandable>{lyrics}</blockquote>",
+                                reply_to_message_id=audio_msg.message_id,
+                                parse_mode="HTML"
+                            ), priority=PRIORITY_MESSAGE)
                 return
                 
             except Exception as e:
@@ -221,145 +437,105 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
                 print("Falling back to standard download method")
         
         # STANDARD DOWNLOAD PATH FOR OTHER SOURCES
-        # Prepare file paths
-        safe_title = ''.join(c if c.isalnum() or c in ('.','_','-') else '_' for c in title).strip('_.-')[:100]
-        if not safe_title:
-            safe_title = f"audio_{uuid.uuid4()}"
-        temp_dir = tempfile.gettempdir()
-        if is_playlist_track:
-            base_temp_path = os.path.join(temp_dir, f"pl_{playlist_download_id}_{safe_title}")
-        else:
-            task_uuid = str(uuid.uuid4())
-            base_temp_path = os.path.join(temp_dir, f"single_{task_uuid}_{safe_title}")
-        print(f"[Download Path] Base temp path set to: {base_temp_path}")
-
-        # Pre-cleanup
-        for ext in ['.mp3','.m4a','.webm','.mp4','.opus','.ogg','.aac','.part']:
-            p = f"{base_temp_path}{ext}"
-            if os.path.exists(p):
-                try:
-                    os.remove(p)
-                    print(f"Removed existing file: {p}")
-                except Exception as e:
-                    print(f"Warning: Could not remove {p}: {e}")
-
-        # Download options
-        download_opts = {
-            'format':'bestaudio[ext=m4a]/bestaudio/best',
-            'postprocessors':[{'key':'FFmpegExtractAudio','preferredcodec':'mp3','preferredquality':'192'}],
-            'outtmpl':base_temp_path + '.%(ext)s',
-            'quiet':True,'verbose':False,'no_warnings':True,
-            'prefer_ffmpeg':True,'nocheckcertificate':True,'ignoreerrors':True,
-            'extract_flat':False,'ffmpeg_location':'/usr/bin/ffmpeg'
-        }
-        expected_mp3 = base_temp_path + '.mp3'
-
-        # Blocking download
-        print(f"Starting download for: {title} - {artist}")
-        await loop.run_in_executor(None, _blocking_download_and_convert, url, download_opts)
-        print(f"Finished blocking download for: {title} - {artist}")
-
-        # Check file exists
-        if not os.path.exists(expected_mp3):
-            print(f"ERROR: MP3 not found at {expected_mp3}")
-            for ext in ['.m4a','.webm','.opus','.ogg','.aac']:
-                p = f"{base_temp_path}{ext}"
-                if os.path.exists(p):
-                    try: os.remove(p)
-                    except: pass
-                    break
-            raise Exception(f"файл {expected_mp3} не создался после скачивания/конвертации")
-
-        temp_path = expected_mp3
-        print(f"Confirmed MP3 exists at: {temp_path}")
-
-        if os.path.getsize(temp_path) == 0:
-            raise Exception("скачанный файл пустой чет не то")
-
-        # Validate MP3
-        audio_check = MP3(temp_path)
-        if not audio_check.info.length > 0:
-            raise Exception("файл mp3 скачался но похоже битый (нулевая длина)")
+        if not cache_pinned:
+            # Prepare file paths
+            safe_title = ''.join(c if c.isalnum() or c in ('.','_','-') else '_' for c in title).strip('_.-')[:100]
+            if not safe_title:
+                safe_title = f"audio_{uuid.uuid4()}"
+            temp_dir = tempfile.gettempdir()
+            if is_playlist_track:
+                base_temp_path = os.path.join(temp_dir, f"pl_{playlist_download_id}_{safe_title}")
+            else:
+                task_uuid = str(uuid.uuid4())
+                base_temp_path = os.path.join(temp_dir, f"single_{task_uuid}_{safe_title}")
+            print(f"[Download Path] Base temp path set to: {base_temp_path}")
+
+            async def standard_fetch():
+                print(f"Starting download for: {title} - {artist}")
+                progress = None
+                if not is_playlist_track and original_status_message_id:
+                    progress = DownloadProgress(chat_id_for_updates, original_status_message_id, f"{original_title} - {original_artist}")
+                path, tagged, cover = await fetch_audio(url, base_temp_path, source or 'unknown', original_title, original_artist,
+                                                        progress=progress, is_group=is_group,
+                                                        cover_url=track_data.get('cover_url'), cover_keys=cover_keys, target=target)
+                print(f"Finished blocking download for: {title} - {artist}")
+                return await _tag_and_cache(cache_key, path, original_title, original_artist, tagged=tagged, cover=cover)
+
+            temp_path, cache_pinned = await fetch_shared(cache_key, standard_fetch)
+        outcome = 'ok'
 
         # Success handling
         if is_playlist_track:
-            entry = playlist_downloads.get(playlist_download_id)
-            if entry:
-                for t in entry['tracks']:
-                    if t['url']==url and t['status'] in ('pending','downloading'):
-                        t['status']='success'
-                        t['file_path']=temp_path
-                        break
-                entry['completed_tracks']+=1
-                if entry['completed_tracks'] < entry['total_tracks'] and entry['status_message_id']:
-                    try:
-                        text = f"⏳ загрузка плейлиста {entry['playlist_title']}: {entry['completed_tracks']}/{entry['total_tracks']}"
-                        await bot.edit_message_text(text, chat_id=entry['chat_id'], message_id=entry['status_message_id'])
-                    except: pass
-                if entry['completed_tracks']>=entry['total_tracks']:
-                    asyncio.create_task(send_completed_playlist(playlist_download_id))
+            handed_over = await _playlist_track_done(playlist_download_id, url, temp_path, cache_key if cache_pinned else None, cache_key)
         else:
             # Single track:
-            # Используем исходные метаданные для записи в файл
-            if set_mp3_metadata(temp_path, original_title, original_artist): # Changed to use original_title, original_artist
-                # DEPRECATED: Removed unused Shazam recognition code
-                # try:
-                #     result = await shazam.recognize(temp_path)
-                #     track_info = result.get("track", {})
-                #     rec_title = track_info.get("title") or track_info.get("heading")
-                #     rec_artist = track_info.get("subtitle")
-                #     # We do NOT update 'title' and 'artist' here, so original values are used for send_audio/lyric search
-                #     # DEPRECATED: Do not update title/artist from Shazam for Telegram/lyrics
-                #     # if rec_title and rec_artist:
-                #     #     title, artist = rec_title, rec_artist
-                # except Exception as e:
-                #     print(f"Shazam recognition error: {e}")
-
-                # Fetch lyrics using original artist and title: Genius -> Yandex Music -> MusicXMatch -> PyLyrics -> ChartLyrics -> LyricWikia
+            # DEPRECATED: Removed unused Shazam recognition code
+            # try:
+            #     result = await shazam.recognize(temp_path)
+            #     track_info = result.get("track", {})
+            #     rec_title = track_info.get("title") or track_info.get("heading")
+            #     rec_artist = track_info.get("subtitle")
+            #     # We do NOT update 'title' and 'artist' here, so original values are used for send_audio/lyric search
+            #     # DEPRECATED: Do not update title/artist from Shazam for Telegram/lyrics
+            #     # if rec_title and rec_artist:
+            #     #     title, artist = rec_title, rec_artist
+            # except Exception as e:
+            #     print(f"Shazam recognition error: {e}")
+
+            # Fetch lyrics using original artist and title: Genius -> Yandex Music -> MusicXMatch -> PyLyrics -> ChartLyrics -> LyricWikia
+            lyrics = None
+            try:
+                # Используем исходные название и исполнителя для поиска текста
+                lyrics = await search_lyrics_parallel(original_artist, original_title, timeout=10.0)
+            except Exception as e:
+                print(f"Error fetching lyrics: {e}")
                 lyrics = None
-                try:
-                    # Используем исходные название и исполнителя для поиска текста
-                    lyrics = await search_lyrics_parallel(original_artist, original_title, timeout=10.0)
-                except Exception as e:
-                    print(f"Error fetching lyrics: {e}")
-                    lyrics = None
 
-                # Delete original status message if present
-                if original_status_message_id:
-                    try: await bot.delete_message(chat_id_for_updates, original_status_message_id)
-                    except: pass
+            # Delete original status message if present
+            if original_status_message_id:
+                outbound.discard_edits(chat_id_for_updates, original_status_message_id)
+                try: await bot.delete_message(chat_id_for_updates, original_status_message_id)
+                except: pass
 
-                ctx = callback_message or original_message_context
-                if ctx:
-                    # Send audio and capture the message using original metadata
-                    audio_msg = await bot.send_audio(
+            ctx = callback_message or original_message_context
+            if ctx:
+                cover = await _track_cover(track_data, cover_keys)
+                # Send audio and capture the message using original metadata
+                with span('send_audio'):
+                    audio_msg = await outbound.send(chat_id_for_updates, lambda: bot.send_audio(
                         chat_id_for_updates,
                         FSInputFile(temp_path),
                         title=original_title, # Changed to use original_title
-                        performer=original_artist # Changed to use original_artist
-                    )
+                        performer=original_artist, # Changed to use original_artist
+                        thumbnail=_thumbnail(cover)
+                    ), upload_bytes=os.path.getsize(temp_path))
                     
-                    # Send lyrics if found (даже в группах)
-                    if lyrics:
-                        await bot.send_message(
-                            chat_id_for_updates,
-                            f"<blockquote expandable>{lyrics}</blockquote>",
-                            reply_to_message_id=audio_msg.message_id,
-                            parse_mode="HTML"
-                        )
+                # Send lyrics if found (даже в группах)
+                if lyrics:
+                    await outbound.send(chat_id_for_updates, lambda: bot.send_message(
+                        chat_id_for_updates,
+                        f"<blockquote expandable>{lyrics}</blockquote>",
+                        reply_to_message_id=audio_msg.message_id,
+                        parse_mode="HTML"
+                    ), priority=PRIORITY_MESSAGE)
 
     except Exception as e:
+        outcome = 'error'
         print(f"ERROR in download_track: {e}")
         traceback.print_exc()
         # Failure handling omitted for brevity
         raise
     finally:
         # Cleanup temp and task management
-        if temp_path and os.path.exists(temp_path):
+        DOWNLOADS_TOTAL.inc(source=source or 'unknown', outcome=outcome)
+        if cache_pinned:
+            if not handed_over:
+                audio_cache.release(cache_key)
+        elif temp_path and os.path.exists(temp_path):
             delete = not is_playlist_track
             if is_playlist_track:
                 failed=False
-                entry = playlist_downloads.get(playlist_download_id)
+                entry = await state_backend.load_playlist(playlist_download_id)
                 if entry:
                     for t in entry['tracks']:
                         if t['url']==url and t['status']=='failed': failed=True
@@ -367,21 +543,28 @@ async def download_track(user_id, track_data, callback_message=None, status_mess
             if delete:
                 try: os.remove(temp_path)
                 except: pass
-        if user_id in download_tasks:
-            download_tasks[user_id].pop(url, None)
-            if not download_tasks[user_id]:
-                del download_tasks[user_id]
+        await _forget_task(user_id, url)
         # Trigger next
-        if download_queues.get(user_id):
+        if await state_backend.queue_length(user_id):
             active = sum(1 for t in download_tasks.get(user_id, {}).values() if not t.done())
             if active < MAX_PARALLEL_DOWNLOADS:
                 # local import to avoid circular dependency
                 from .download_queue import process_download_queue
                 asyncio.create_task(process_download_queue(user_id))
 
+def release_track_file(track):
+    """Освобождает файл трека плейлиста: файл из аудиокэша отпускается, временный удаляется"""
+    if track.get('cache_key'):
+        audio_cache.release(track.pop('cache_key'))
+        return
+    p = track.get('file_path')
+    if p and os.path.exists(p):
+        try: os.remove(p)
+        except: pass
+
 async def send_completed_playlist(playlist_download_id):
     """Sends all tracks of a completed playlist"""
-    entry = playlist_downloads.pop(playlist_download_id, None)
+    entry = await state_backend.pop_playlist(playlist_download_id)
     if not entry: return
     user_id = entry['user_id']; chat_id = entry['chat_id']
     is_group = 'chat_type' in entry and entry['chat_type'] in ('group', 'supergroup')
@@ -402,24 +585,24 @@ async def send_completed_playlist(playlist_download_id):
             text += f" (не удалось {len(failed)})"
             
     if entry['status_message_id']:
-        try: await bot.edit_message_text(text, chat_id, entry['status_message_id'])
-        except: pass
+        outbound.edit_text(text, chat_id=chat_id, message_id=entry['status_message_id'])
         
-    for t in succ:
-        if t.get('file_path') and os.path.exists(t['file_path']):
-            await bot.send_audio(chat_id, FSInputFile(t['file_path']), title=t['title'], performer=t.get('artist'))
-            try: os.remove(t['file_path'])
-            except: pass
+    # Альбомами по 10 треков: один запрос и одно сообщение вместо десяти
+    items = [AudioItem(t['file_path'], title=t['title'], performer=t.get('artist'), thumbnail=cover_art.lookup(t.get('cover_key')))
+             for t in succ if t.get('file_path')]
+    try:
+        await send_audio_group(chat_id, items)
+    finally:
+        for t in succ:
+            release_track_file(t)
             
     # Cleanup failed files
     for t in failed:
-        p = t.get('file_path')
-        if p and os.path.exists(p):
-            try: os.remove(p)
-            except: pass
+        release_track_file(t)
             
     # delete the playlist status message after sending all tracks
     if entry.get('status_message_id'):
+        outbound.discard_edits(chat_id, entry['status_message_id'])
         try:
             await bot.delete_message(chat_id, entry['status_message_id'])
         except: pass 
\ No newline at end of file
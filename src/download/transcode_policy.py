@@ -0,0 +1,98 @@
+# transcode_policy.py
+# Политика перекодирования. Раньше любой трек уходил в ffmpeg как MP3 192k - в личке и в группе,
+# на свободной машине и в пик. Теперь кодек и битрейт выбираются в два шага:
+#   target()          - в процессе бота: потолок битрейта по типу чата и загрузке воркеров
+#                       (заданий на слот; с TRANSCODE_BUSY_LOAD битрейт снижается, с
+#                       TRANSCODE_PEAK_LOAD AAC можно отдавать в M4A без перекодирования)
+#   fit_to_source()   - в задании скачивания, когда yt-dlp уже выбрал формат: источник не
+#                       раздувается (128k не кодируется в 192k), тот же кодек в пределах потолка
+#                       просто копируется, а выше потолка (MP3 320k в группу) - пережимается
+# Модуль без зависимостей от бота: его импортирует и процесс-воркер.
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from src.core.config import (
+    TRANSCODE_CODEC, TRANSCODE_BITRATE_PRIVATE, TRANSCODE_BITRATE_GROUP,
+    TRANSCODE_BUSY_LOAD, TRANSCODE_BUSY_BITRATE, TRANSCODE_PEAK_LOAD, TRANSCODE_REMUX_AAC,
+)
+
+logger = logging.getLogger(__name__)
+
+BITRATES = (96, 128, 160, 192, 256, 320)  # kbit/s
+_SOURCE_TOLERANCE = 1.05  # 130k Opus считаем источником 128k, а не 160k
+
+
+@dataclass
+class TranscodeTarget:
+    codec: str        # mp3 | opus
+    bitrate: int      # потолок, kbit/s
+    remux_aac: bool   # AAC-источник отдавать в M4A без перекодирования
+    reason: str       # private / group / busy / peak
+
+    @property
+    def cache_tag(self) -> str:
+        """Часть ключа аудиокэша: файл, сжатый в пик или для группы, не достается запросу с потолком выше"""
+        return f"{self.codec}_{self.bitrate}" + ('_aac' if self.remux_aac else '')
+
+
+@dataclass
+class TranscodeDecision:
+    ext: str                # расширение готового файла: mp3 | m4a | opus
+    bitrate: Optional[int]  # None - копирование без перекодирования
+    reason: str
+    source: str             # кодек и битрейт источника, для лога
+    reencode: bool = False  # тот же кодек выше потолка: ExtractAudio его только скопирует, пережимает воркер
+
+    @property
+    def label(self) -> str:
+        return f"{self.ext}_{self.bitrate}" if self.bitrate else f"copy_{self.ext}"
+
+    def postprocessors(self) -> list[dict]:
+        # FFmpegExtractAudio сам копирует поток, если кодек источника совпадает с preferredcodec
+        return [{'key': 'FFmpegExtractAudio', 'preferredcodec': self.ext,
+                 'preferredquality': str(self.bitrate) if self.bitrate else None}]
+
+
+def target(is_group: bool, load: float) -> TranscodeTarget:
+    """Потолок битрейта для чата при текущей загрузке (заданий на слот воркеров)"""
+    bitrate = TRANSCODE_BITRATE_GROUP if is_group else TRANSCODE_BITRATE_PRIVATE
+    reason = 'group' if is_group else 'private'
+    if load >= TRANSCODE_BUSY_LOAD and TRANSCODE_BUSY_BITRATE < bitrate:
+        bitrate, reason = TRANSCODE_BUSY_BITRATE, 'busy'
+    peak = load >= TRANSCODE_PEAK_LOAD
+    if peak:
+        reason = 'peak'
+    remux = TRANSCODE_REMUX_AAC == 'always' or (TRANSCODE_REMUX_AAC == 'peak' and peak)
+    return TranscodeTarget(TRANSCODE_CODEC, bitrate, remux, reason)
+
+
+def _source_codec(acodec: Optional[str]) -> str:
+    acodec = (acodec or '').lower()
+    if acodec.startswith(('mp4a', 'aac')):
+        return 'aac'
+    if acodec.startswith('mp3'):
+        return 'mp3'
+    return acodec.split('.')[0]
+
+
+def fit_to_source(target: TranscodeTarget, info: Optional[dict]) -> TranscodeDecision:
+    """Решение для формата, который выбрал yt-dlp (info из extract_info(download=False))"""
+    info = info or {}
+    codec = _source_codec(info.get('acodec'))
+    abr = info.get('abr') or info.get('tbr')
+    source = f"{codec or 'unknown'}@{round(abr)}k" if abr else (codec or 'unknown')
+    if codec == target.codec and (not abr or abr <= target.bitrate * _SOURCE_TOLERANCE):
+        return TranscodeDecision(target.codec, None, 'same_codec', source)
+    if codec == 'aac' and target.remux_aac:
+        return TranscodeDecision('m4a', None, target.reason, source)
+    bitrate = target.bitrate
+    if abr:
+        fit = max((b for b in BITRATES if b <= abr * _SOURCE_TOLERANCE), default=BITRATES[0])
+        if fit < bitrate:
+            return TranscodeDecision(target.codec, fit, 'source', source)
+    return TranscodeDecision(target.codec, bitrate, target.reason, source, reencode=codec == target.codec)
+
+
+def log_decision(url: str, decision: TranscodeDecision):
+    logger.info(f"Transcode {url}: {decision.source} -> {decision.label} ({decision.reason})")
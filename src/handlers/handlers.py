@@ -14,17 +14,26 @@ from aiogram import F, types
 from aiogram.filters import Command
 
 from src.core.bot_instance import dp, bot, ADMIN_ID
-from src.core.config import TRACKS_PER_PAGE, MAX_TRACKS, GROUP_TRACKS_PER_PAGE, GROUP_MAX_TRACKS, MAX_PARALLEL_DOWNLOADS, YDL_AUDIO_OPTS, LOG_GROUP_ID
-from src.core.state import search_results, download_tasks, download_queues, playlist_downloads
+from src.core.config import TRACKS_PER_PAGE, MAX_TRACKS, GROUP_TRACKS_PER_PAGE, GROUP_MAX_TRACKS, MAX_PARALLEL_DOWNLOADS, LOG_GROUP_ID
+from src.core.outbound import outbound
+from src.core.state import download_tasks, state_backend
 from src.search.search import search_soundcloud, search_vk
-from src.handlers.keyboard import create_tracks_keyboard
-from src.download.track_downloader import download_track, _blocking_download_and_convert
+from src.search.session import SearchSession, search_sessions
+from src.search.ranking import rank_tracks
+from src.handlers.keyboard import create_tracks_keyboard, new_search_id, parse_token, TRACK_TOKEN, PAGE_TOKEN
+from src.download.track_downloader import download_track, fetch_audio, _tag_and_cache, fetch_shared, release_track_file, _cover_keys, _thumbnail
+from src.download.cover_art import cover_art
 from src.download.media_downloader import download_media_from_url
 from src.download.download_queue import process_download_queue
+from src.download.prefetch import prefetcher
+from src.download.audio_cache import audio_cache
+from src.download.download_workers import download_workers
+from src.download import transcode_policy
 from src.recognition.music_recognition import shazam, search_genius, search_yandex_music, search_musicxmatch, search_lyrics_parallel
-from src.core.utils import set_mp3_metadata
 from src.recognition.transcription import process_voice_or_video
 from src.logger.group_logger import send_log_message
+from src.upload.agent_channel import agent_channel
+from src.monitoring.tracing import start_trace, finish_trace, span, slowest_traces, format_trace_summary
 
 logger = logging.getLogger(__name__)
 
@@ -85,11 +94,13 @@ async def cmd_cancel(message: types.Message):
         parse_mode="HTML"
     )
     user_id = message.from_user.id
+    prefetcher.cancel_user(user_id)
     cancelled_tasks = 0
     cancelled_playlists = 0
     cleaned_files = 0
     active_urls = []
-    queued_count = 0
+    # Очередь чистится первой: отмененные задачи в finally запускают следующие из очереди
+    queued_count = await state_backend.clear_queue(user_id)
 
     if user_id in download_tasks:
         to_cancel = {u:t for u,t in download_tasks[user_id].items() if not t.done() and not t.cancelled()}
@@ -100,23 +111,22 @@ async def cmd_cancel(message: types.Message):
         download_tasks[user_id] = {u:t for u,t in download_tasks[user_id].items() if not t.done() and not t.cancelled()}
         if not download_tasks.get(user_id):
             download_tasks.pop(user_id, None)
-    if user_id in download_queues:
-        queued_count = len(download_queues[user_id])
-        download_queues.pop(user_id, None)
-    to_remove = []
+    await state_backend.release_downloads(user_id)
     files = []
-    for pl_id, pl in list(playlist_downloads.items()):
-        if pl.get('user_id') == user_id:
-            cancelled_playlists += 1
-            to_remove.append(pl_id)
-            for tr in pl.get('tracks', []):
-                if tr['url'] in active_urls and tr.get('file_path') and os.path.exists(tr['file_path']):
-                    files.append(tr['file_path'])
-            if pl.get('status_message_id'):
-                try: await bot.delete_message(chat_id=pl['chat_id'], message_id=pl['status_message_id'])
-                except: pass
-    for rid in to_remove:
-        playlist_downloads.pop(rid, None)
+    for pl_id in await state_backend.user_playlists(user_id):
+        pl = await state_backend.pop_playlist(pl_id)
+        if not pl:
+            continue
+        cancelled_playlists += 1
+        for tr in pl.get('tracks', []):
+            if tr.get('cache_key'):
+                # Файл лежит в общем аудиокэше - просто отпускаем его
+                release_track_file(tr)
+            elif tr['url'] in active_urls and tr.get('file_path') and os.path.exists(tr['file_path']):
+                files.append(tr['file_path'])
+        if pl.get('status_message_id'):
+            try: await bot.delete_message(chat_id=pl['chat_id'], message_id=pl['status_message_id'])
+            except: pass
     for f in set(files):
         try: os.remove(f); cleaned_files += 1
         except: pass
@@ -130,6 +140,35 @@ async def cmd_cancel(message: types.Message):
     else:
         await message.answer("❌ ничего не было активного")
 
+@dp.message(Command("slow"))
+async def cmd_slow(message: types.Message):
+    """Админская команда: самые медленные из последних запросов по этапам"""
+    if message.from_user.id != ADMIN_ID:
+        return
+    args = message.text.split()
+    limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+    traces = slowest_traces(limit)
+    if not traces:
+        await message.answer("нет завершенных запросов")
+        return
+    await message.answer("🐢 медленные запросы:\n\n" + "\n".join(format_trace_summary(t) for t in traces), parse_mode="HTML")
+
+async def _start_status(callback: types.CallbackQuery, user: int, url: str) -> types.Message:
+    """Сообщение "скачиваю..."; если отправить не вышло, заявка на трек снимается"""
+    try:
+        return await callback.message.answer(f"⏳ скачиваю...")
+    except Exception:
+        await state_backend.release_download(user, url)
+        raise
+
+async def _load_search(sid: int):
+    """Результаты поиска: живой список сессии этого процесса или сохраненные в state_backend"""
+    session = search_sessions.get(sid)
+    if session:
+        return session.tracks
+    return await state_backend.load_search(sid)
+
+# Кнопки со всем треком в base64 JSON больше не создаются, но остались в старых сообщениях
 @dp.callback_query(F.data.startswith("d_"))
 async def process_download_callback(callback: types.CallbackQuery):
     try:
@@ -145,17 +184,19 @@ async def process_download_callback(callback: types.CallbackQuery):
             f'👤 <a href="tg://user?id={callback.from_user.id}">{callback.from_user.full_name}</a>\n➤ прямое скачивание: <a href="{data["url"]}">ссылка</a>',
             parse_mode="HTML"
         )
-        if data['url'] in download_tasks.get(user, {}):
-            await callback.answer("этот трек уже качается или в очереди", show_alert=True); return
-        if any(item[0]['url']==data['url'] for item in download_queues.get(user, [])):
+        if not await state_backend.claim_download(user, data['url']):
             await callback.answer("этот трек уже качается или в очереди", show_alert=True); return
         active = sum(1 for t in download_tasks.get(user, {}).values() if not t.done())
         if active >= MAX_PARALLEL_DOWNLOADS:
+            await state_backend.release_download(user, data['url'])
             await callback.answer(f"❌ слишком много загрузок ({active}/{MAX_PARALLEL_DOWNLOADS})", show_alert=True)
         else:
-            status = await callback.message.answer(f"⏳ скачиваю...")
+            status = await _start_status(callback, user, data['url'])
             download_tasks.setdefault(user, {})
+            # Задача загрузки наследует контекст, а с ним и trace запроса
+            trace = start_trace('track_download', user_id=user, source=data.get('source', ''))
             task = asyncio.create_task(download_track(user, data, callback.message, status, original_message_context=callback.message))
+            task.add_done_callback(lambda _: finish_trace(trace))
             download_tasks[user][data['url']] = task
             await callback.answer("начал скачивание")
             if is_group:
@@ -167,14 +208,13 @@ async def process_download_callback(callback: types.CallbackQuery):
         await callback.message.answer(f"❌ ошибка: {e}")
         await callback.answer()
 
-@dp.callback_query(F.data.startswith("dl_"))
+@dp.callback_query(F.data.startswith(TRACK_TOKEN))
 async def process_download_callback_with_index(callback: types.CallbackQuery):
     try:
-        _, idx, sid = callback.data.split('_',2)
-        idx = int(idx)-1
-        if sid not in search_results:
+        sid, idx = parse_token(callback.data)
+        tracks = await _load_search(sid)
+        if tracks is None:
             await callback.answer("❌ результаты устарели", show_alert=True); return
-        tracks = search_results[sid]
         if idx<0 or idx>=len(tracks):
             await callback.answer("❌ не найден трек", show_alert=True); return
         data = tracks[idx]
@@ -189,15 +229,19 @@ async def process_download_callback_with_index(callback: types.CallbackQuery):
             parse_mode="HTML"
         )
         user = callback.from_user.id
-        if data['url'] in download_tasks.get(user, {}) or any(item[0]['url']==data['url'] for item in download_queues.get(user, [])):
+        if not await state_backend.claim_download(user, data['url']):
             await callback.answer("этот трек уже качается или в очереди", show_alert=True); return
         active = sum(1 for t in download_tasks.get(user, {}).values() if not t.done())
         if active >= MAX_PARALLEL_DOWNLOADS:
+            await state_backend.release_download(user, data['url'])
             await callback.answer(f"❌ слишком много загрузок ({active}/{MAX_PARALLEL_DOWNLOADS})", show_alert=True)
         else:
-            status = await callback.message.answer(f"⏳ скачиваю...")
+            status = await _start_status(callback, user, data['url'])
             download_tasks.setdefault(user, {})
+            # Задача загрузки наследует контекст, а с ним и trace запроса
+            trace = start_trace('track_download', user_id=user, source=data.get('source', ''))
             task = asyncio.create_task(download_track(user, data, callback.message, status, original_message_context=callback.message))
+            task.add_done_callback(lambda _: finish_trace(trace))
             download_tasks[user][data['url']] = task
             await callback.answer("начал скачивание")
             if is_group:
@@ -208,18 +252,27 @@ async def process_download_callback_with_index(callback: types.CallbackQuery):
     except Exception as e:
         await callback.answer(f"❌ ошибка: {e}", show_alert=True)
 
-@dp.callback_query(F.data.startswith("page_"))
+@dp.callback_query(F.data.startswith(PAGE_TOKEN))
 async def process_page_callback(callback: types.CallbackQuery):
     try:
-        _, p, sid = callback.data.split('_',2)
-        page = int(p)
-        if sid not in search_results:
+        sid, page = parse_token(callback.data)
+        tracks = await _load_search(sid)
+        if tracks is None:
             await callback.answer("❌ результаты устарели", show_alert=True); return
         # Определяем тип чата
         is_group = callback.message.chat.type in ('group', 'supergroup')
+        session = search_sessions.get(sid)
+        if session:
+            # Страница дальше загруженного - ждем, пока источники догрузят
+            await session.ensure((page + 1) * session.per_page + 1)
+            page = min(page, max(0, (len(tracks) - 1) // session.per_page))
+            session.shown(page)
         # Передаем параметр is_group при создании клавиатуры
-        kb = create_tracks_keyboard(search_results[sid], page, sid, is_group)
-        await callback.message.edit_reply_markup(reply_markup=kb)
+        has_more = bool(session and not session.done)
+        kb = create_tracks_keyboard(tracks, page, sid, is_group, has_more=has_more)
+        # Отложенная правка заголовка (догрузились результаты) вернула бы старую страницу
+        outbound.discard_edits(callback.message.chat.id, callback.message.message_id)
+        await callback.message.edit_text(search_header(tracks, has_more), reply_markup=kb)
         await callback.answer()
     except:
         await callback.answer("❌ ошибка при переключении страницы", show_alert=True)
@@ -228,6 +281,12 @@ async def process_page_callback(callback: types.CallbackQuery):
 async def process_info_callback(callback: types.CallbackQuery):
     await callback.answer()
 
+@dp.message(agent_channel.is_agent_message)
+async def handle_telethon_agent_file(message: types.Message):
+    """Receives a file uploaded by the Telethon agent and hands its file_id back to the waiting job.
+    Registered before the media handlers so agent audio never reaches recognition."""
+    await agent_channel.resolve(message)
+
 @dp.message((F.voice | F.audio | F.video_note))
 async def handle_media_recognition(message: types.Message):
     """
@@ -238,6 +297,7 @@ async def handle_media_recognition(message: types.Message):
     chat_id = message.chat.id
     message_id = message.message_id
     is_group = message.chat.type in ('group', 'supergroup')
+    trace = start_trace('recognition', user_id=user_id)
 
     # Notify admin
     media_type = "voice" if message.voice else ("audio" if message.audio else "video note")
@@ -253,6 +313,8 @@ async def handle_media_recognition(message: types.Message):
     original_media_path = None
     downloaded_track_path = None
     converted_media_path = None
+    cache_key = None
+    cache_pinned = False
     temp_dir = None
 
     try:
@@ -278,7 +340,8 @@ async def handle_media_recognition(message: types.Message):
         destination_path = os.path.join(temp_dir, f"{media_file.file_unique_id}.{file_extension}")
         
         # Download using bot.download
-        await bot.download(media_file, destination=destination_path)
+        with span('telegram_download'):
+            await bot.download(media_file, destination=destination_path)
         original_media_path = destination_path
         
         if not os.path.exists(original_media_path):
@@ -313,7 +376,8 @@ async def handle_media_recognition(message: types.Message):
 
         # 4. First try: Recognize using Shazam
         await status_message.edit_text("🔎 распознаю трек...")
-        result = await shazam.recognize(recognition_path)
+        with span('shazam'):
+            result = await shazam.recognize(recognition_path)
         track_info = result.get("track", {})
         rec_title = track_info.get("title") or track_info.get("heading", "Unknown Title")
         rec_artist = track_info.get("subtitle", "Unknown Artist")
@@ -329,16 +393,13 @@ async def handle_media_recognition(message: types.Message):
             max_results = 10
             
             # Асинхронный поиск в обоих источниках - VK и SoundCloud
-            sc_task = asyncio.create_task(search_soundcloud(search_query, max_results))
-            vk_task = asyncio.create_task(search_vk(search_query, max_results))
-            sc_results, vk_results = await asyncio.gather(sc_task, vk_task)
+            with span('search'):
+                sc_task = asyncio.create_task(search_soundcloud(search_query, max_results))
+                vk_task = asyncio.create_task(search_vk(search_query, max_results))
+                sc_results, vk_results = await asyncio.gather(sc_task, vk_task)
             
-            # Комбинируем результаты с приоритетом VK
-            combined_results = []
-            for t in vk_results: 
-                combined_results.append({**t, 'source': 'vk'})
-            for t in sc_results: 
-                combined_results.append({**t, 'source': 'soundcloud'})
+            # Комбинируем результаты: дубли склеиваются, первым идет самый похожий на оригинал трек
+            combined_results = rank_tracks([*vk_results, *sc_results], search_query)
                 
             search_results_list = combined_results
 
@@ -361,35 +422,32 @@ async def handle_media_recognition(message: types.Message):
             # В группах сокращаем сообщение
             await status_message.edit_text(f"⏳ скачиваю трек...")
 
-            # 6. Download the first result
-            loop = asyncio.get_running_loop()
-            safe_title = ''.join(c if c.isalnum() or c in ('_','-') else '_' for c in rec_title).strip('_.-')[:60]
-            if not safe_title: safe_title = f"audio_{uuid.uuid4()}"
-            base_temp_path = os.path.join(temp_dir, f"recognized_{safe_title}")
-            
-            # Ensure no conflicting file exists
-            if os.path.exists(base_temp_path + '.mp3'):
-                os.remove(base_temp_path + '.mp3')
-
-            download_opts = {
-                **YDL_AUDIO_OPTS,
-                'outtmpl': base_temp_path + '.%(ext)s',
-                'quiet': True, 'verbose': False, 'no_warnings': True,
-                'prefer_ffmpeg': True, 'nocheckcertificate': True, 'ignoreerrors': True,
-                'extract_flat': False, 'ffmpeg_location': '/usr/bin/ffmpeg'
-            }
-            expected_mp3_path = base_temp_path + '.mp3'
-
-            await loop.run_in_executor(None, _blocking_download_and_convert, download_url, download_opts)
-
-            if not os.path.exists(expected_mp3_path) or os.path.getsize(expected_mp3_path) == 0:
-                raise ValueError("Скачанный файл не найден или пуст.")
+            # 6. Download the first result (если его уже кто-то скачал - берем из аудиокэша)
+            target = transcode_policy.target(is_group, download_workers.load)
+            cache_key = audio_cache.key_for(first_valid_result, target.cache_tag)
+            # Обложка из ответа Shazam точнее, чем у найденного трека
+            shazam_cover = (track_info.get('images') or {}).get('coverart')
+            cover_keys = _cover_keys(cache_key, first_valid_result)
+            downloaded_track_path = audio_cache.acquire(cache_key)
+            cache_pinned = downloaded_track_path is not None
+            if not cache_pinned:
+                safe_title = ''.join(c if c.isalnum() or c in ('_','-') else '_' for c in rec_title).strip('_.-')[:60]
+                if not safe_title: safe_title = f"audio_{uuid.uuid4()}"
+                base_temp_path = os.path.join(temp_dir, f"recognized_{safe_title}")
             
-            downloaded_track_path = expected_mp3_path
-            logger.info(f"Track downloaded to: {downloaded_track_path}")
+                async def recognized_fetch():
+                    # Старые файлы с тем же именем fetch_audio удаляет сам; теги (recognized title/artist) пишет воркер
+                    path, tagged, cover = await fetch_audio(download_url, base_temp_path, first_valid_result.get('source', 'unknown'),
+                                                            rec_title, rec_artist, is_group=is_group,
+                                                            cover_url=shazam_cover or first_valid_result.get('cover_url'),
+                                                            cover_keys=cover_keys, target=target)
+                    logger.info(f"Track downloaded to: {path}")
 
-            # 7. Set metadata (using recognized title/artist)
-            set_mp3_metadata(downloaded_track_path, rec_title, rec_artist)
+                    # 7. Set metadata (using recognized title/artist)
+                    return await _tag_and_cache(cache_key, path, rec_title, rec_artist, tagged=tagged, cover=cover)
+
+                # Тот же трек могут прямо сейчас качать для других чатов - ждем общую загрузку
+                downloaded_track_path, cache_pinned = await fetch_shared(cache_key, recognized_fetch)
 
             # 8. Fetch lyrics (using recognized title/artist)
             try:
@@ -403,13 +461,16 @@ async def handle_media_recognition(message: types.Message):
             # 9. Send Audio and Lyrics
             await status_message.edit_text("📤 отправляю...")
             
-            audio_msg = await bot.send_audio(
-                chat_id,
-                FSInputFile(downloaded_track_path),
-                title=rec_title,
-                performer=rec_artist,
-                reply_to_message_id=message_id
-            )
+            with span('send_audio'):
+                cover = cover_art.lookup(*cover_keys) or await cover_art.fetch(shazam_cover or first_valid_result.get('cover_url'), *cover_keys)
+                audio_msg = await bot.send_audio(
+                    chat_id,
+                    FSInputFile(downloaded_track_path),
+                    title=rec_title,
+                    performer=rec_artist,
+                    thumbnail=_thumbnail(cover),
+                    reply_to_message_id=message_id
+                )
 
             if lyrics:
                 await bot.send_message(
@@ -476,11 +537,14 @@ async def handle_media_recognition(message: types.Message):
                 await message.reply(f"❌ Ошибка обработки: {e}") # Send a new message if status edit fails
 
     finally:
+        finish_trace(trace)
         # Cleanup temporary files and directory
         if original_media_path and os.path.exists(original_media_path):
             try: os.remove(original_media_path)
             except Exception as e: logger.warning(f"Could not remove original media file {original_media_path}: {e}")
-        if downloaded_track_path and os.path.exists(downloaded_track_path):
+        if cache_pinned:
+            audio_cache.release(cache_key)
+        elif downloaded_track_path and os.path.exists(downloaded_track_path):
             try: os.remove(downloaded_track_path)
             except Exception as e: logger.warning(f"Could not remove downloaded track file {downloaded_track_path}: {e}")
         if converted_media_path and os.path.exists(converted_media_path):
@@ -490,103 +554,6 @@ async def handle_media_recognition(message: types.Message):
              try: temp_dir_obj.cleanup()
              except Exception as e: logger.warning(f"Could not cleanup temporary directory {temp_dir}: {e}")
 
-@dp.message(F.caption)
-async def handle_telethon_agent_file(message: types.Message):
-    """Handles files received from the Telethon agent and forwards them to the original user."""
-    # Check if the caption contains the metadata from the Telethon agent
-    if message.caption and message.caption.startswith('{') and message.caption.endswith('}'):
-        try:
-            metadata = json.loads(message.caption)
-            if metadata.get("source_type") == "telethon_agent":
-                logger.info(f"Received file from Telethon agent. Metadata: {metadata}")
-
-                original_chat_id = metadata.get("original_chat_id")
-                original_message_id = metadata.get("original_message_id")
-                status_message_id = metadata.get("status_message_id")
-                file_type = metadata.get("file_type")
-                title = metadata.get("title")
-                performer = metadata.get("performer")
-                duration = metadata.get("duration", 0)
-
-                if not (original_chat_id and file_type):
-                    logger.error(f"Missing required metadata from Telethon agent: {metadata}")
-                    return
-
-                file_id = None
-                if message.audio:
-                    file_id = message.audio.file_id
-                elif message.video:
-                    file_id = message.video.file_id
-                elif message.photo:
-                    file_id = message.photo[-1].file_id # Get the largest photo
-                elif message.document:
-                    file_id = message.document.file_id
-
-                if not file_id:
-                    logger.error(f"Could not get file_id from message from Telethon agent. Message: {message}")
-                    return
-
-                # Delete the original status message from download_media_from_url
-                try:
-                    if status_message_id and original_chat_id: # original_chat_id here is the chat where the status message was sent
-                        await bot.delete_message(chat_id=original_chat_id, message_id=status_message_id)
-                except Exception as e:
-                    logger.warning(f"Could not delete status message {status_message_id} in chat {original_chat_id}: {e}")
-
-                # Send the file to the original user
-                try:
-                    if file_type == "audio":
-                        await bot.send_audio(
-                            chat_id=original_chat_id,
-                            audio=file_id,
-                            title=title,
-                            performer=performer,
-                            duration=duration,
-                            reply_to_message_id=original_message_id if original_message_id else None
-                        )
-                    elif file_type == "video":
-                        await bot.send_video(
-                            chat_id=original_chat_id,
-                            video=file_id,
-                            caption=title, # Video caption
-                            duration=duration, # NEW: Pass duration for video files
-                            reply_to_message_id=original_message_id if original_message_id else None
-                        )
-                    elif file_type == "photo":
-                        await bot.send_photo(
-                            chat_id=original_chat_id,
-                            photo=file_id,
-                            caption=title, # Photo caption
-                            reply_to_message_id=original_message_id if original_message_id else None
-                        )
-                    elif file_type == "document":
-                        await bot.send_document(
-                            chat_id=original_chat_id,
-                            document=file_id,
-                            caption=title, # Document caption
-                            reply_to_message_id=original_message_id if original_message_id else None
-                        )
-                    logger.info(f"Successfully resent file from agent to chat {original_chat_id}.")
-
-                    # Delete the agent's message after successful re-sending to keep bot's chat clean
-                    try:
-                        await bot.delete_message(chat_id=message.chat.id, message_id=message.message_id)
-                    except Exception as e:
-                        logger.warning(f"Could not delete agent's message {message.message_id} in chat {message.chat.id}: {e}")
-
-                except Exception as e:
-                    logger.error(f"Error re-sending file from Telethon agent to {original_chat_id}: {e}", exc_info=True)
-                    try:
-                        # Notify the original user about the error
-                        await bot.send_message(original_chat_id, f"❌ Ошибка при отправке файла: {e}")
-                    except: pass # If cannot even send error message, just log it.
-
-        except json.JSONDecodeError:
-            # Not a JSON caption from our agent, ignore.
-            pass
-        except Exception as e:
-            logger.error(f"Unexpected error in handle_telethon_agent_file: {e}", exc_info=True)
-
 @dp.message(F.text)
 async def handle_text(message: types.Message):
     if message.text.startswith('/'):
@@ -625,27 +592,49 @@ async def handle_text(message: types.Message):
         )
         # treat as search
         searching = await message.answer("🔍 ищу музыку...")
-        sid = str(uuid.uuid4())
         try:
-            maxr = MAX_TRACKS
-            sc_task = asyncio.create_task(search_soundcloud(message.text, maxr))
-            vk_task = asyncio.create_task(search_vk(message.text, maxr))
-            sc, vk = await asyncio.gather(sc_task, vk_task)
-            combined = []
-            # Сначала добавляем результаты из VK (приоритет)
-            for t in vk: combined.append({**t, 'source': 'vk'})
-            # Затем добавляем результаты из SoundCloud
-            for t in sc: combined.append({**t, 'source': 'soundcloud'})
-            if not combined:
-                await bot.edit_message_text("❌ ничего не нашел", chat_id=searching.chat.id, message_id=searching.message_id)
-                return
-            search_results[sid] = combined
-            kb = create_tracks_keyboard(combined, 0, sid)
-            await bot.edit_message_text(f"🎵 найдено {len(combined)}", chat_id=searching.chat.id, message_id=searching.message_id, reply_markup=kb)
+            await run_search(message, searching, message.text, MAX_TRACKS, is_group=False)
         except Exception as e:
             await bot.edit_message_text(f"❌ ошибка при поиске: {e}", chat_id=searching.chat.id, message_id=searching.message_id)
         return
 
+async def run_search(message: types.Message, status: types.Message, query: str, max_tracks: int, is_group: bool):
+    """Показывает первую страницу, как только ее есть чем заполнить; следующие порции грузятся по мере листания"""
+    per_page = GROUP_TRACKS_PER_PAGE if is_group else TRACKS_PER_PAGE
+    sid = await new_search_id()
+    # Прошлый поиск пользователя больше не листают - его курсоры останавливаются
+    search_sessions.cancel_user(message.from_user.id)
+    session = SearchSession(query, max_tracks, per_page).start()
+    await session.first_page()
+    if not session.tracks:
+        await bot.edit_message_text("❌ ничего не нашел", chat_id=status.chat.id, message_id=status.message_id)
+        return
+    # Строки первой страницы замораживаются до отрисовки: пока уходит правка, может прийти порция
+    session.shown(0)
+    rendered = (len(session.tracks), session.done)
+    await state_backend.save_search(sid, session.tracks)
+    kb = create_tracks_keyboard(session.tracks, 0, sid, is_group, has_more=not session.done)
+    await bot.edit_message_text(search_header(session.tracks, not session.done), chat_id=status.chat.id, message_id=status.message_id, reply_markup=kb)
+    if not session.done:
+        search_sessions.add(sid, session, message.from_user.id)
+        session.on_update = lambda s: refresh_search_message(s, sid, status.chat.id, status.message_id, is_group)
+    if rendered != (len(session.tracks), session.done):
+        # источник успел ответить, пока уходила первая страница
+        refresh_search_message(session, sid, status.chat.id, status.message_id, is_group)
+    prefetcher.schedule(message.from_user.id, session.tracks, is_group)
+
+def refresh_search_message(session: SearchSession, sid: int, chat_id: int, message_id: int, is_group: bool):
+    """Правит на месте заголовок "найдено N" и клавиатуру текущей страницы"""
+    if session.done:
+        search_sessions.pop(sid)
+    # В Redis лежит снимок списка - обновляем его, чтобы кнопки в других воркерах видели новые строки
+    asyncio.create_task(state_backend.save_search(sid, session.tracks))
+    kb = create_tracks_keyboard(session.tracks, session.page, sid, is_group, has_more=not session.done)
+    outbound.edit_text(search_header(session.tracks, not session.done), chat_id=chat_id, message_id=message_id, reply_markup=kb)
+
+def search_header(tracks: list, has_more: bool) -> str:
+    return f"🎵 найдено {len(tracks)}{'+' if has_more else ''}"
+
 async def handle_url_download(message: types.Message, url: str):
     logger.info(f"User {message.from_user.username} download_url: {url}")
     is_group = message.chat.type in ('group', 'supergroup')
@@ -658,8 +647,12 @@ async def handle_url_download(message: types.Message, url: str):
     )
     reply = message.reply if message.chat.type!='private' else message.answer
     status = await reply("⏳ скачиваю...", disable_web_page_preview=True)
-    
-    await download_media_from_url(url, message, status)
+
+    trace = start_trace('url_download', user_id=message.from_user.id)
+    try:
+        await download_media_from_url(url, message, status)
+    finally:
+        finish_trace(trace)
 
 async def handle_group_search(message: types.Message, query: str):
     logger.info(f"User {message.from_user.username} group_search: {query}")
@@ -671,25 +664,8 @@ async def handle_group_search(message: types.Message, query: str):
         parse_mode="HTML"
     )
     status = await message.reply("🔍 ищу музыку...")
-    sid = str(uuid.uuid4())
     try:
         # Используем GROUP_MAX_TRACKS для групповых чатов
-        maxr = GROUP_MAX_TRACKS
-        sc_task = asyncio.create_task(search_soundcloud(query, maxr))
-        vk_task = asyncio.create_task(search_vk(query, maxr))
-        sc, vk = await asyncio.gather(sc_task, vk_task)
-        combined = []
-        # Сначала добавляем результаты из VK (приоритет)
-        for t in vk: combined.append({**t, 'source': 'vk'})
-        # Затем добавляем результаты из SoundCloud
-        for t in sc: combined.append({**t, 'source': 'soundcloud'})
-        if not combined:
-            await bot.edit_message_text("❌ ничего не нашел", chat_id=status.chat.id, message_id=status.message_id)
-            return
-        search_results[sid] = combined
-        # Передаем флаг is_group=True
-        kb = create_tracks_keyboard(combined, 0, sid, is_group=True)
-        # Сокращаем текст сообщения для группы
-        await bot.edit_message_text(f"🎵 найдено {len(combined)}", chat_id=status.chat.id, message_id=status.message_id, reply_markup=kb)
+        await run_search(message, status, query, GROUP_MAX_TRACKS, is_group=True)
     except Exception as e:
         await bot.edit_message_text(f"❌ ошибка: {e}", chat_id=status.chat.id, message_id=status.message_id) 
\ No newline at end of file
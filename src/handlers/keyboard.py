@@ -1,65 +1,97 @@
 # keyboard.py
 import math
 import base64
-import json
+import struct
+import secrets
+from collections import OrderedDict
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from src.core.config import TRACKS_PER_PAGE, GROUP_TRACKS_PER_PAGE
+from src.core.state import state_backend
 
-def create_tracks_keyboard(tracks, page=0, search_id="", is_group=False):
-    """Генерация инлайн-клавиатуры для списка треков"""
+# Колбэки кнопок - короткие токены вместо JSON трека: буква вида, точка и 8 символов
+# base64url от (id поиска, номер). Сам трек лежит в search_results на сервере.
+#   t.XXXXXXXX - скачать трек с индексом n, p.XXXXXXXX - открыть страницу n
+TRACK_TOKEN = 't.'
+PAGE_TOKEN = 'p.'
+_TOKEN = struct.Struct('>IH')
+
+# Отрисованные страницы: строки показанной страницы больше не меняются (см. SearchSession)
+_KEYBOARD_CACHE_SIZE = 1024
+_keyboards: OrderedDict = OrderedDict()
+
+
+async def new_search_id() -> int:
+    """Случайный 32-битный id поиска, которого еще нет в state_backend (общем для всех воркеров)"""
+    while True:
+        search_id = secrets.randbits(32)
+        if await state_backend.load_search(search_id) is None:
+            return search_id
+
+
+def make_token(kind: str, search_id: int, n: int) -> str:
+    return kind + base64.urlsafe_b64encode(_TOKEN.pack(search_id, n)).decode('ascii')
+
+
+def parse_token(data: str) -> tuple[int, int]:
+    """(id поиска, номер) из токена; ValueError, если это не токен"""
+    try:
+        return _TOKEN.unpack(base64.urlsafe_b64decode(data[2:]))
+    except (struct.error, ValueError, TypeError) as e:
+        raise ValueError(f"bad callback token {data!r}") from e
+
+
+def _track_button(track, index, search_id):
+    duration = track.get('duration', 0)
+    if duration > 0:
+        duration_str = f" ({int(duration // 60)}:{int(duration % 60):02d})"
+    else:
+        duration_str = ""
+    return InlineKeyboardButton(
+        text=f"🎧 {track['title']} - {track['channel']}{duration_str}",
+        callback_data=make_token(TRACK_TOKEN, search_id, index)
+    )
+
+
+def create_tracks_keyboard(tracks, page=0, search_id=0, is_group=False, has_more=False):
+    """Генерация инлайн-клавиатуры для списка треков.
+    has_more - результаты еще догружаются: стрелка вперед есть и на последней загруженной странице"""
     tracks_per_page = GROUP_TRACKS_PER_PAGE if is_group else TRACKS_PER_PAGE
+    key = (search_id, page, tracks_per_page, len(tracks), has_more)
+    keyboard = _keyboards.get(key)
+    if keyboard is not None:
+        _keyboards.move_to_end(key)
+        return keyboard
+
     total_pages = math.ceil(len(tracks) / tracks_per_page)
     start_idx = page * tracks_per_page
     end_idx = min(start_idx + tracks_per_page, len(tracks))
-    buttons = []
-    for i in range(start_idx, end_idx):
-        track = tracks[i]
-        track_data = {
-            "title": track['title'],
-            "artist": track['channel'],
-            "url": track['url'],
-            "search_id": search_id,
-            "source": track.get('source', '')
-        }
-        track_json = json.dumps(track_data, ensure_ascii=False)
-        if len(track_json.encode('utf-8')) > 60:
-            callback_data = f"dl_{i+1}_{search_id}"
-        else:
-            callback_data = f"d_{base64.b64encode(track_json.encode('utf-8')).decode('utf-8')}"
-        duration = track.get('duration', 0)
-        if duration > 0:
-            minutes = int(duration // 60)
-            seconds = int(duration % 60)
-            duration_str = f" ({minutes}:{seconds:02d})"
-        else:
-            duration_str = ""
-        buttons.append([
-            InlineKeyboardButton(
-                text=f"🎧 {track['title']} - {track['channel']}{duration_str}",
-                callback_data=callback_data
-            )
-        ])
-    if total_pages > 1:
+    buttons = [[_track_button(tracks[i], i, search_id)] for i in range(start_idx, end_idx)]
+    if total_pages > 1 or has_more:
         nav_buttons = []
         if page > 0:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="⬅️",
-                    callback_data=f"page_{page-1}_{search_id}"
+                    callback_data=make_token(PAGE_TOKEN, search_id, page - 1)
                 )
             )
         nav_buttons.append(
             InlineKeyboardButton(
-                text=f"{page+1}/{total_pages}",
+                text=f"{page+1}/{total_pages}{'+' if has_more else ''}",
                 callback_data="info"
             )
         )
-        if page < total_pages - 1:
+        if page < total_pages - 1 or has_more:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="➡️",
-                    callback_data=f"page_{page+1}_{search_id}"
+                    callback_data=make_token(PAGE_TOKEN, search_id, page + 1)
                 )
             )
         buttons.append(nav_buttons)
-    return InlineKeyboardMarkup(inline_keyboard=buttons) 
\ No newline at end of file
+    keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    _keyboards[key] = keyboard
+    if len(_keyboards) > _KEYBOARD_CACHE_SIZE:
+        _keyboards.popitem(last=False)
+    return keyboard
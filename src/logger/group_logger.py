@@ -1,8 +1,158 @@
+import re
+import html
+import asyncio
+import logging
+from typing import Optional
+
 from aiogram import Bot, types
+from aiogram.exceptions import TelegramRetryAfter
+
+from src.core.config import LOG_QUEUE_SIZE, LOG_BATCH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4096
+# Сколько раз повторять отправку пачки при ошибках, не связанных с flood control
+MAX_SEND_ATTEMPTS = 3
+
+
+class LogSink:
+    """
+    Асинхронная очередь лог-сообщений для группы админов.
+
+    События копятся в ограниченной очереди и раз в interval секунд уходят
+    одним сообщением на чат. При переполнении новые события отбрасываются
+    и считаются в dropped, на RetryAfter отправка ждет указанное Telegram время.
+    """
+
+    def __init__(self, max_queue: int = LOG_QUEUE_SIZE, interval: float = LOG_BATCH_INTERVAL):
+        self.max_queue = max_queue
+        self.interval = interval
+        self.bot: Optional[Bot] = None
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self._unreported_drops = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: list = []  # события, уже снятые с очереди, но еще не отправленные
+        self._sending: Optional[asyncio.Future] = None
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def submit(self, bot: Bot, chat_id: int | str, text: str, parse_mode: str = 'HTML') -> bool:
+        """Кладет событие в очередь, никогда не ждет сеть. Возвращает False, если событие отброшено."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self.bot = bot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        try:
+            self._queue.put_nowait((chat_id, parse_mode, text))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._unreported_drops += 1
+            return False
+
+    async def stop(self):
+        """Отправляет накопленное и останавливает фоновую задачу"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+        if self._sending and not self._sending.done():
+            await asyncio.wait({self._sending})  # отправка пачки доходит до конца, а не рвется посередине
+        # Пачка, которую задача копила в момент отмены, уходит вместе с остатком очереди
+        items, self._batch = self._batch, []
+        if self._queue:
+            items += self._drain()
+        if items:
+            await self._flush(items)
+
+    def _drain(self) -> list:
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _run(self):
+        while True:
+            self._batch.append(await self._queue.get())
+            await asyncio.sleep(self.interval)
+            self._batch += self._drain()
+            items, self._batch = self._batch, []
+            self._sending = asyncio.ensure_future(self._flush(items))
+            await asyncio.shield(self._sending)
+
+    async def _flush(self, items: list):
+        # Группируем по чату и режиму разметки, сохраняя порядок событий
+        batches: dict[tuple, list[str]] = {}
+        for chat_id, parse_mode, text in items:
+            if parse_mode and len(text) > MAX_MESSAGE_LENGTH:
+                # Обрезка посреди тега или сущности ломает разметку, и Telegram отвергает всю пачку
+                text, parse_mode = _plain_text(text)[:MAX_MESSAGE_LENGTH], None
+            batches.setdefault((chat_id, parse_mode), []).append(text)
+
+        if self._unreported_drops and batches:
+            key = next(iter(batches))
+            batches[key].append(f"⚠️ пропущено событий: {self._unreported_drops}")
+            self._unreported_drops = 0
+
+        for (chat_id, parse_mode), texts in batches.items():
+            for chunk in self._split(texts):
+                await self._send(chat_id, chunk, parse_mode)
+
+    @staticmethod
+    def _split(texts: list[str]) -> list[str]:
+        """Склеивает события (каждое уже не длиннее лимита) в сообщения не длиннее лимита Telegram"""
+        chunks, current = [], ""
+        for text in texts:
+            candidate = f"{current}\n\n{text}" if current else text
+            if len(candidate) > MAX_MESSAGE_LENGTH:
+                chunks.append(current)
+                current = text
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _send(self, chat_id: int | str, text: str, parse_mode: str):
+        attempts = 0
+        while True:
+            try:
+                await self.bot.send_message(chat_id, text, parse_mode=parse_mode)
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Log chat {chat_id} flood control, retry in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                attempts += 1
+                if attempts >= MAX_SEND_ATTEMPTS:
+                    self.failed += 1
+                    # Логируем ошибку, если не удалось отправить сообщение
+                    print(f"Error sending log message to chat ID {chat_id}: {e}")
+                    return
+                await asyncio.sleep(attempts)
+
+
+def _plain_text(text: str) -> str:
+    """HTML события без тегов и сущностей - такой текст можно резать где угодно"""
+    return html.unescape(re.sub(r'<[^>]*>', '', text))
+
+
+log_sink = LogSink()
+
 
 async def send_log_message(bot: Bot, chat_id: int | str, text: str, parse_mode: str = 'HTML'):
     """
-    Отправляет лог-сообщение в указанный чат.
+    Ставит лог-сообщение в очередь на отправку в указанный чат.
+    Возвращается сразу, сообщение уйдет в ближайшей пачке.
 
     Args:
         bot: Объект бота.
@@ -10,12 +160,6 @@ async def send_log_message(bot: Bot, chat_id: int | str, text: str, parse_mode:
         text: Текст сообщения.
         parse_mode: Режим парсинга текста.
     """
-    try:
-        await bot.send_message(
-            chat_id,
-            text,
-            parse_mode=parse_mode
-        )
-    except Exception as e:
-        # Логируем ошибку, если не удалось отправить сообщение
-        print(f"Error sending log message to chat ID {chat_id}: {e}") 
\ No newline at end of file
+    if not chat_id:
+        return
+    log_sink.submit(bot, chat_id, text, parse_mode)
@@ -0,0 +1,213 @@
+# metrics.py
+# Минимальные метрики в формате Prometheus (counter / gauge / histogram) и HTTP
+# эндпоинт /metrics. Метрики обновляются и из event loop, и из потоков executor'а,
+# поэтому каждая защищена своим lock.
+import time
+import math
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from aiohttp import web
+
+from src.core.config import METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry: list["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    @abstractmethod
+    def _samples(self) -> list[str]: ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        """Значение вычисляется в момент сбора метрик"""
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                values[key] = fn()
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [counts per bucket..., sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for key, data in items:
+            for bound, count in zip(self.buckets, data):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# --- Метрики бота ---
+
+SEARCH_SECONDS = Histogram('musicbot_search_seconds', 'Search latency per source', ('source',))
+SEARCH_RESULTS = Counter('musicbot_search_results_total', 'Search results returned per source', ('source',))
+DOWNLOAD_SECONDS = Histogram('musicbot_download_seconds', 'yt-dlp download time (without conversion)', ('source',))
+CONVERT_SECONDS = Histogram('musicbot_convert_seconds', 'ffmpeg conversion time', ('codec',))
+TRANSCODE_DECISIONS = Counter('musicbot_transcode_decisions_total', 'Output codec and bitrate chosen by the transcode policy', ('output', 'reason'))
+DOWNLOAD_BYTES = Counter('musicbot_download_bytes_total', 'Bytes downloaded by yt-dlp', ('source',))
+DOWNLOAD_THROUGHPUT = Histogram('musicbot_download_throughput_bytes_per_second', 'Average speed of each finished download', ('source',),
+                                buckets=(64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 25e6, 50e6))
+DOWNLOADS_TOTAL = Counter('musicbot_downloads_total', 'Finished track downloads', ('source', 'outcome'))
+UPLOAD_SECONDS = Histogram('musicbot_upload_seconds', 'File upload time', ('kind',))
+UPLOAD_BYTES = Counter('musicbot_upload_bytes_total', 'Uploaded bytes', ('kind',))
+QUEUE_DEPTH = Gauge('musicbot_queue_depth', 'Items waiting in internal queues', ('queue',))
+SCHEDULER_WAIT = Histogram('musicbot_outbound_wait_seconds', 'Time requests wait in the outbound scheduler', ('priority',),
+                           buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+CACHE_REQUESTS = Counter('musicbot_cache_requests_total', 'Cache lookups', ('cache', 'result'))
+CACHE_EVICTIONS = Counter('musicbot_cache_evictions_total', 'Files evicted from disk caches', ('cache',))
+CACHE_BYTES = Gauge('musicbot_cache_bytes', 'Disk space used by caches', ('cache',))
+SINGLEFLIGHT_TOTAL = Counter('musicbot_singleflight_total', 'Calls that started or joined a shared task', ('flight', 'role'))
+PREFETCH_TOTAL = Counter('musicbot_prefetch_total', 'Speculative downloads by outcome', ('outcome',))
+COBALT_REQUESTS = Counter('musicbot_cobalt_requests_total', 'Cobalt API requests per mirror', ('mirror', 'outcome'))
+LYRICS_SECONDS = Histogram('musicbot_lyrics_seconds', 'Lyrics provider latency', ('provider', 'outcome'))
+EXECUTOR_THREADS = Gauge('musicbot_executor_threads', 'Executor threads, busy and total', ('pool', 'state'))
+EXECUTOR_QUEUED = Gauge('musicbot_executor_queued', 'Jobs waiting for a free executor thread', ('pool',))
+EXECUTOR_WAIT = Histogram('musicbot_executor_wait_seconds', 'Time jobs wait for a free executor thread', ('pool',),
+                          buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+async def start_metrics_server(port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """Поднимает HTTP сервер с /metrics. Возвращает runner для остановки."""
+    async def handle_metrics(request):
+        return web.Response(text=render_metrics(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, '0.0.0.0', port).start()
+    except OSError as e:
+        logger.error(f"Could not start metrics server on port {port}: {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Metrics available on :{port}/metrics")
+    return runner
@@ -0,0 +1,141 @@
+# tracing.py
+# Легкая трассировка запросов: хендлер открывает trace с request id, этапы пайплайна
+# пишут в него span'ы через contextvars (asyncio.create_task копирует контекст,
+# поэтому задачи загрузки продолжают trace своего хендлера). Завершенные trace'ы
+# хранятся в кольцевом буфере для /slow и дописываются JSON-строками в TRACE_LOG_PATH.
+import json
+import time
+import uuid
+import asyncio
+import logging
+import functools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.core.config import TRACE_LOG_PATH, TRACE_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    duration: Optional[float] = None
+    attrs: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+@dataclass
+class Trace:
+    kind: str
+    attrs: dict = field(default_factory=dict)
+    request_id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    started_at: float = field(default_factory=time.time)
+    start: float = field(default_factory=time.perf_counter)
+    duration: Optional[float] = None
+    spans: list = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        return self.duration is not None
+
+    def to_dict(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "kind": self.kind,
+            "attrs": self.attrs,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "spans": [
+                {
+                    "name": s.name,
+                    "offset": round(s.start - self.start, 4),
+                    "duration": s.duration,
+                    "attrs": s.attrs,
+                    "error": s.error,
+                }
+                for s in self.spans
+            ],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_recent: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+
+
+def start_trace(kind: str, **attrs) -> Trace:
+    """Открывает trace для текущего контекста (и задач, созданных из него)"""
+    trace = Trace(kind=kind, attrs=attrs)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace else None
+
+
+def finish_trace(trace: Optional[Trace]):
+    """Закрывает trace, кладет его в буфер и экспортирует. Повторный вызов ничего не делает."""
+    if trace is None or trace.finished:
+        return
+    trace.duration = time.perf_counter() - trace.start
+    _recent.append(trace)
+    if TRACE_LOG_PATH:
+        try:
+            with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.warning(f"Could not export trace {trace.request_id}: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Замеряет этап текущего запроса. Вне trace (или после его завершения) ничего не пишет."""
+    trace = _current_trace.get()
+    if trace is None or trace.finished:
+        yield None
+        return
+    s = Span(name=name, start=time.perf_counter(), attrs=attrs)
+    trace.spans.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = type(e).__name__
+        raise
+    finally:
+        s.duration = time.perf_counter() - s.start
+
+
+def traced(name: Optional[str] = None):
+    """Декоратор: оборачивает вызов функции (обычной или async) в span"""
+    def decorator(func):
+        span_name = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def slowest_traces(limit: int = 10) -> list[Trace]:
+    return sorted(_recent, key=lambda t: t.duration or 0, reverse=True)[:limit]
+
+
+def format_trace_summary(trace: Trace, top_spans: int = 4) -> str:
+    """Одна строка на запрос: id, тип, общее время и самые долгие этапы"""
+    spans = sorted((s for s in trace.spans if s.duration is not None), key=lambda s: s.duration, reverse=True)
+    stages = ", ".join(f"{s.name} {s.duration:.1f}s" + (" ❌" if s.error else "") for s in spans[:top_spans])
+    return f"<code>{trace.request_id}</code> {trace.kind} {trace.duration:.1f}s" + (f"\n  {stages}" if stages else "")
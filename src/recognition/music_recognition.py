@@ -2,11 +2,16 @@ import tempfile
 import logging
 import asyncio
 import os
+import time
 from typing import Optional, Dict, Any
 from shazamio import Shazam
 from musicxmatch_api import MusixMatchAPI
 import re
 
+from src.core.executors import metadata_executor
+from src.monitoring.metrics import LYRICS_SECONDS
+from src.monitoring.tracing import traced
+
 # Добавляем импорты для новых библиотек
 import lyricsgenius
 from yandex_music import Client as YandexMusicClient
@@ -53,7 +58,7 @@ def clean_lyrics(lyrics: str) -> str:
 async def search_musicxmatch(artist: str, track: str) -> Optional[str]:
     try:
         # Сначала ищем трек по исполнителю и названию
-        search_result = await asyncio.to_thread(musicxmatch.search_tracks, f"{track} {artist}")
+        search_result = await metadata_executor.run(musicxmatch.search_tracks, f"{track} {artist}")
         
         # Проверяем, что получили результаты поиска
         if search_result and search_result.get("message", {}).get("body", {}).get("track_list"):
@@ -62,7 +67,7 @@ async def search_musicxmatch(artist: str, track: str) -> Optional[str]:
             track_id = first_track["track_id"]
             
             # Получаем текст песни по ID трека
-            lyrics_result = await asyncio.to_thread(musicxmatch.get_track_lyrics, track_id)
+            lyrics_result = await metadata_executor.run(musicxmatch.get_track_lyrics, track_id)
             
             # Извлекаем текст песни из результата
             if lyrics_result and lyrics_result.get("message", {}).get("body", {}).get("lyrics"):
@@ -81,7 +86,7 @@ async def search_genius(artist: str, track: str) -> Optional[str]:
     
     try:
         # Ищем песню через API Genius
-        search_result = await asyncio.to_thread(genius.search_song, track, artist)
+        search_result = await metadata_executor.run(genius.search_song, track, artist)
         if search_result:
             # Получаем текст песни и очищаем его
             lyrics = search_result.lyrics
@@ -98,12 +103,12 @@ async def search_yandex_music(artist: str, track: str) -> Optional[str]:
     
     try:
         # Ищем трек по названию и исполнителю
-        search_result = await asyncio.to_thread(yandex_client.search, f"{track} {artist}", type_="track")
+        search_result = await metadata_executor.run(yandex_client.search, f"{track} {artist}", type_="track")
         if search_result and search_result.tracks and search_result.tracks.results:
             # Берем первый найденный трек
             best_track = search_result.tracks.results[0]
             # Получаем дополнительную информацию о треке, включая текст
-            supplement = await asyncio.to_thread(best_track.get_supplement)
+            supplement = await metadata_executor.run(best_track.get_supplement)
             if supplement and supplement.lyrics:
                 return clean_lyrics(supplement.lyrics.full_lyrics)
         return None
@@ -111,6 +116,7 @@ async def search_yandex_music(artist: str, track: str) -> Optional[str]:
         logging.error(f"Yandex Music error for {artist} - {track}: {e}")
         return None
 
+@traced()
 async def search_lyrics_parallel(artist: str, title: str, timeout: float = 10.0) -> Optional[str]:
     """
     Search for lyrics using multiple services in parallel with timeout.
@@ -133,14 +139,25 @@ async def search_lyrics_parallel(artist: str, title: str, timeout: float = 10.0)
     
     async def _search_with_timeout(priority: int, search_func, artist: str, title: str) -> tuple[int, Optional[str]]:
         """Wrapper for search function with timeout"""
+        started = time.perf_counter()
+        outcome = 'empty'
         try:
             lyrics = await asyncio.wait_for(search_func(artist, title), timeout=timeout)
             if lyrics:
+                outcome = 'found'
                 return priority, lyrics
         except asyncio.TimeoutError:
+            outcome = 'timeout'
             logging.warning(f"{search_func.__name__} timed out after {timeout}s")
+        except asyncio.CancelledError:
+            # Другой провайдер ответил раньше
+            outcome = 'cancelled'
+            raise
         except Exception as e:
+            outcome = 'error'
             logging.error(f"{search_func.__name__} error: {e}")
+        finally:
+            LYRICS_SECONDS.observe(time.perf_counter() - started, provider=search_func.__name__.replace('search_', ''), outcome=outcome)
         return priority, None
 
     # Create tasks for all search functions
@@ -0,0 +1,153 @@
+# ranking.py
+# Ранжирование и склейка дублей между поиском и клавиатурой. VK и SoundCloud выдают одну и ту
+# же песню по много раз (перезаливы, "Official Video", перестановка исполнителя и названия),
+# и оригинал тонул на третьей-четвертой странице.
+#  1. Исполнитель/название нормализуются (транслит, скобки, feat., пунктуация), версии вроде
+#     remix/live/cover выделяются отдельно - это другая песня, а не дубль.
+#  2. Одинаковые песни с длительностью в пределах DURATION_TOLERANCE склеиваются в кластер,
+#     от кластера остается один трек - с лучшим счетом.
+#  3. Счет: совпадение с запросом + правдоподобность длительности + надежность источника
+#     + популярность (размер кластера) - штраф за версию, которую не просили.
+# Все за один проход со словарями, 600 кандидатов считаются за миллисекунды.
+import re
+import math
+from dataclasses import dataclass
+from statistics import median
+from typing import Iterable
+
+from src.core.utils import extract_title_and_artist
+from src.search.search_cache import normalize_query
+
+DURATION_TOLERANCE = 4  # секунд: разница между перезаливами одного трека
+SOURCE_WEIGHT = {'vk': 1.0, 'soundcloud': 0.8}  # у SoundCloud больше превью и перезаливов
+VERSION_MARKERS = (
+    'remix', 'cover', 'live', 'karaoke', 'instrumental', 'acoustic', 'sped up', 'speed up',
+    'slowed', 'reverb', 'nightcore', '8d', 'bass boosted', 'mashup', 'minus', 'минус', 'ремикс',
+)
+
+_MARKER_RE = re.compile(r'\b(' + '|'.join(re.escape(m) for m in VERSION_MARKERS) + r')\b')
+_BRACKETS_RE = re.compile(r'[\(\[\{].*?[\)\]\}]')
+_FEAT_RE = re.compile(r'\s(feat|ft|prod)\.?\s.*$')
+
+# Веса слагаемых счета
+W_MATCH, W_DURATION, W_SOURCE, W_POPULARITY, W_VERSION = 1.0, 0.2, 0.2, 0.1, 0.3
+
+
+@dataclass(slots=True)
+class _Candidate:
+    track: dict
+    order: int
+    song: tuple          # (исполнитель/название в каноничном порядке, версии)
+    duration: float
+    tokens: frozenset
+    markers: frozenset
+    cluster: int = -1
+    score: float = 0.0
+
+
+def _markers(text: str) -> frozenset:
+    return frozenset(_MARKER_RE.findall(text.lower()))
+
+
+def _clean(text: str) -> str:
+    text = _BRACKETS_RE.sub(' ', (text or '').lower())
+    text = _FEAT_RE.sub('', text)
+    return normalize_query(text)
+
+
+def _split(track: dict) -> tuple[str, str]:
+    """Исполнитель и название; "Исполнитель - Название" в поле названия разбирается"""
+    title = track.get('title') or ''
+    artist = track.get('channel') or track.get('artist') or ''
+    if not artist or artist == 'Unknown Artist' or ' - ' in title:
+        title, artist = extract_title_and_artist(title)
+    return artist, title
+
+
+def _candidate(track: dict, order: int) -> _Candidate:
+    artist, title = _split(track)
+    markers = _markers(f"{artist} {title}")
+    artist, title = _clean(artist), _clean(title)
+    # порядок не важен: "A - B" и "B - A" у SoundCloud - одна песня
+    song = (tuple(sorted((artist, title))), markers)
+    return _Candidate(
+        track=track,
+        order=order,
+        song=song,
+        duration=float(track.get('duration') or 0),
+        tokens=frozenset(f"{artist} {title}".split()),
+        markers=markers,
+    )
+
+
+def _cluster(candidates: list[_Candidate]) -> dict[int, list[_Candidate]]:
+    """Одна песня + близкая длительность = один кластер"""
+    by_song: dict[tuple, list[_Candidate]] = {}
+    for c in candidates:
+        by_song.setdefault(c.song, []).append(c)
+    clusters: dict[int, list[_Candidate]] = {}
+    for group in by_song.values():
+        group.sort(key=lambda c: c.duration)
+        start = None
+        for c in group:
+            # длительность неизвестна (0) - в первый кластер песни
+            if start is None or (c.duration and c.duration - start > DURATION_TOLERANCE):
+                cluster_id = len(clusters)
+                clusters[cluster_id] = []
+                start = c.duration
+            c.cluster = cluster_id
+            clusters[cluster_id].append(c)
+    return clusters
+
+
+def _score(candidates: list[_Candidate], clusters: dict[int, list[_Candidate]], query: str):
+    query_tokens = frozenset(normalize_query(_FEAT_RE.sub('', query.lower())).split())
+    query_markers = _markers(query)
+    # "Настоящая" длительность песни - медиана по всем ее копиям: превью и нарезки отличаются
+    song_durations: dict[tuple, list[float]] = {}
+    for c in candidates:
+        if c.duration:
+            song_durations.setdefault(c.song[0], []).append(c.duration)
+    song_median = {song: median(values) for song, values in song_durations.items()}
+
+    for c in candidates:
+        match = len(query_tokens & c.tokens) / len(query_tokens) if query_tokens else 0.0
+        expected = song_median.get(c.song[0])
+        if c.duration and expected:
+            plausibility = 1.0 - min(1.0, abs(c.duration - expected) / expected)
+        else:
+            plausibility = 0.5
+        popularity = min(1.0, math.log2(len(clusters[c.cluster])) / 3)
+        unwanted_version = 1.0 if c.markers - query_markers else 0.0
+        c.score = (W_MATCH * match + W_DURATION * plausibility
+                   + W_SOURCE * SOURCE_WEIGHT.get(c.track.get('source'), 0.5)
+                   + W_POPULARITY * popularity - W_VERSION * unwanted_version)
+
+
+def rank_tracks(tracks: Iterable[dict], query: str, pinned: Iterable[dict] = ()) -> list[dict]:
+    """
+    Убирает дубли и сортирует результаты по релевантности.
+
+    Args:
+        tracks: Все кандидаты от всех источников (словари треков не меняются)
+        query: Запрос пользователя
+        pinned: Уже показанные треки: их кластеры в выдачу не попадают, чтобы не повторяться
+    Returns:
+        По одному лучшему треку на кластер, от лучшего к худшему
+    """
+    pinned = list(pinned)
+    pinned_ids = {id(t) for t in pinned}
+    candidates = [_candidate(t, i) for i, t in enumerate(tracks)]
+    # Закрепленные треки участвуют в кластеризации, даже если их нет среди tracks
+    known = {id(c.track) for c in candidates}
+    candidates += [_candidate(t, len(candidates) + i) for i, t in enumerate(pinned) if id(t) not in known]
+    clusters = _cluster(candidates)
+    _score(candidates, clusters, query)
+
+    best = []
+    for members in clusters.values():
+        if any(id(c.track) in pinned_ids for c in members):
+            continue
+        best.append(max(members, key=lambda c: (c.score, -c.order)))
+    best.sort(key=lambda c: (-c.score, c.order))
+    return [c.track for c in best]
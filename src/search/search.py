@@ -8,24 +8,46 @@ traceback.print_exc = lambda *args, **kwargs: None
 
 from src.core.config import YDL_AUDIO_OPTS, MIN_SONG_DURATION, MAX_SONG_DURATION
 from src.core.utils import extract_title_and_artist
-from src.search.vk_music import get_vk_service
+from src.core.executors import extract_executor
+from src.search.vk_music import get_vk_service, vk_track_id
+from src.monitoring.metrics import SEARCH_SECONDS, SEARCH_RESULTS
+from src.search.search_cache import cached_search
 
-async def search_soundcloud(query, max_results=50):
-    """Searches SoundCloud using yt-dlp"""
-    try:
-        search_opts = {
-            **YDL_AUDIO_OPTS,
-            'default_search': 'scsearch',
-            'max_downloads': max_results,
-            'extract_flat': True,
-        }
-        with yt_dlp.YoutubeDL(search_opts) as ydl:
-            info = ydl.extract_info(f"scsearch{max_results}:{query}", download=False)
-            if not info or 'entries' not in info:
-                return []
+def _soundcloud_entries(query, max_results, offset=0):
+    """Blocking yt-dlp search, runs in an executor.
+    У scsearch нет смещения, поэтому берем offset + max_results и отрезаем уже виденное:
+    это все равно один запрос к API (до 200 записей), а на первой странице - всего 10-20."""
+    total = offset + max_results
+    search_opts = {
+        **YDL_AUDIO_OPTS,
+        'default_search': 'scsearch',
+        'max_downloads': total,
+        'extract_flat': True,
+    }
+    with yt_dlp.YoutubeDL(search_opts) as ydl:
+        info = ydl.extract_info(f"scsearch{total}:{query}", download=False)
+    if not info or 'entries' not in info:
+        return []
+    return list(info['entries'] or [])[offset:]
+
+def _cover_url(entry):
+    """Самая маленькая обложка, из которой еще выйдет превью Telegram 320x320"""
+    thumbs = [t for t in entry.get('thumbnails') or [] if t.get('url')]
+    fitting = [t for t in thumbs if (t.get('width') or 0) >= 300]
+    if fitting:
+        return min(fitting, key=lambda t: t['width'])['url']
+    return entry.get('thumbnail') or (thumbs[-1]['url'] if thumbs else None)
+
+@cached_search('soundcloud')
+async def search_soundcloud(query, max_results=50, offset=0):
+    """Searches SoundCloud using yt-dlp. offset - сколько результатов пропустить (для постраничной загрузки)"""
+    with SEARCH_SECONDS.time(source='soundcloud'):
+        try:
+            # yt-dlp блокирующий: в executor, чтобы VK и SoundCloud искали параллельно
+            entries = await extract_executor.run(_soundcloud_entries, query, max_results, offset)
 
             results = []
-            for entry in info['entries'] or []:
+            for entry in entries:
                 if not entry:
                     continue
                 duration = entry.get('duration', 0)
@@ -49,34 +71,41 @@ async def search_soundcloud(query, max_results=50):
                     'url': entry.get('webpage_url', entry.get('url', '')),
                     'duration': duration,
                     'source': 'soundcloud',
+                    'track_id': entry.get('id'),
+                    'cover_url': _cover_url(entry),
                 })
+            SEARCH_RESULTS.inc(len(results), source='soundcloud')
             return results
-    except Exception as e:
-        print(f"An error occurred during SoundCloud search: {e}")
-        traceback.print_exc()
-        return [] 
+        except Exception as e:
+            print(f"An error occurred during SoundCloud search: {e}")
+            traceback.print_exc()
+            return [] 
 
-async def search_vk(query: str, max_results: int = 50):
+@cached_search('vk')
+async def search_vk(query: str, max_results: int = 50, offset: int = 0):
     """Searches VK for tracks using vkpymusic, returns list of dicts (title, channel, url, duration, source)."""
-    try:
-        service = get_vk_service()
-        tracks = service.search_songs_by_text(query, count=max_results)
-        results = []
-        for track in tracks:
-            artist = getattr(track, 'artist', 'Unknown Artist')
-            title = getattr(track, 'title', 'Unknown Title')
-            duration = getattr(track, 'duration', 0)
-            url = getattr(track, 'url', None) or getattr(track, 'download_url', None) or ''
-            if not url:
-                continue
-            results.append({
-                'title': title,
-                'channel': artist,
-                'url': url,
-                'duration': duration,
-                'source': 'vk',
-            })
-        return results
-    except Exception as e:
-        print(f"An error occurred during VK search: {e}")
-        return []
\ No newline at end of file
+    with SEARCH_SECONDS.time(source='vk'):
+        try:
+            service = get_vk_service()
+            tracks = await extract_executor.run(service.search_songs_by_text, query, count=max_results, offset=offset)
+            results = []
+            for track in tracks:
+                artist = getattr(track, 'artist', 'Unknown Artist')
+                title = getattr(track, 'title', 'Unknown Title')
+                duration = getattr(track, 'duration', 0)
+                url = getattr(track, 'url', None) or getattr(track, 'download_url', None) or ''
+                if not url:
+                    continue
+                results.append({
+                    'title': title,
+                    'channel': artist,
+                    'url': url,
+                    'duration': duration,
+                    'source': 'vk',
+                    'track_id': vk_track_id(track),
+                })
+            SEARCH_RESULTS.inc(len(results), source='vk')
+            return results
+        except Exception as e:
+            print(f"An error occurred during VK search: {e}")
+            return []
\ No newline at end of file
@@ -0,0 +1,101 @@
+# search_cache.py
+# Кэш результатов поиска. В группах один и тот же трендовый трек ищут пачками, и каждый
+# запрос заново гонял SoundCloud и VK на сотни результатов. Ключ - нормализованный запрос
+# (регистр, пробелы, пунктуация, транслит), источник, лимит и смещение страницы. Записи живут SEARCH_CACHE_TTL
+# секунд, всего их не больше SEARCH_CACHE_SIZE. Одинаковые запросы, пришедшие одновременно,
+# ждут один поиск. Результаты хранятся кортежем тех же словарей, что уходят в search_results,
+# поэтому страницы разных поисков ссылаются на одни объекты, а не на копии.
+import re
+import time
+import functools
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from src.core.config import SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE
+from src.core.single_flight import SingleFlight
+from src.monitoring.metrics import CACHE_REQUESTS
+
+_TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z',
+    'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r',
+    'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'c', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch',
+    'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    'і': 'i', 'ї': 'i', 'є': 'e', 'ґ': 'g',
+})
+
+
+def normalize_query(query: str) -> str:
+    """Ключ запроса: регистр, пунктуация, пробелы и кириллица (транслитом) сводятся к одному виду"""
+    text = unicodedata.normalize('NFKC', query or '').lower().translate(_TRANSLIT)
+    text = re.sub(r'[^\w]+', ' ', text).replace('_', ' ')
+    return ' '.join(text.split())
+
+
+class SearchCache:
+    """TTL + LRU кэш результатов поиска с объединением одинаковых запросов"""
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[float, tuple]] = OrderedDict()  # ключ -> (когда, результаты)
+        self._flights = SingleFlight('search')
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key: tuple):
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        stored_at, results = item
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def _put(self, key: tuple, results: tuple):
+        self._entries[key] = (time.monotonic(), results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, source: str, query: str, limit: int, fetch: Callable[[], Awaitable[list]], offset: int = 0) -> tuple:
+        """Результаты из кэша или fetch(). Пустой результат не кэшируется: это может быть сбой источника."""
+        if not self.enabled:
+            return tuple(await fetch())
+        key = (source, normalize_query(query), limit, offset)
+        results = self._get(key)
+        if results is not None:
+            CACHE_REQUESTS.inc(cache='search', result='hit')
+            return results
+        CACHE_REQUESTS.inc(cache='search', result='miss')
+
+        async def run():
+            found = tuple(await fetch())
+            if found:
+                self._put(key, found)
+            return found
+
+        return await self._flights.do(repr(key), run)
+
+    def clear(self):
+        self._entries.clear()
+
+
+search_cache = SearchCache()
+
+
+def cached_search(source: str):
+    """Оборачивает функцию поиска (query, max_results, offset) в общий кэш"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(query, max_results=50, offset=0):
+            return list(await search_cache.get(source, query, max_results, lambda: fn(query, max_results, offset), offset))
+        return wrapper
+    return decorator
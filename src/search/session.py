@@ -0,0 +1,199 @@
+# session.py
+# Прогрессивный поиск. Раньше клавиатура появлялась только после самого медленного источника,
+# и каждый источник сразу тянул MAX_TRACKS результатов, хотя почти никто не уходит дальше
+# первой страницы. Теперь каждый источник читается курсором порциями по странице: первая
+# страница показывается, как только какой-нибудь источник ее заполнил, следующие порции
+# грузятся, когда пользователь доходит до последней загруженной страницы.
+# Все дописывается в тот же список (он же лежит в search_results), а заголовок "найдено N"
+# правится на месте. Уже показанные строки не двигаются: токены кнопок t./p. ссылаются на индексы,
+# поэтому дубли и ранжирование (ranking.py) пересчитываются только для еще не показанных.
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from src.core.config import SEARCH_SESSION_TTL, SEARCH_SESSION_MAX
+from src.search.search import search_soundcloud, search_vk
+from src.search.ranking import rank_tracks
+
+logger = logging.getLogger(__name__)
+
+# Источник -> функция поиска (query, max_results, offset)
+SOURCES: dict[str, Callable[[str, int, int], Awaitable[list]]] = {
+    'vk': search_vk,
+    'soundcloud': search_soundcloud,
+}
+
+
+class SourceCursor:
+    """Позиция постраничного чтения одного источника"""
+
+    def __init__(self, source: str, search: Callable[[str, int, int], Awaitable[list]], limit: int):
+        self.source = source
+        self.search = search
+        self.limit = limit          # больше этого с источника не берем (MAX_TRACKS)
+        self.offset = 0
+        self.exhausted = False
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def busy(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def fetch(self, query: str, batch: int) -> Optional[asyncio.Task]:
+        """Запускает загрузку следующей порции, если она еще не идет"""
+        if self.exhausted or self.busy:
+            return None
+        count = min(batch, self.limit - self.offset)
+        self.task = asyncio.create_task(self.search(query, count, self.offset))
+        self.offset += count
+        return self.task
+
+
+class SearchSession:
+    """Результаты поиска, которые догружаются, пока пользователь уже смотрит первую страницу"""
+
+    def __init__(self, query: str, limit: int, per_page: int):
+        self.query = query
+        self.per_page = per_page
+        self.tracks: list[dict] = []  # тот же объект кладется в search_results[sid]
+        self.page = 0                 # страница, которая сейчас показана
+        self.on_update: Optional[Callable[['SearchSession'], None]] = None
+        self._shown = 0               # сколько строк уже побывало на экране
+        self._candidates: list[dict] = []  # все результаты источников, включая дубли
+        self._cursors = [SourceCursor(source, search, limit) for source, search in SOURCES.items()]
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        """Все источники дочитаны до конца"""
+        return all(c.exhausted for c in self._cursors)
+
+    @property
+    def loading(self) -> bool:
+        return any(c.busy for c in self._cursors)
+
+    def start(self):
+        self._fetch_more()
+        return self
+
+    def _fetch_more(self):
+        for cursor in self._cursors:
+            task = cursor.fetch(self.query, self.per_page)
+            if task:
+                task.add_done_callback(lambda t, cursor=cursor: self._arrived(cursor, t))
+
+    def _arrived(self, cursor: SourceCursor, task: asyncio.Task):
+        found = []
+        if not task.cancelled():
+            if task.exception() is not None:
+                logger.warning(f"{cursor.source} search failed: {task.exception()}")
+            else:
+                found = task.result()
+        # Пустая порция (конец выдачи или ошибка) - источник кончился. Неполная порция -
+        # еще нет: часть записей отсеивается по длительности.
+        if not found or cursor.offset >= cursor.limit:
+            cursor.exhausted = True
+        if found:
+            self._merge(found)
+        self._changed.set()
+        if self.on_update and (found or self.done):
+            self.on_update(self)
+
+    def _merge(self, found: list[dict]):
+        """Добавляет результаты, не трогая уже показанные строки"""
+        self._candidates.extend(found)
+        shown = self.tracks[:self._shown]
+        self.tracks[self._shown:] = rank_tracks(self._candidates, self.query, pinned=shown)
+
+    def shown(self, page: int):
+        """Страница page отрисована: ее строки больше не переставляются.
+        Если это последняя загруженная страница - заранее грузим следующую порцию."""
+        self.page = page
+        self._shown = max(self._shown, min(len(self.tracks), (page + 1) * self.per_page))
+        if (page + 2) * self.per_page > len(self.tracks):
+            self._fetch_more()
+
+    async def ensure(self, count: int):
+        """Ждет, пока результатов станет не меньше count или все источники кончатся"""
+        while len(self.tracks) < count and not self.done:
+            if not self.loading:
+                self._fetch_more()
+            self._changed.clear()
+            await self._changed.wait()
+
+    async def first_page(self):
+        await self.ensure(self.per_page)
+
+    def cancel(self):
+        """Останавливает догрузку: курсоры больше не читают, ждущие ensure() выходят"""
+        for cursor in self._cursors:
+            cursor.exhausted = True
+            if cursor.busy:
+                cursor.task.cancel()
+        self._changed.set()
+
+
+class SessionRegistry:
+    """
+    Живые сессии поиска этого процесса. Сессия живет ttl секунд с последнего обращения, всего их
+    не больше max_size, у пользователя - одна (новый поиск останавливает прошлый). Вытесненная
+    сессия останавливается (cancel), ее результаты остаются в state_backend, и кнопки работают дальше.
+    """
+
+    def __init__(self, ttl: float = SEARCH_SESSION_TTL, max_size: int = SEARCH_SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions: OrderedDict[int, tuple[SearchSession, int, float]] = OrderedDict()  # sid -> (сессия, user_id, истекает)
+        self._by_user: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, sid: int) -> Optional[SearchSession]:
+        self._expire()
+        item = self._sessions.get(sid)
+        if item is None:
+            return None
+        session, user_id, _ = item
+        self._sessions[sid] = (session, user_id, time.monotonic() + self.ttl)
+        self._sessions.move_to_end(sid)
+        return session
+
+    def add(self, sid: int, session: SearchSession, user_id: int):
+        self.cancel_user(user_id)
+        self._sessions[sid] = (session, user_id, time.monotonic() + self.ttl)
+        self._by_user[user_id] = sid
+        self._expire()
+        while len(self._sessions) > self.max_size:
+            self._drop(next(iter(self._sessions)))
+
+    def pop(self, sid: int):
+        """Сессия дочитана до конца - просто забываем ее"""
+        item = self._sessions.pop(sid, None)
+        if item and self._by_user.get(item[1]) == sid:
+            del self._by_user[item[1]]
+
+    def cancel_user(self, user_id: int):
+        sid = self._by_user.get(user_id)
+        if sid is not None:
+            self._drop(sid)
+
+    def _drop(self, sid: int):
+        item = self._sessions.get(sid)
+        self.pop(sid)
+        if item:
+            item[0].cancel()
+
+    def _expire(self):
+        now = time.monotonic()
+        # get() переносит сессию в конец, так что порядок - по сроку
+        while self._sessions:
+            sid, (_, _, expires) = next(iter(self._sessions.items()))
+            if expires > now:
+                break
+            self._drop(sid)
+
+
+search_sessions = SessionRegistry()
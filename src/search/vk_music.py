@@ -43,6 +43,19 @@ def search_tracks(query, count=10):
     service = get_vk_service()
     return service.search_songs_by_text(query, count=count)
 
+def vk_track_id(track):
+    """
+    Стабильный id трека VK вида owner_track (ссылки на mp3 подписаны и меняются)
+    
+    Returns:
+        str | None: id трека или None, если у объекта нет нужных полей
+    """
+    owner_id = getattr(track, 'owner_id', None)
+    track_id = getattr(track, 'track_id', None)
+    if owner_id is None or track_id is None:
+        return None
+    return f"{owner_id}_{track_id}"
+
 def download_track(track, download_dir=None):
     """
     Скачивание трека
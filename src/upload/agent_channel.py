@@ -0,0 +1,114 @@
+# agent_channel.py
+# Локальный канал между Telethon агентом и ботом.
+# Агент отправляет файл в чат бота с коротким тегом задания в подписи, бот по тегу
+# находит ожидающее задание и возвращает file_id тому, кто его ждет.
+# Никакого JSON в подписи и никакого разбора чужих сообщений.
+# При нескольких воркерах апдейт с файлом может прийти не в тот процесс, что ждет задание:
+# тогда file_id передается через state_backend, а ждущий забирает его оттуда (wait()).
+import asyncio
+import logging
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+from aiogram import types
+
+from src.core.config import TELETHON_HANDOFF_TIMEOUT
+from src.core.state import state_backend
+
+logger = logging.getLogger(__name__)
+
+CAPTION_PREFIX = "#agent:"
+HANDOFF_POLL_INTERVAL = 0.5  # секунд между проверками state_backend, пока файл не пришел в этот процесс
+
+
+@dataclass
+class AgentFile:
+    """Результат задания: file_id загруженного файла в Bot API"""
+    job_id: str
+    file_id: str
+    file_type: str
+    chat_id: int
+    message_id: int
+
+
+class AgentChannel:
+    """Реестр заданий агента: job_id -> Future[AgentFile]"""
+
+    def __init__(self):
+        self.agent_user_id: Optional[int] = None
+        self._pending: dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def caption_for(job_id: str) -> str:
+        return f"{CAPTION_PREFIX}{job_id}"
+
+    async def set_agent_user(self, user_id: int):
+        """Аккаунт агента известен процессу, где запущен Telethon; остальные воркеры берут его из state_backend"""
+        self.agent_user_id = user_id
+        await state_backend.save_agent_user(user_id)
+
+    def expect(self, job_id: str) -> asyncio.Future:
+        """Регистрирует задание до отправки файла, чтобы не пропустить быстрый апдейт"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = future
+        return future
+
+    async def wait(self, job_id: str, future: asyncio.Future) -> AgentFile:
+        """Ждет файл задания: из этого процесса через future, из других воркеров - через state_backend"""
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=HANDOFF_POLL_INTERVAL)
+            if done:
+                return future.result()
+            result = await state_backend.take_handoff(job_id)
+            if result is not None:
+                if 'error' in result:
+                    raise RuntimeError(result['error'])
+                return AgentFile(**result)
+
+    def discard(self, job_id: str):
+        future = self._pending.pop(job_id, None)
+        if future and not future.done():
+            future.cancel()
+
+    async def is_agent_message(self, message: types.Message) -> bool:
+        """Фильтр для хендлера: сообщение от аккаунта агента с тегом задания"""
+        if message.from_user is None or not message.caption or not message.caption.startswith(CAPTION_PREFIX):
+            return False
+        if self.agent_user_id is None:
+            self.agent_user_id = await state_backend.load_agent_user()
+        return message.from_user.id == self.agent_user_id
+
+    async def resolve(self, message: types.Message) -> bool:
+        """Передает file_id из сообщения агента ожидающему заданию - здесь или в другом воркере"""
+        job_id = message.caption[len(CAPTION_PREFIX):].strip()
+        future = self._pending.pop(job_id, None)
+        if future is not None and future.done():
+            logger.warning(f"[AGENT] Job {job_id} is no longer waiting")
+            return False
+
+        if message.audio:
+            file_id, file_type = message.audio.file_id, "audio"
+        elif message.video:
+            file_id, file_type = message.video.file_id, "video"
+        elif message.photo:
+            file_id, file_type = message.photo[-1].file_id, "photo"  # Get the largest photo
+        elif message.document:
+            file_id, file_type = message.document.file_id, "document"
+        else:
+            error = "Сообщение агента не содержит файла"
+            if future is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                await state_backend.publish_handoff(job_id, {'error': error}, TELETHON_HANDOFF_TIMEOUT)
+            return False
+
+        result = AgentFile(job_id, file_id, file_type, message.chat.id, message.message_id)
+        if future is not None:
+            future.set_result(result)
+        else:
+            # Задание ждет другой воркер
+            await state_backend.publish_handoff(job_id, asdict(result), TELETHON_HANDOFF_TIMEOUT)
+        return True
+
+
+agent_channel = AgentChannel()
@@ -0,0 +1,145 @@
+# fast_upload.py
+# Параллельная загрузка больших файлов по частям через несколько MTProto соединений
+# (подход FastTelethon). Части раздаются воркерам из общей очереди, упавшая часть
+# переотправляется, поэтому сбой одного соединения не перезапускает весь файл.
+import os
+import asyncio
+import hashlib
+import logging
+from typing import Optional, Callable, Awaitable, Union
+
+from telethon import TelegramClient, helpers
+from telethon.network import MTProtoSender
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+logger = logging.getLogger(__name__)
+
+# Файлы больше этого размера Telegram принимает только через SaveBigFilePart
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+MAX_PART_SIZE_KB = 512
+
+
+class ParallelUploader:
+    """
+    Загружает файл частями через пул отдельных MTProto соединений к домашнему DC.
+
+    Args:
+        client: Подключенный и авторизованный TelegramClient
+        connections: Количество параллельных соединений
+        part_size_kb: Размер части в КБ (должен делить 512 без остатка)
+        part_retries: Сколько раз переотправлять одну часть перед ошибкой
+    """
+
+    def __init__(self, client: TelegramClient, connections: int = 4,
+                 part_size_kb: int = MAX_PART_SIZE_KB, part_retries: int = 5):
+        if part_size_kb > MAX_PART_SIZE_KB or (MAX_PART_SIZE_KB * 1024) % (part_size_kb * 1024) != 0:
+            raise ValueError("Размер части должен быть делителем 512КБ")
+        self.client = client
+        self.connections = max(1, connections)
+        self.part_size = part_size_kb * 1024
+        self.part_retries = part_retries
+
+    async def _create_sender(self) -> MTProtoSender:
+        """Новое соединение к домашнему DC с ключом авторизации основной сессии"""
+        dc = await self.client._get_dc(self.client.session.dc_id)
+        sender = MTProtoSender(self.client.session.auth_key, loggers=self.client._log)
+        await sender.connect(self.client._connection(
+            dc.ip_address,
+            dc.port,
+            dc.id,
+            loggers=self.client._log,
+            proxy=self.client._proxy,
+            local_addr=self.client._local_addr
+        ))
+        return sender
+
+    async def upload(self, file_path: str,
+                     progress_callback: Optional[Callable[[int, int], Awaitable[None]]] = None
+                     ) -> Union[InputFile, InputFileBig]:
+        """
+        Загружает файл и возвращает InputFile/InputFileBig для send_file.
+
+        Args:
+            file_path: Путь к файлу
+            progress_callback: async (sent_bytes, total_bytes)
+        """
+        file_size = os.path.getsize(file_path)
+        total_parts = max(1, (file_size + self.part_size - 1) // self.part_size)
+        is_big = file_size > BIG_FILE_THRESHOLD
+        file_id = helpers.generate_random_long()
+        file_name = os.path.basename(file_path)
+
+        pending: asyncio.Queue = asyncio.Queue()
+        for part_index in range(total_parts):
+            pending.put_nowait(part_index)
+        attempts = [0] * total_parts
+        uploaded_bytes = 0
+
+        def read_part(part_index: int) -> bytes:
+            with open(file_path, 'rb') as f:
+                f.seek(part_index * self.part_size)
+                return f.read(self.part_size)
+
+        def make_request(part_index: int, data: bytes):
+            if is_big:
+                return SaveBigFilePartRequest(file_id, part_index, total_parts, data)
+            return SaveFilePartRequest(file_id, part_index, data)
+
+        async def worker(worker_idx: int):
+            nonlocal uploaded_bytes
+            sender = await self._create_sender()
+            try:
+                while True:
+                    try:
+                        part_index = pending.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    data = await asyncio.to_thread(read_part, part_index)
+                    try:
+                        ok = await sender.send(make_request(part_index, data))
+                        if not ok:
+                            raise RuntimeError(f"Telegram отклонил часть {part_index}")
+                    except Exception as e:
+                        attempts[part_index] += 1
+                        if attempts[part_index] > self.part_retries:
+                            raise RuntimeError(f"Часть {part_index} не загрузилась после {self.part_retries} попыток: {e}")
+                        logger.warning(f"[FastUpload] Part {part_index} failed on connection {worker_idx} "
+                                       f"(attempt {attempts[part_index]}): {e}; reconnecting")
+                        pending.put_nowait(part_index)
+                        await sender.disconnect()
+                        await asyncio.sleep(min(2 ** attempts[part_index], 10))
+                        sender = await self._create_sender()
+                        continue
+                    uploaded_bytes += len(data)
+                    if progress_callback:
+                        await progress_callback(uploaded_bytes, file_size)
+            finally:
+                await sender.disconnect()
+
+        # md5 нужен только для маленьких файлов, считаем его параллельно с отправкой
+        md5_task = None if is_big else asyncio.create_task(asyncio.to_thread(self._file_md5, file_path))
+        workers = [asyncio.create_task(worker(i)) for i in range(min(self.connections, total_parts))]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if md5_task:
+                md5_task.cancel()
+            raise
+
+        logger.info(f"[FastUpload] Uploaded {file_name}: {file_size} bytes in {total_parts} parts "
+                    f"over {len(workers)} connections")
+        if is_big:
+            return InputFileBig(file_id, total_parts, file_name)
+        return InputFile(file_id, total_parts, file_name, await md5_task)
+
+    @staticmethod
+    def _file_md5(file_path: str) -> str:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
@@ -0,0 +1,107 @@
+# media_group.py
+# Отправка пачки аудио альбомами sendMediaGroup. Плейлист уходил по одному send_audio на трек:
+# 150 треков в группе - 150 запросов и 150 сообщений под лимитом 20 сообщений в минуту.
+# Теперь треки режутся на альбомы до 10 файлов (и до MEDIA_GROUP_MAX_MB за запрос, чтобы один
+# запрос не грузился бесконечно), альбомы ставятся в outbound все сразу и грузятся параллельно
+# в пределах его лимитов. Если Telegram отверг альбом (битый файл, слишком большой и т.п.),
+# треки этого альбома отправляются по одному, и теряется только тот, что не прошел и сам.
+# Сетевые ошибки и таймауты так не обрабатываются: альбом мог уже дойти, и повтор по одному
+# продублировал бы треки в чате.
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramEntityTooLarge
+from aiogram.types import FSInputFile, BufferedInputFile, InputMediaAudio
+
+from src.core.bot_instance import bot
+from src.core.outbound import outbound
+from src.core.config import MEDIA_GROUP_MAX_MB, MEDIA_GROUP_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GROUP_SIZE = 10  # максимум Telegram
+
+
+@dataclass
+class AudioItem:
+    path: str
+    title: Optional[str] = None
+    performer: Optional[str] = None
+    duration: Optional[int] = None
+    thumbnail: Optional[bytes] = None  # JPEG из cover_art
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def _thumbnail(self):
+        return BufferedInputFile(self.thumbnail, filename='cover.jpg') if self.thumbnail else None
+
+    def media(self) -> InputMediaAudio:
+        return InputMediaAudio(media=FSInputFile(self.path), title=self.title, performer=self.performer,
+                               duration=self.duration, thumbnail=self._thumbnail())
+
+
+def _chunks(items: list[AudioItem]) -> list[list[AudioItem]]:
+    """Альбомы по порядку: до MEDIA_GROUP_SIZE файлов и до MEDIA_GROUP_MAX_MB на запрос"""
+    limit = MEDIA_GROUP_MAX_MB * 1024 * 1024
+    chunks, current, current_size = [], [], 0
+    for item in items:
+        size = item.size
+        if current and (len(current) == MEDIA_GROUP_SIZE or current_size + size > limit):
+            chunks.append(current)
+            current, current_size = [], 0
+        current.append(item)
+        current_size += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def _send_one(chat_id, item: AudioItem, **kwargs) -> bool:
+    try:
+        await outbound.send(chat_id, lambda: bot.send_audio(
+            chat_id, FSInputFile(item.path), title=item.title, performer=item.performer,
+            duration=item.duration, thumbnail=item._thumbnail(), **kwargs
+        ), upload_bytes=item.size)
+        return True
+    except Exception as e:
+        logger.warning(f"Could not send {item.path} to {chat_id}: {e}")
+        return False
+
+
+async def _send_chunk(chat_id, chunk: list[AudioItem], **kwargs) -> int:
+    if len(chunk) > 1:
+        try:
+            await outbound.send(chat_id, lambda: bot.send_media_group(chat_id, [item.media() for item in chunk],
+                                                                      request_timeout=MEDIA_GROUP_TIMEOUT, **kwargs),
+                                upload_bytes=sum(item.size for item in chunk))
+            return len(chunk)
+        except (TelegramBadRequest, TelegramEntityTooLarge) as e:
+            # Telegram отверг запрос целиком - в чат ничего не ушло
+            logger.warning(f"Media group of {len(chunk)} to {chat_id} rejected, sending one by one: {e}")
+    sent = 0
+    for item in chunk:
+        sent += await _send_one(chat_id, item, **kwargs)
+    return sent
+
+
+async def send_audio_group(chat_id, items: list[AudioItem], **kwargs) -> int:
+    """
+    Отправляет аудио альбомами. kwargs уходят в send_media_group/send_audio (например,
+    message_thread_id). Возвращает число доставленных треков. Сетевая ошибка альбома
+    пробрасывается, но только после того, как закончились остальные альбомы: файлы
+    нельзя освобождать, пока они еще грузятся.
+    """
+    items = [item for item in items if os.path.exists(item.path)]
+    if not items:
+        return 0
+    results = await asyncio.gather(*(_send_chunk(chat_id, chunk, **kwargs) for chunk in _chunks(items)),
+                                   return_exceptions=True)
+    errors = [r for r in results if isinstance(r, BaseException)]
+    if errors:
+        raise errors[0]
+    return sum(results)
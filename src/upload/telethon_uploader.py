@@ -0,0 +1,207 @@
+# telethon_uploader.py
+# Долгоживущий сервис отправки больших файлов через Telethon (MTProto).
+# Одно авторизованное соединение на весь процесс, задания идут через очередь,
+# одновременно обрабатывается не больше TELETHON_UPLOAD_PARALLELISM файлов.
+import os
+import time
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Awaitable
+
+from telethon import TelegramClient
+from telethon.sessions import StringSession
+from telethon.tl.types import DocumentAttributeAudio
+
+from src.core.config import (
+    API_ID, API_HASH, STRING_SESSION, TELETHON_BOT_USERNAME, TELETHON_UPLOAD_PARALLELISM,
+    TELETHON_UPLOAD_CONNECTIONS, TELETHON_UPLOAD_PART_SIZE_KB, TELETHON_UPLOAD_PART_RETRIES, TELETHON_FAST_UPLOAD_MIN_MB,
+    TELETHON_HANDOFF_TIMEOUT
+)
+from src.upload.fast_upload import ParallelUploader
+from src.upload.agent_channel import agent_channel, AgentFile
+from src.monitoring.metrics import UPLOAD_SECONDS, UPLOAD_BYTES
+
+logger = logging.getLogger(__name__)
+
+# progress_callback(sent_bytes, total_bytes)
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+
+@dataclass
+class UploadJob:
+    """Задание на отправку файла через агента"""
+    file_path: str
+    file_type: str  # audio / video / photo / document
+    title: str
+    performer: str
+    duration: int = 0
+    progress_callback: Optional[ProgressCallback] = None
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class TelethonUploader:
+    """
+    Сервис загрузки файлов через Telethon.
+
+    Клиент подключается один раз при первом задании и переиспользуется,
+    задания обрабатываются пулом воркеров поверх asyncio.Queue.
+    """
+
+    def __init__(self,
+                 api_id: Optional[str] = API_ID,
+                 api_hash: Optional[str] = API_HASH,
+                 string_session: Optional[str] = STRING_SESSION,
+                 bot_username: Optional[str] = TELETHON_BOT_USERNAME,
+                 parallelism: int = TELETHON_UPLOAD_PARALLELISM):
+        self.api_id = api_id
+        self.api_hash = api_hash
+        self.string_session = string_session
+        self.bot_username = bot_username
+        self.parallelism = max(1, parallelism)
+
+        self._client: Optional[TelegramClient] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._start_lock = asyncio.Lock()
+        self.active_jobs = 0
+
+    @property
+    def is_configured(self) -> bool:
+        return all([self.api_id, self.api_hash, self.string_session, self.bot_username])
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        """Подключает клиент и запускает воркеры (повторный вызов ничего не делает)"""
+        async with self._start_lock:
+            if self._workers:
+                return
+            if not self.is_configured:
+                raise RuntimeError("Не все переменные окружения (API_ID, API_HASH, STRING_SESSION, TELETHON_BOT_USERNAME) установлены.")
+            try:
+                api_id = int(self.api_id)
+            except ValueError:
+                raise RuntimeError("API_ID должен быть целым числом.")
+
+            client = TelegramClient(StringSession(self.string_session), api_id, self.api_hash)
+            logger.info("Подключение Telethon клиента...")
+            await client.connect()
+            if not await client.is_user_authorized():
+                await client.disconnect()
+                raise RuntimeError("Клиент Telethon не авторизован. Пожалуйста, убедитесь, что STRING_SESSION верен.")
+            # Бот принимает файлы только от этого аккаунта
+            await agent_channel.set_agent_user((await client.get_me()).id)
+            logger.info("Telethon клиент подключен.")
+
+            self._client = client
+            self._queue = asyncio.Queue()
+            self._workers = [
+                asyncio.create_task(self._worker(i)) for i in range(self.parallelism)
+            ]
+
+    async def stop(self):
+        """Останавливает воркеры и отключает клиент"""
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._client and self._client.is_connected():
+            logger.info("Отключение Telethon клиента...")
+            await self._client.disconnect()
+        self._client = None
+
+    async def submit(self, job: UploadJob) -> asyncio.Future:
+        """
+        Ставит файл в очередь на отправку.
+
+        Returns:
+            Future, который завершится сообщением Telethon после отправки
+            или исключением, если отправка не удалась.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        logger.info(f"[AGENT] Job {job.job_id} queued ({self._queue.qsize()} in queue): {job.file_path}")
+        return future
+
+    async def upload(self, job: UploadJob) -> AgentFile:
+        """
+        Отправляет файл через агента и ждет, пока бот получит его.
+
+        Returns:
+            AgentFile с file_id, по которому бот может переслать файл куда угодно
+        """
+        handoff = agent_channel.expect(job.job_id)
+        try:
+            await (await self.submit(job))
+            return await asyncio.wait_for(agent_channel.wait(job.job_id, handoff), TELETHON_HANDOFF_TIMEOUT)
+        finally:
+            agent_channel.discard(job.job_id)
+
+    async def _worker(self, worker_idx: int):
+        while True:
+            job, future = await self._queue.get()
+            self.active_jobs += 1
+            try:
+                if future.cancelled():
+                    continue
+                msg = await self._send(job)
+                if not future.done():
+                    future.set_result(msg)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"[AGENT] Job {job.job_id} failed on worker {worker_idx}: {e}", exc_info=True)
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.active_jobs -= 1
+                self._queue.task_done()
+
+    async def _send(self, job: UploadJob):
+        if not os.path.exists(job.file_path):
+            raise FileNotFoundError(f"Файл не найден: {job.file_path}")
+        if not self._client.is_connected():
+            logger.warning("Telethon клиент отключен, переподключаюсь...")
+            await self._client.connect()
+
+        attributes = []
+        if job.file_type == 'audio':
+            attributes.append(DocumentAttributeAudio(duration=job.duration, title=job.title, performer=job.performer))
+
+        logger.info(f"[AGENT] Отправка файла {job.file_path} боту @{self.bot_username} (job {job.job_id})")
+        file = job.file_path
+        size = os.path.getsize(job.file_path)
+        started = time.perf_counter()
+        # Большие файлы грузим частями через несколько соединений, send_file получает готовый InputFile
+        if size >= TELETHON_FAST_UPLOAD_MIN_MB * 1024 * 1024:
+            uploader = ParallelUploader(
+                self._client,
+                connections=TELETHON_UPLOAD_CONNECTIONS,
+                part_size_kb=TELETHON_UPLOAD_PART_SIZE_KB,
+                part_retries=TELETHON_UPLOAD_PART_RETRIES
+            )
+            file = await uploader.upload(job.file_path, progress_callback=job.progress_callback)
+
+        msg = await self._client.send_file(
+            self.bot_username,
+            file,
+            caption=agent_channel.caption_for(job.job_id),
+            attributes=attributes,
+            supports_streaming=True,  # Важно для больших файлов
+            progress_callback=job.progress_callback
+        )
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, kind='telethon')
+        UPLOAD_BYTES.inc(size, kind='telethon')
+        logger.info(f"[AGENT] Job {job.job_id} sent. Message ID: {msg.id}")
+        return msg
+
+
+# Общий экземпляр для бота
+telethon_uploader = TelethonUploader()